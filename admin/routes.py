@@ -1,3 +1,5 @@
+import json
+
 from flask import flash, redirect, render_template, request, session, url_for
 from flask_httpauth import HTTPBasicAuth
 
@@ -8,6 +10,7 @@ from .services import (
     get_dashboard_stats,
     get_paginated_reports,
     get_report_by_id,
+    get_system_health,
     update_prompt_content,
 )
 
@@ -87,8 +90,12 @@ def reports():
 @auth.login_required
 def report_detail(report_id):
     report = get_report_by_id(report_id)
+    stage_timings = json.loads(report.stage_timings) if report.stage_timings else {}
     return render_template(
-        "admin/report_detail.html", user=auth.current_user(), report=report
+        "admin/report_detail.html",
+        user=auth.current_user(),
+        report=report,
+        stage_timings=stage_timings,
     )
 
 
@@ -101,4 +108,6 @@ def templates():
 @admin_bp.route("/admin/system")
 @auth.login_required
 def system():
-    return render_template("admin/system.html", user=auth.current_user())
+    """System health page."""
+    health = get_system_health()
+    return render_template("admin/system.html", user=auth.current_user(), health=health)
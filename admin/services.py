@@ -4,22 +4,14 @@ from typing import Any, Dict, Tuple
 from flask_sqlalchemy.pagination import Pagination
 from sqlalchemy import func
 
+from core import resilience
 from core.database import db
+from core.gemini_governor import get_gemini_governor
 from core.models import ReportLog, ReportStatus
+from core.prompt_config import prompt_registry
 
-# Define a dictionary to hold the paths to the prompt files.
-# This makes it easier to manage and extend.
-PROMPT_FILES: Dict[str, str] = {
-    "system_instruction": os.path.join(
-        os.path.dirname(__file__), "..", "core", "system_instruction.txt"
-    ),
-    "style_guide": os.path.join(
-        os.path.dirname(__file__), "..", "core", "style_guide.txt"
-    ),
-    "schema_report": os.path.join(
-        os.path.dirname(__file__), "..", "core", "schema_report.txt"
-    ),
-}
+# The prompt files are owned by the prompt registry, which reloads them on change.
+PROMPT_FILES: Dict[str, str] = prompt_registry.paths
 
 
 def get_prompt_content(prompt_name: str) -> Tuple[str, bool]:
@@ -60,8 +52,8 @@ def update_prompt_content(prompt_name: str, content: str) -> Tuple[str, bool]:
         return f"Error: Prompt file for '{prompt_name}' not configured.", False
 
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        # Atomic replace; the registry reloads the prompts and refreshes the cache.
+        prompt_registry.write(prompt_name, content)
         # Capitalize and replace underscores for a user-friendly name in the message
         friendly_name = prompt_name.replace("_", " ").capitalize()
         return f"{friendly_name} prompt updated successfully.", True
@@ -132,11 +124,20 @@ def get_dashboard_stats() -> Dict[str, Any]:
         )
         avg_gen_time = avg_gen_time_query or 0
 
+        # Share of prompt tokens served from the prompt cache
+        prompt_tokens, cached_tokens = db.session.query(
+            func.sum(ReportLog.prompt_tokens), func.sum(ReportLog.cached_tokens)
+        ).one()
+        cached_prompt_share = (
+            f"{(cached_tokens or 0) / prompt_tokens:.0%}" if prompt_tokens else "N/A"
+        )
+
         return {
             "reports_generated": reports_generated,
             "api_cost_monthly_est": f"${total_cost:.2f}",
             "avg_generation_time_secs": f"{avg_gen_time:.0f}s",
             "processing_errors": processing_errors,
+            "cached_prompt_share": cached_prompt_share,
         }
     except Exception as e:
         # Log the error for debugging
@@ -147,4 +148,25 @@ def get_dashboard_stats() -> Dict[str, Any]:
             "api_cost_monthly_est": "$0.00",
             "avg_generation_time_secs": "N/A",
             "processing_errors": "N/A",
+            "cached_prompt_share": "N/A",
         }
+
+
+# --- System Health Services ---
+
+
+def get_system_health() -> Dict[str, Any]:
+    """
+    Reports the state of the Gemini circuit breakers and of the rate governor.
+
+    Breakers are kept per process, so the figures are those of the process
+    serving the page.
+    """
+    governor_stats = None
+    governor = get_gemini_governor()
+    if governor is not None:
+        try:
+            governor_stats = governor.stats()
+        except Exception as e:
+            print(f"Error fetching Gemini governor stats: {e}")
+    return {"breakers": resilience.snapshot(), "governor": governor_stats}
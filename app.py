@@ -1,10 +1,14 @@
 import asyncio
+import atexit
+import concurrent.futures
 import io
+import json
 import logging
 import os
 import shutil
 import sys
 import tempfile
+import time
 import uuid
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple, Union
@@ -20,6 +24,7 @@ from flask import (
     flash,
     g,
     get_flashed_messages,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -34,13 +39,22 @@ from werkzeug.datastructures import FileStorage
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
-import document_processor
 import docx_generator
+import email_compaction
+import extraction_pool
+import extractor_registry
+import image_dedup
 import llm_handler
+import token_budget
 from admin.routes import admin_bp
+from core import gemini_client
 from core.config import settings
-from core.database import db
+from core.database import add_missing_columns, db
+from core.job_queue import Job, JobQueue, JobQueueFullError, JobState
 from core.models import DocumentLog, ReportLog, ReportStatus
+from core.prompt_config import prompt_registry
+from extraction_pool import ExtractionResult
+from llm_handler import ChunkCallback
 
 load_dotenv()
 
@@ -185,11 +199,23 @@ for handler in logging.root.handlers:
 REPORTS_DIR = os.path.join(tempfile.gettempdir(), "generated_reports_data")
 os.makedirs(REPORTS_DIR, exist_ok=True)
 
+# Uploaded files are persisted here until their report job has finished with them
+UPLOADS_DIR = os.path.join(tempfile.gettempdir(), "report_job_uploads")
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+
+# Interval at which idle report streams send a comment to keep proxies from closing them
+SSE_KEEPALIVE_SECONDS = 15
+
 
 def allowed_file(filename: str) -> bool:
+    if "." not in filename:
+        return False
+    extension = filename.rsplit(".", 1)[1].lower()
+    if extractor_registry.file_type_for_extension(extension) is None:
+        return False
+    # Every registered file type is accepted unless the deployment narrows the list
     return (
-        "." in filename
-        and filename.rsplit(".", 1)[1].lower() in settings.ALLOWED_EXTENSIONS
+        settings.ALLOWED_EXTENSIONS is None or extension in settings.ALLOWED_EXTENSIONS
     )
 
 
@@ -217,70 +243,17 @@ def _validate_file_list(files: List[FileStorage]) -> Optional[Tuple[str, str]]:
     return None
 
 
-def _add_text_data_to_processed_list(
-    processed_file_data_list: List[Dict[str, Any]],
-    current_total_length: int,
-    text_content: str,
-    filename: str,
-    source_description: str,
-) -> Tuple[List[Dict[str, Any]], int, Optional[Tuple[str, str]]]:
-    """Helper to add extracted text to the list, handling truncation and size limits."""
-    flash_message = None
-    available_chars = settings.MAX_EXTRACTED_TEXT_LENGTH - current_total_length
-    if available_chars <= 0:
-        logger.warning(
-            f"Maximum total extracted text length reached before processing content from {filename} ({source_description}). Skipping."
-        )
-        flash_message = (
-            f"Skipped some content from {filename} ({source_description}) as maximum total text limit was reached.",
-            "warning",
-        )
-        return processed_file_data_list, current_total_length, flash_message
-
-    if len(text_content) > available_chars:
-        text_content = text_content[:available_chars]
-        logger.warning(
-            f"Truncated text from {filename} ({source_description}) to fit within MAX_EXTRACTED_TEXT_LENGTH."
-        )
-        flash_message = (
-            f"Content from {filename} ({source_description}) was truncated to fit the overall text limit.",
-            "warning",
-        )
-
-    processed_file_data_list.append(
-        {
-            "type": "text",
-            "filename": filename,
-            "content": text_content,
-            "source": source_description,
-        }
-    )
-    current_total_length += len(text_content)
-    return processed_file_data_list, current_total_length, flash_message
-
+async def _save_uploaded_file(
+    file_storage: FileStorage, upload_dir: str
+) -> Tuple[Optional[str], List[Tuple[str, str]], Optional[Dict[str, Any]]]:
+    """Validates and persists a single FileStorage object into the job's upload directory.
 
-async def _process_single_file_storage(
-    file_storage: FileStorage, temp_dir: str, current_total_extracted_text_length: int
-) -> Tuple[List[Dict[str, Any]], int, List[Tuple[str, str]], Optional[str]]:
-    """Processes a single FileStorage object, returning processed data, new text length, flash messages, and filename."""
-    # Ensure g.request_id is available here if needed for deep logging
-    # logger.debug(f"Processing single file. Request ID: {g.get('request_id', 'N/A_process_single')}")
-    processed_entries: List[Dict[str, Any]] = []
-    text_length_added_by_this_file = 0
+    Returns the saved path (or None), flash messages, and an entry to forward to the
+    LLM when the file had to be skipped.
+    """
     flash_messages: List[Tuple[str, str]] = []
-    successfully_saved_filename: Optional[str] = None
-
     original_filename_for_logging = file_storage.filename or "<unknown>"
 
-    # Individual file size check (re-check, as total size is checked before loop)
-    # file_storage.seek(0, os.SEEK_END)
-    # current_file_size = file_storage.tell()
-    # file_storage.seek(0)
-    # Note: The guide suggested checking file size here. However, the original code already has a robust check
-    # for individual file size *before* this helper would be called (inside the main loop).
-    # To avoid redundancy and keep this helper focused, we'll assume individual size check is done by the caller.
-    # If not, it should be added here or, preferably, ensured by the caller.
-
     if not allowed_file(original_filename_for_logging):
         logger.warning(
             f"File type not allowed: {original_filename_for_logging}, skipping."
@@ -291,18 +264,14 @@ async def _process_single_file_storage(
                 "warning",
             )
         )
-        processed_entries.append(
+        return (
+            None,
+            flash_messages,
             {
                 "type": "unsupported",
                 "filename": original_filename_for_logging,
                 "message": "File type not allowed",
-            }
-        )
-        return (
-            processed_entries,
-            text_length_added_by_this_file,
-            flash_messages,
-            successfully_saved_filename,
+            },
         )
 
     filename = secure_filename(original_filename_for_logging)
@@ -313,86 +282,63 @@ async def _process_single_file_storage(
         flash_messages.append(
             ("A file with an invalid name was skipped after securing.", "warning")
         )
-        processed_entries.append(
+        return (
+            None,
+            flash_messages,
             {
                 "type": "error",
                 "filename": original_filename_for_logging,
                 "message": "Invalid filename after securing.",
-            }
-        )
-        return (
-            processed_entries,
-            text_length_added_by_this_file,
-            flash_messages,
-            successfully_saved_filename,
+            },
         )
 
-    filepath = os.path.join(temp_dir, filename)
+    filepath = os.path.join(upload_dir, filename)
+    await asyncio.to_thread(file_storage.save, filepath)
+    logger.info(f"Saved uploaded file to job upload path: {filepath}")
 
-    try:
-        await asyncio.to_thread(file_storage.save, filepath)
-        logger.info(f"Saved uploaded file to temporary path: {filepath}")
-        successfully_saved_filename = filename  # Mark as saved for display list
-
-        processed_info: Union[Dict[str, Any], List[Dict[str, Any]]] = (
-            await asyncio.to_thread(
-                document_processor.process_uploaded_file, filepath, temp_dir
+    # Reject content that no extractor recognizes now, rather than after a failed parse
+    if await asyncio.to_thread(extractor_registry.sniff_file_type, filepath) is None:
+        logger.warning(f"Unrecognized content in {filepath}, skipping.")
+        os.remove(filepath)
+        flash_messages.append(
+            (
+                f"The content of {original_filename_for_logging} does not match any supported file type. It has been skipped.",
+                "warning",
             )
         )
+        return (
+            None,
+            flash_messages,
+            {
+                "type": "unsupported",
+                "filename": original_filename_for_logging,
+                "message": "Unrecognized file content",
+            },
+        )
+    return filepath, flash_messages, None
 
-        parts_to_process: List[Dict[str, Any]] = []
-        was_eml = isinstance(processed_info, list)
-        if was_eml:
-            # It's an EML file that returned a list of its parts
-            if processed_info:
-                parts_to_process.extend(processed_info)
-        elif isinstance(processed_info, dict):
-            # It's any other single file type
-            parts_to_process.append(processed_info)
-
-        temp_processed_file_data_list_for_this_file: List[Dict[str, Any]] = []
-        current_length_for_this_file_processing = current_total_extracted_text_length
-
-        for part in parts_to_process:
-            part_type = part.get("type")
-            part_filename = part.get("filename", original_filename_for_logging)
-
-            if part_type in ["error", "unsupported"]:
-                processed_entries.append(part)
-            elif part_type == "text" and part.get("content"):
-                source_desc = (
-                    f"from {original_filename_for_logging}"
-                    if was_eml
-                    else "file content"
-                )
 
-                (
-                    temp_processed_file_data_list_for_this_file,
-                    current_length_for_this_file_processing,
-                    flash_msg,
-                ) = _add_text_data_to_processed_list(
-                    temp_processed_file_data_list_for_this_file,
-                    current_length_for_this_file_processing,
-                    part["content"],
-                    part_filename,
-                    source_desc,
-                )
-                if flash_msg:
-                    flash_messages.append(flash_msg)
+def _merge_extraction_result(
+    processed_info: ExtractionResult,
+    filepath: str,
+    original_filename: str,
+) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """Merges the extraction result of one saved upload into LLM-ready entries.
 
-            elif part_type == "vision":
-                processed_entries.append(part)
+    Text is kept whole here; token_budget.plan_context fits all entries of the
+    upload into the model's context once every file has been extracted.
 
-        # Add text data accumulated for this file to the main processed_entries
-        processed_entries.extend(temp_processed_file_data_list_for_this_file)
-        # Calculate how much new text length was actually added by this file's content
-        text_length_added_by_this_file = (
-            current_length_for_this_file_processing
-            - current_total_extracted_text_length
-        )
+    Returns the processed data and flash messages.
+    """
+    processed_entries: List[Dict[str, Any]] = []
+    flash_messages: List[Tuple[str, str]] = []
+    filename = os.path.basename(filepath)
 
-    except Exception as e:
-        logger.error(f"Error saving or processing file {filename}: {e}", exc_info=True)
+    if isinstance(processed_info, BaseException):
+        logger.error(
+            f"Error processing file {filename}: {processed_info}",
+            exc_info=processed_info,
+        )
         flash_messages.append(
             (
                 f"An unexpected error occurred while processing file {filename}. It has been skipped. Please check logs for details.",
@@ -406,19 +352,402 @@ async def _process_single_file_storage(
                 "message": "An unexpected error occurred during processing. Please see logs.",
             }
         )
+        return processed_entries, flash_messages
+
+    parts_to_process: List[Dict[str, Any]] = []
+    has_parts = isinstance(processed_info, list)
+    if has_parts:
+        # An EML file (or a PDF mixing text and scanned pages) returned a list of its parts
+        if processed_info:
+            parts_to_process.extend(processed_info)
+    elif isinstance(processed_info, dict):
+        # It's any other single file type
+        parts_to_process.append(processed_info)
+
+    text_entries: List[Dict[str, Any]] = []
+    for part in parts_to_process:
+        part_type = part.get("type")
+
+        if part_type in ["error", "unsupported", "vision"]:
+            processed_entries.append(part)
+        elif part_type == "text" and part.get("content"):
+            text_entries.append(
+                {
+                    "type": "text",
+                    "filename": part.get("filename", original_filename),
+                    "content": part["content"],
+                    "source": (
+                        f"from {original_filename}" if has_parts else "file content"
+                    ),
+                    "original_filetype": part.get("original_filetype"),
+                }
+            )
 
-    return (
-        processed_entries,
-        text_length_added_by_this_file,
-        flash_messages,
-        successfully_saved_filename,
+    # Text follows the vision parts of the same file, as before
+    processed_entries.extend(text_entries)
+    return processed_entries, flash_messages
+
+
+def _make_report_stream_writer(job: Job, report_log: ReportLog) -> ChunkCallback:
+    """Builds the on_chunk callback used while a report is being streamed.
+
+    Each chunk is published to the job's live subscribers (the SSE endpoint) and
+    the text received so far is saved to ReportLog.llm_raw_response at most every
+    LLM_STREAM_FLUSH_SECONDS, so partial output survives a failed generation. The
+    save runs in a thread, with its own session, so that the commit does not block
+    the other jobs sharing the loop; a save still running skips the next one.
+    """
+    streamed_parts: List[str] = []
+    last_flush = time.monotonic()
+    flush_task: Optional["asyncio.Task[None]"] = None
+    report_log_id = report_log.id
+
+    def _save(text: str) -> None:
+        with app.app_context():
+            # Never overwrite the final text once the job has recorded its outcome
+            db.session.query(ReportLog).filter_by(
+                id=report_log_id, status=ReportStatus.PROCESSING
+            ).update({ReportLog.llm_raw_response: text})
+            db.session.commit()
+
+    async def _flush(text: str) -> None:
+        try:
+            await asyncio.to_thread(_save, text)
+        except Exception as e:
+            logger.warning(f"Could not save the streamed report text: {e}")
+
+    async def _on_chunk(text: str) -> None:
+        nonlocal last_flush, flush_task
+        streamed_parts.append(text)
+        job.append_output(text)
+        if time.monotonic() - last_flush < settings.LLM_STREAM_FLUSH_SECONDS:
+            return
+        if flush_task is not None and not flush_task.done():
+            return
+        flush_task = asyncio.ensure_future(_flush("".join(streamed_parts)))
+        last_flush = time.monotonic()
+
+    return _on_chunk
+
+
+def _record_generation_usage(
+    report_log: ReportLog,
+    generation: llm_handler.LLMGenerationResult,
+    extraction_seconds: float,
+) -> None:
+    """Copies token usage, cost, upload volume and stage timings onto the ReportLog."""
+    report_log.prompt_tokens = generation.prompt_tokens
+    report_log.cached_tokens = generation.cached_tokens
+    report_log.output_tokens = generation.output_tokens
+    report_log.thinking_tokens = generation.thinking_tokens
+    report_log.upload_bytes = generation.upload_bytes
+    # Failed calls are billed too, so the cost is recorded either way
+    report_log.api_cost_usd = generation.cost_usd
+    timings = {"extraction": extraction_seconds, **generation.timings}
+    report_log.stage_timings = json.dumps(
+        {stage: round(seconds, 3) for stage, seconds in timings.items()}
     )
 
 
+def _unbind_context_caches(
+    *criteria: Any,
+) -> Tuple[int, List[Tuple[str, Optional[datetime]]]]:
+    """Unbinds the context caches of the reports matching ``criteria``.
+
+    Reports generated from the same documents share one cache, so the bindings
+    are its reference count. Runs in a thread, with its own session.
+
+    Returns:
+        The number of reports unbound, and the caches no report uses any more
+        with the latest expiry their reports held.
+    """
+    with app.app_context():
+        report_logs = (
+            db.session.query(ReportLog)
+            .filter(ReportLog.context_cache_name.isnot(None), *criteria)
+            .all()
+        )
+        bound_until: Dict[str, Optional[datetime]] = {}
+        for report_log in report_logs:
+            cache_name = report_log.context_cache_name
+            expires_at = report_log.context_cache_expires_at
+            previous = bound_until.get(cache_name)
+            if previous is None or (expires_at is not None and expires_at > previous):
+                bound_until[cache_name] = expires_at
+            report_log.context_cache_name = None
+            report_log.context_cache_expires_at = None
+        db.session.commit()
+
+        unused = [
+            (cache_name, expires_at)
+            for cache_name, expires_at in bound_until.items()
+            if not db.session.query(ReportLog)
+            .filter_by(context_cache_name=cache_name)
+            .count()
+        ]
+        return len(report_logs), unused
+
+
+async def _release_context_caches(*criteria: Any) -> int:
+    """Unbinds the context caches of the matching reports and deletes unused ones.
+
+    Runs on the job loop, which owns the Gemini client; the database work runs
+    in a thread so that it does not block the jobs sharing the loop.
+
+    Returns:
+        The number of reports unbound.
+    """
+    released, unused = await asyncio.to_thread(_unbind_context_caches, *criteria)
+    for cache_name, expires_at in unused:
+        await llm_handler.delete_context_cache(cache_name, expires_at)
+    return released
+
+
+async def _release_expired_context_caches() -> None:
+    """Releases the context caches of reports past their editing window. Runs until cancelled."""
+    while True:
+        try:
+            released = await _release_context_caches(
+                ReportLog.context_cache_expires_at < datetime.utcnow()
+            )
+            if released:
+                logger.info(f"Released {released} expired context caches.")
+        except Exception as e:
+            logger.error(f"Could not release expired context caches: {e}")
+        await asyncio.sleep(settings.CACHE_REFRESH_CHECK_SECONDS)
+
+
+async def _run_report_job(job: Job) -> None:
+    """Runs extraction and report generation for a queued upload.
+
+    Drives the job's ReportLog from PROCESSING to SUCCESS or ERROR and removes the
+    job's upload directory once finished.
+    """
+    upload_dir: str = job.payload["upload_dir"]
+
+    with app.app_context():
+        g.request_id = f"job-{job.id}"
+        report_log = db.session.get(ReportLog, job.id)
+        if report_log is None:
+            raise RuntimeError(f"ReportLog {job.id} not found for queued job.")
+
+        processed_file_data: List[Dict[str, Any]] = list(
+            job.payload.get("skipped_entries", [])
+        )
+
+        try:
+            job.set_stage("extracting")
+            extraction_started = time.perf_counter()
+            saved_files = job.payload["files"]
+            extraction_results = await extraction_pool.extract_files(
+                [saved_file["path"] for saved_file in saved_files], upload_dir
+            )
+            for saved_file, processed_info in zip(saved_files, extraction_results):
+                entries, f_messages = _merge_extraction_result(
+                    processed_info,
+                    saved_file["path"],
+                    saved_file["original_filename"],
+                )
+                processed_file_data.extend(entries)
+                for fm in f_messages:
+                    job.add_message(fm[0], fm[1])
+
+            # Reply chains repeat earlier messages, signatures and disclaimers
+            processed_file_data, f_messages = email_compaction.compact_email_bodies(
+                processed_file_data
+            )
+            for fm in f_messages:
+                job.add_message(fm[0], fm[1])
+
+            # Burst shots and photos attached to several emails are sent once
+            processed_file_data, f_messages = image_dedup.collapse_near_duplicates(
+                processed_file_data
+            )
+            for fm in f_messages:
+                job.add_message(fm[0], fm[1])
+
+            # Share the context window across every file before anything is sent
+            processed_file_data, f_messages = await asyncio.to_thread(
+                token_budget.plan_context, processed_file_data
+            )
+            for fm in f_messages:
+                job.add_message(fm[0], fm[1])
+
+            extraction_seconds = time.perf_counter() - extraction_started
+
+            job.set_stage("generating")
+            start_time = datetime.utcnow()
+            generation = await llm_handler.generate_report_from_content(
+                processed_files=processed_file_data,
+                additional_text="",
+                on_chunk=_make_report_stream_writer(job, report_log),
+            )
+            end_time = datetime.utcnow()
+            report_content = generation.text
+
+            job.set_stage("finalizing")
+            report_log.generation_time_seconds = (end_time - start_time).total_seconds()
+            _record_generation_usage(report_log, generation, extraction_seconds)
+            report_log.context_cache_name = generation.context_cache_name
+            report_log.context_cache_expires_at = generation.context_cache_expires_at
+
+            if generation.is_error:
+                logger.error(f"LLM Error: {report_content}")
+                job.state = JobState.ERROR
+                job.error = f"Could not generate report: {report_content}"
+                report_log.status = ReportStatus.ERROR
+                report_log.error_message = report_content
+                # Keep whatever was streamed before the failure instead of discarding it
+                report_log.llm_raw_response = job.output_text() or report_content
+                db.session.commit()
+                # There is no report to edit
+                await _release_context_caches(ReportLog.id == report_log.id)
+                return
+
+            report_log.llm_raw_response = report_content
+            report_log.final_report_text = report_content  # Initially the same
+
+            report_log.status = ReportStatus.SUCCESS
+            db.session.commit()
+            job.state = JobState.SUCCESS
+
+        except Exception as e:
+            logger.error(f"Unexpected error in report job {job.id}: {e}", exc_info=True)
+            db.session.rollback()
+            job.state = JobState.ERROR
+            job.error = "An unexpected server error occurred."
+            report_log.status = ReportStatus.ERROR
+            report_log.error_message = str(e)
+            db.session.commit()
+        finally:
+            if os.path.exists(upload_dir):
+                try:
+                    await asyncio.to_thread(shutil.rmtree, upload_dir)
+                    logger.info(
+                        f"Successfully removed job upload directory: {upload_dir}"
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Error removing job upload directory {upload_dir}: {e}",
+                        exc_info=True,
+                    )
+
+
+report_jobs = JobQueue(
+    max_workers=settings.REPORT_JOB_WORKERS,
+    max_queue_size=settings.REPORT_JOB_QUEUE_SIZE,
+    retention_seconds=settings.REPORT_JOB_RETENTION_SECONDS,
+)
+report_jobs.set_handler(_run_report_job)
+
+
+# Background tasks running on the job loop, by name
+_background_tasks: Dict[str, "concurrent.futures.Future[Any]"] = {}
+
+
+def _schedule_background_tasks() -> None:
+    """Warms up the shared Gemini client on the job loop and schedules the
+    background refresh of the prompt cache and, with claim context caching, the
+    release of expired context caches. Runs every time the job loop starts."""
+    if settings.GEMINI_CLIENT_WARMUP:
+        _background_tasks["gemini_warm_up"] = report_jobs.run_coroutine(
+            gemini_client.warm_up_gemini_client()
+        )
+    _background_tasks["prompt_cache_refresh"] = report_jobs.run_coroutine(
+        llm_handler.keep_prompt_cache_fresh()
+    )
+    if settings.LLM_CLAIM_CONTEXT_CACHE_ENABLED:
+        _background_tasks["context_cache_sweep"] = report_jobs.run_coroutine(
+            _release_expired_context_caches()
+        )
+
+
+report_jobs.add_start_hook(_schedule_background_tasks)
+
+
+def start_background_services() -> None:
+    """Starts the report job loop together with its background tasks (idempotent)."""
+    report_jobs.start()
+
+
+def _shutdown_background_services() -> None:
+    if report_jobs.is_running:
+        try:
+            # The client's async connections belong to the job loop.
+            report_jobs.run_coroutine(gemini_client.close_gemini_client()).result(
+                timeout=5
+            )
+        except Exception as e:
+            logger.warning(f"Could not close the Gemini client cleanly: {e}")
+    report_jobs.shutdown()
+
+
+atexit.register(_shutdown_background_services)
+
+
+def _upgrade_database() -> None:
+    """Adds the model columns missing from a database created by an older version.
+
+    Runs at startup, so that an upgrade does not depend on `flask init-db`.
+    """
+    with app.app_context():
+        try:
+            for column in add_missing_columns():
+                logger.info(f"Added missing column {column}.")
+        except Exception as e:
+            logger.warning(f"Could not add missing database columns: {e}")
+
+
+def _fail_interrupted_reports() -> None:
+    """Marks the reports left PROCESSING by a previous process as failed.
+
+    Jobs live in the memory of the process that runs them, which is why the app
+    must be served by a single process: when it restarts, none of those reports
+    can finish any more.
+    """
+    with app.app_context():
+        try:
+            interrupted = (
+                db.session.query(ReportLog)
+                .filter_by(status=ReportStatus.PROCESSING)
+                .update(
+                    {
+                        ReportLog.status: ReportStatus.ERROR,
+                        ReportLog.error_message: "The server restarted before the report was finished. Please generate it again.",
+                    }
+                )
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Could not check for interrupted reports: {e}")
+            return
+    if interrupted:
+        logger.warning(
+            f"Marked {interrupted} reports interrupted by a restart as failed."
+        )
+
+
+_upgrade_database()
+_fail_interrupted_reports()
+# However the app is served (hypercorn app:app, run_server.py), importing it
+# starts the job loop.
+start_background_services()
+# Build the prompt cache for edited prompts right away instead of on the next report.
+prompt_registry.add_change_listener(
+    lambda prompts: report_jobs.run_coroutine(llm_handler.refresh_prompt_cache())
+)
+
+
 @app.route("/upload", methods=["POST"])
 @limiter.limit("10 per minute;20 per hour")
 @auth.login_required
-async def upload_files() -> Union[str, FlaskResponse]:
+async def upload_files() -> Union[Tuple[FlaskResponse, int], FlaskResponse]:
+    """Persists the uploaded files and enqueues a report job.
+
+    Responds with 202 and the job ID as soon as the inputs are stored; progress is
+    exposed by the /jobs/<job_id> endpoint.
+    """
     app_logger = logging.getLogger(__name__)
     app_logger.info(
         f"Entered /upload route. Request ID: {g.get('request_id', 'N/A_upload_entry')}"
@@ -446,11 +775,11 @@ async def upload_files() -> Union[str, FlaskResponse]:
         db.session.commit()
         return redirect(request.url)
 
-    processed_file_data: List[Dict[str, Any]] = []
-    uploaded_filenames_for_display: List[str] = []
-    temp_dir: Optional[str] = None
+    saved_files: List[Dict[str, str]] = []
+    skipped_entries: List[Dict[str, Any]] = []
+    upload_dir: Optional[str] = None
+    job_submitted = False
     total_upload_size = 0
-    current_total_extracted_text_length = 0
 
     try:
         # Calculate total upload size first
@@ -469,8 +798,9 @@ async def upload_files() -> Union[str, FlaskResponse]:
             db.session.commit()
             return redirect(request.url)
 
-        temp_dir = tempfile.mkdtemp()
-        logger.info(f"Created temporary directory: {temp_dir}")
+        upload_dir = os.path.join(UPLOADS_DIR, report_log.id)
+        os.makedirs(upload_dir, exist_ok=True)
+        logger.info(f"Created job upload directory: {upload_dir}")
 
         for file_storage in files:
             if not file_storage or not file_storage.filename:
@@ -496,30 +826,31 @@ async def upload_files() -> Union[str, FlaskResponse]:
                 db.session.add(doc_log)
                 continue
 
-            entries, text_added, f_messages, saved_fname = (
-                await _process_single_file_storage(
-                    file_storage, temp_dir, current_total_extracted_text_length
-                )
+            saved_path, f_messages, skipped_entry = await _save_uploaded_file(
+                file_storage, upload_dir
             )
-            processed_file_data.extend(entries)
-            current_total_extracted_text_length += text_added
             for fm in f_messages:
                 flash(fm[0], fm[1])
-
-            if saved_fname:
-                uploaded_filenames_for_display.append(saved_fname)
-                # Step 2: Create DocumentLog for the successfully processed file
+            if skipped_entry:
+                skipped_entries.append(skipped_entry)
+
+            if saved_path:
+                saved_files.append(
+                    {
+                        "path": saved_path,
+                        "original_filename": file_storage.filename,
+                    }
+                )
+                # Step 2: Create DocumentLog for the successfully stored file
                 doc_log = DocumentLog(
                     report_id=report_log.id,
                     original_filename=file_storage.filename,
-                    stored_filepath=os.path.join(
-                        temp_dir, saved_fname
-                    ),  # Store temp path for now
+                    stored_filepath=saved_path,
                     file_size_bytes=current_file_size,
                 )
                 db.session.add(doc_log)
 
-        if not processed_file_data and not uploaded_filenames_for_display:
+        if not saved_files:
             flash("No files were suitable for processing.", "warning")
             report_log.status = ReportStatus.ERROR
             report_log.error_message = (
@@ -528,45 +859,46 @@ async def upload_files() -> Union[str, FlaskResponse]:
             db.session.commit()
             return redirect(url_for("index"))
 
-        db.session.commit()  # Commit document logs before calling LLM
+        db.session.commit()  # Commit document logs before handing over to the worker
 
-        # Step 3: Call LLM and update ReportLog with results
-        start_time = datetime.utcnow()
-        report_content: str = await llm_handler.generate_report_from_content(
-            processed_files=processed_file_data, additional_text=""
+        # Step 3: Enqueue the generation job; the worker updates the ReportLog.
+        job = report_jobs.submit(
+            report_log.id,
+            {
+                "upload_dir": upload_dir,
+                "files": saved_files,
+                "skipped_entries": skipped_entries,
+            },
         )
-        end_time = datetime.utcnow()
-
-        report_log.generation_time_seconds = (end_time - start_time).total_seconds()
-        report_log.llm_raw_response = report_content
-        report_log.final_report_text = report_content  # Initially the same
-
-        if not report_content or report_content.strip().startswith("ERROR:"):
-            logger.error(f"LLM Error: {report_content}")
-            flash(f"Could not generate report: {report_content}", "error")
-            report_log.status = ReportStatus.ERROR
-            report_log.error_message = report_content
-            db.session.commit()
-            return render_template(
-                "index.html", filenames=uploaded_filenames_for_display
-            )
-
-        # Success case
-        report_log.status = ReportStatus.SUCCESS
-        # TODO: Replace with actual cost from a modified llm_handler
-        report_log.api_cost_usd = 0.03  # Placeholder value
-        db.session.commit()
+        job_submitted = True
 
         # Store the report_log.id in the session for the next step (download)
         session["report_log_id"] = report_log.id
 
-        return render_template(
-            "report.html",
-            report_content=report_content,
-            filenames=uploaded_filenames_for_display,
-            generation_time=report_log.generation_time_seconds,
+        return (
+            jsonify(
+                {
+                    "job_id": job.id,
+                    "status": report_log.status.value,
+                    "status_url": url_for("job_status", job_id=job.id),
+                    "stream_url": url_for("job_stream", job_id=job.id),
+                    "report_url": url_for("show_report"),
+                    "queue_position": report_jobs.queue_position(job.id),
+                }
+            ),
+            202,
         )
 
+    except JobQueueFullError as e:
+        logger.warning(f"Rejecting upload for ReportLog {report_log.id}: {e}")
+        flash(
+            "The server is busy generating other reports. Please try again in a few minutes.",
+            "error",
+        )
+        report_log.status = ReportStatus.ERROR
+        report_log.error_message = str(e)
+        db.session.commit()
+        return redirect(url_for("index"))
     except Exception as e:
         logger.error(f"Unexpected error in upload_files: {e}", exc_info=True)
         flash("An unexpected server error occurred.", "error")
@@ -575,19 +907,133 @@ async def upload_files() -> Union[str, FlaskResponse]:
         db.session.commit()
         return redirect(url_for("index"))
     finally:
-        if temp_dir and os.path.exists(temp_dir):
+        if not job_submitted and upload_dir and os.path.exists(upload_dir):
             try:
-                # In a real scenario with permanent storage, you'd copy files out of temp_dir
-                # before deleting it. For now, we accept the stored_filepath becomes invalid.
-                await asyncio.to_thread(shutil.rmtree, temp_dir)
-                logger.info(f"Successfully removed temporary directory: {temp_dir}")
+                await asyncio.to_thread(shutil.rmtree, upload_dir)
+                logger.info(f"Successfully removed job upload directory: {upload_dir}")
             except Exception as e:
                 logger.error(
-                    f"Error removing temporary directory {temp_dir}: {e}", exc_info=True
+                    f"Error removing job upload directory {upload_dir}: {e}",
+                    exc_info=True,
                 )
 
 
-# Add this new function somewhere after the /upload route in app.py
+@app.route("/jobs/<job_id>")
+@limiter.exempt  # Polled every few seconds while a report is generated
+@auth.login_required
+def job_status(job_id: str) -> Union[FlaskResponse, Tuple[FlaskResponse, int]]:
+    """Returns the progress of a report job as JSON, for the upload page to poll."""
+    report_log = db.session.get(ReportLog, job_id)
+    if not report_log:
+        return jsonify({"error": "Job not found."}), 404
+
+    job = report_jobs.get(job_id)
+    if job is not None:
+        stage = job.stage
+        messages = job.to_dict()["messages"]
+        error = job.error
+    else:
+        # The job may have been handled by another process or pruned from memory:
+        # the ReportLog is the source of truth for its outcome.
+        stage = "done" if report_log.status != ReportStatus.PROCESSING else "unknown"
+        messages = []
+        error = None
+
+    if report_log.status == ReportStatus.ERROR:
+        error = error or report_log.error_message
+
+    if (
+        job is not None
+        and report_log.status != ReportStatus.PROCESSING
+        and not job.delivered
+    ):
+        # Surface extraction warnings and errors on the page the client navigates to next.
+        for message in messages:
+            flash(message["message"], message["category"])
+        if error:
+            flash(error, "error")
+        job.delivered = True
+
+    return jsonify(
+        {
+            "job_id": job_id,
+            "status": report_log.status.value,
+            "stage": stage,
+            "queue_position": report_jobs.queue_position(job_id),
+            "queue_depth": report_jobs.queue_depth(),
+            "messages": messages,
+            "error": error,
+            "generation_time_seconds": report_log.generation_time_seconds,
+            "report_url": (
+                url_for("show_report")
+                if report_log.status == ReportStatus.SUCCESS
+                else None
+            ),
+        }
+    )
+
+
+def _format_sse(
+    event: str, data: Dict[str, Any], event_id: Optional[int] = None
+) -> str:
+    """Formats a single Server-Sent Event with a JSON payload."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@app.route("/jobs/<job_id>/stream")
+@limiter.exempt  # A single long-lived connection per report
+@auth.login_required
+def job_stream(job_id: str) -> Union[FlaskResponse, Tuple[FlaskResponse, int]]:
+    """Streams the report text of a job to the browser as Server-Sent Events.
+
+    Every "chunk" event carries the next piece of text, with the chunk index as its
+    event ID so that a reconnecting EventSource resumes via Last-Event-ID. A final
+    "done" event carries the outcome of the job.
+    """
+    report_log = db.session.get(ReportLog, job_id)
+    if not report_log:
+        return jsonify({"error": "Job not found."}), 404
+
+    try:
+        offset = int(request.headers.get("Last-Event-ID", "-1")) + 1
+    except ValueError:
+        offset = 0
+
+    job = report_jobs.get(job_id)
+    persisted_text = report_log.llm_raw_response or ""
+    persisted_status = report_log.status.value
+
+    def _events():
+        nonlocal offset
+        if job is None:
+            # The job is not running in this process: replay what has been saved so far.
+            if persisted_text and offset == 0:
+                yield _format_sse("chunk", {"text": persisted_text}, 0)
+            yield _format_sse("done", {"status": persisted_status})
+            return
+
+        while True:
+            chunks = job.wait_for_output(offset, timeout=SSE_KEEPALIVE_SECONDS)
+            for chunk in chunks:
+                yield _format_sse("chunk", {"text": chunk}, offset)
+                offset += 1
+            if not chunks:
+                if job.is_finished:
+                    break
+                yield ": keep-alive\n\n"
+
+        yield _format_sse("done", {"status": job.state, "error": job.error})
+
+    return FlaskResponse(
+        _events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/report")
@@ -623,10 +1069,179 @@ def show_report():
         "report.html",
         report_content=report_log.final_report_text or report_log.llm_raw_response,
         generation_time=report_log.generation_time_seconds,
+        can_revise=_can_revise(report_log),
         # filenames=filenames # Optional: if you need to display them
     )
 
 
+def _can_revise(report_log: ReportLog) -> bool:
+    """Whether the documents of a report are still cached for follow-up edits."""
+    return bool(
+        report_log.context_cache_name
+        and report_log.context_cache_expires_at
+        and report_log.context_cache_expires_at > datetime.utcnow()
+    )
+
+
+async def _extract_revision_files(
+    files: List[FileStorage], report_log: ReportLog, upload_dir: str
+) -> List[Dict[str, Any]]:
+    """Saves and extracts the documents added with a revision request.
+
+    Returns the LLM-ready entries; warnings are flashed.
+    """
+    processed_file_data: List[Dict[str, Any]] = []
+    saved_files: List[Tuple[str, str]] = []
+    for file_storage in files:
+        if not file_storage or not file_storage.filename:
+            continue
+        file_storage.seek(0, os.SEEK_END)
+        file_size = file_storage.tell()
+        file_storage.seek(0)
+        if file_size > settings.MAX_FILE_SIZE_BYTES:
+            flash(
+                f"File {file_storage.filename} exceeds the size limit of {settings.MAX_FILE_SIZE_MB} MB and was skipped.",
+                "warning",
+            )
+            continue
+        saved_path, f_messages, skipped_entry = await _save_uploaded_file(
+            file_storage, upload_dir
+        )
+        for fm in f_messages:
+            flash(fm[0], fm[1])
+        if skipped_entry:
+            processed_file_data.append(skipped_entry)
+        if saved_path:
+            saved_files.append((saved_path, file_storage.filename))
+            db.session.add(
+                DocumentLog(
+                    report_id=report_log.id,
+                    original_filename=file_storage.filename,
+                    stored_filepath=saved_path,
+                    file_size_bytes=file_size,
+                )
+            )
+    db.session.commit()
+
+    extraction_results = await extraction_pool.extract_files(
+        [path for path, _ in saved_files], upload_dir
+    )
+    for (path, original_filename), processed_info in zip(
+        saved_files, extraction_results
+    ):
+        entries, f_messages = _merge_extraction_result(
+            processed_info, path, original_filename
+        )
+        processed_file_data.extend(entries)
+        for fm in f_messages:
+            flash(fm[0], fm[1])
+
+    processed_file_data, f_messages = await asyncio.to_thread(
+        token_budget.plan_context, processed_file_data
+    )
+    for fm in f_messages:
+        flash(fm[0], fm[1])
+    return processed_file_data
+
+
+@app.route("/report/revise", methods=["POST"])
+@limiter.limit("10 per minute;60 per hour")
+@auth.login_required
+async def revise_report() -> FlaskResponse:
+    """Applies a follow-up request (and any new documents) to the current report.
+
+    Only the request, the current text and the new documents are sent: the
+    claim's documents are read from its context cache, whose editing window
+    restarts on every revision.
+    """
+    report_log_id = session.get("report_log_id")
+    report_log = db.session.get(ReportLog, report_log_id) if report_log_id else None
+    if not report_log or report_log.status != ReportStatus.SUCCESS:
+        flash(
+            "The requested report was not found or was not successfully generated.",
+            "error",
+        )
+        return redirect(url_for("index"))
+
+    instruction = request.form.get("revision_instruction", "").strip()
+    if not instruction:
+        flash("Please describe the changes to make to the report.", "warning")
+        return redirect(url_for("show_report"))
+    if not _can_revise(report_log):
+        flash(
+            "The documents of this report are no longer available for revisions. Please generate the report again.",
+            "error",
+        )
+        return redirect(url_for("show_report"))
+
+    files = [f for f in request.files.getlist("files[]") if f and f.filename]
+    total_upload_size = 0
+    for file_storage in files:
+        file_storage.seek(0, os.SEEK_END)
+        total_upload_size += file_storage.tell()
+        file_storage.seek(0)
+    if total_upload_size > settings.MAX_TOTAL_UPLOAD_SIZE_BYTES:
+        flash(
+            f"Total upload size exceeds the limit of {settings.MAX_TOTAL_UPLOAD_SIZE_MB} MB.",
+            "error",
+        )
+        return redirect(url_for("show_report"))
+
+    upload_dir = os.path.join(UPLOADS_DIR, f"{report_log.id}-revision-{uuid.uuid4()}")
+    try:
+        processed_file_data: List[Dict[str, Any]] = []
+        if files:
+            os.makedirs(upload_dir, exist_ok=True)
+            processed_file_data = await _extract_revision_files(
+                files, report_log, upload_dir
+            )
+
+        revision = llm_handler.ReportRevision(
+            report_log.context_cache_name,
+            report_log.final_report_text or report_log.llm_raw_response or "",
+            instruction,
+        )
+        # The Gemini client belongs to the job loop
+        generation = await asyncio.wrap_future(
+            report_jobs.run_coroutine(
+                llm_handler.revise_report(revision, processed_file_data)
+            )
+        )
+        report_log.api_cost_usd = (report_log.api_cost_usd or 0.0) + (
+            generation.cost_usd or 0.0
+        )
+        if generation.is_error:
+            logger.error(f"LLM Error while revising a report: {generation.text}")
+            db.session.commit()
+            flash(f"Could not revise the report: {generation.text}", "error")
+            return redirect(url_for("show_report"))
+
+        report_log.final_report_text = generation.text
+        expires_at = await asyncio.wrap_future(
+            report_jobs.run_coroutine(
+                llm_handler.extend_context_cache(report_log.context_cache_name)
+            )
+        )
+        if expires_at is not None:
+            report_log.context_cache_expires_at = expires_at
+        db.session.commit()
+        flash("The report has been revised.", "success")
+    except Exception as e:
+        logger.error(f"Unexpected error in revise_report: {e}", exc_info=True)
+        db.session.rollback()
+        flash("An unexpected server error occurred.", "error")
+    finally:
+        if os.path.exists(upload_dir):
+            try:
+                await asyncio.to_thread(shutil.rmtree, upload_dir)
+            except Exception as e:
+                logger.error(
+                    f"Error removing revision upload directory {upload_dir}: {e}",
+                    exc_info=True,
+                )
+    return redirect(url_for("show_report"))
+
+
 @app.route("/download_report", methods=["POST"])
 @limiter.limit("30 per minute")
 @auth.login_required
@@ -711,7 +1326,10 @@ def init_db_command():
 
     with app.app_context():
         db.create_all()
+        added_columns = add_missing_columns()
 
+    for column in added_columns:
+        click.echo(f"Added missing column {column}.")
     click.echo("Initialized the database.")
 
 
@@ -1,4 +1,4 @@
-from typing import Optional, Set
+from typing import Dict, Optional, Set
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -11,27 +11,49 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: Optional[str] = None
     FLASK_SECRET_KEY: str
 
-    ALLOWED_EXTENSIONS: Set[str] = {
-        "png",
-        "jpg",
-        "jpeg",
-        "xlsx",
-        "pdf",
-        "docx",
-        "txt",
-        "eml",
-    }
+    # Uploads accept the extensions of every registered file type (see
+    # extractor_registry); a set here restricts them to those listed
+    ALLOWED_EXTENSIONS: Optional[Set[str]] = None
     MAX_FILE_SIZE_MB: int = 25  # Maximum size for a single uploaded file in MB
     MAX_TOTAL_UPLOAD_SIZE_MB: int = (
         100  # Maximum total size for all files in a single upload request
     )
-    MAX_EXTRACTED_TEXT_LENGTH: int = (
-        1000000  # Maximum characters for combined extracted text sent to LLM
-    )
 
     LLM_MODEL_NAME: str = "gemini-2.5-flash-preview-05-20"
     LLM_TEMPERATURE: float = 0.5
     LLM_MAX_TOKENS: int = 64000  # Max tokens for the LLM response
+    LLM_CONTINUATION_MAX_ROUNDS: int = 2  # Resumptions of a report cut at MAX_TOKENS
+    LLM_SECTION_PARALLEL_ENABLED: bool = False  # Generate schema sections concurrently
+    LLM_SECTION_CACHE_TTL_SECONDS: int = 900  # Lifetime of a report's document cache
+    LLM_CONSISTENCY_PASS_ENABLED: bool = True  # Reconcile sections written in parallel
+    LLM_CONSISTENCY_MAX_TOKENS: int = 4096  # Output limit of the consistency pass
+    LLM_CLAIM_CONTEXT_CACHE_ENABLED: bool = False  # Cache each claim's documents
+    REPORT_EDIT_WINDOW_HOURS: int = 24  # How long a report's documents stay cached
+    LLM_CONTEXT_WINDOW_TOKENS: int = 1048576  # Input token limit of LLM_MODEL_NAME
+
+    # Token Budget Settings
+    TOKEN_ESTIMATE_CHARS_PER_TOKEN: float = 4.0  # Rough ratio used to estimate text
+    TOKEN_BUDGET_SAFETY_MARGIN: float = 0.1  # Share of the window kept free for errors
+    # Relative share of the budget given to text from each file type (default 1.0)
+    TOKEN_BUDGET_PRIORITY_WEIGHTS: Dict[str, float] = {
+        "eml": 3.0,
+        "pdf": 2.0,
+        "txt": 2.0,
+        "html": 2.0,
+        "docx": 2.0,
+        "xlsx": 1.0,
+    }
+    # USD per million tokens, by model. "input" applies to uncached prompt tokens,
+    # "thinking" to the model's reasoning tokens (both default to the other rates).
+    LLM_PRICES_USD_PER_MILLION_TOKENS: Dict[str, Dict[str, float]] = {
+        "gemini-2.5-flash-preview-05-20": {
+            "input": 0.15,
+            "cached_input": 0.0375,
+            "output": 0.60,
+            "thinking": 3.50,
+        },
+        "gemini-2.5-pro": {"input": 1.25, "cached_input": 0.31, "output": 10.0},
+    }
 
     # DOCX Generation Settings
     DOCX_FONT_NAME: str = "Times New Roman"
@@ -46,10 +68,77 @@ class Settings(BaseSettings):
     )
     CACHE_TTL_DAYS: int = 2  # Time-to-live for the prompt cache in days
     CACHE_DISPLAY_NAME: str = "ReportGenerationPromptsV2"  # Display name for new caches
+    CACHE_REFRESH_MARGIN_HOURS: int = 6  # Extend the cache when less than this remains
+    CACHE_REFRESH_CHECK_SECONDS: int = 600  # Interval of the background refresh task
+
+    # Gemini Client Settings
+    GEMINI_HTTP_MAX_CONNECTIONS: int = 20  # Connection pool size of the shared client
+    GEMINI_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10  # Idle connections kept open
+    GEMINI_HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 120.0  # Idle time before closing
+    GEMINI_CLIENT_WARMUP: bool = True  # Open connections at server startup
+
+    # Gemini File API Settings
+    GEMINI_FILE_REUSE_ENABLED: bool = True  # Reuse uploads of identical documents
+    GEMINI_FILE_REGISTRY_PATH: Optional[str] = None  # SQLite file; defaults to temp dir
+    GEMINI_FILE_TTL_HOURS: int = 48  # Assumed lifetime when the API reports no expiry
+    GEMINI_FILE_REUSE_MARGIN_SECONDS: int = 3600  # Minimum remaining life to reuse
+
+    # Gemini Rate Governor Settings (shared by all app processes)
+    GEMINI_GOVERNOR_ENABLED: bool = True  # Queue calls to stay within the quota
+    GEMINI_GOVERNOR_PATH: Optional[str] = None  # SQLite file; defaults to temp dir
+    GEMINI_REQUESTS_PER_MINUTE: int = 1000  # Requests quota of the API key
+    GEMINI_TOKENS_PER_MINUTE: int = 1_000_000  # Input tokens quota of the API key
+    GEMINI_MAX_CONCURRENT_GENERATIONS: int = 8  # Generations in flight at once
+    GEMINI_MAX_QUEUED_CALLS: int = 100  # Calls allowed to wait before failing fast
+    GEMINI_MAX_QUEUE_WAIT_SECONDS: int = 300  # Longest a call waits for capacity
 
     LLM_API_RETRY_ATTEMPTS: int = 3  # Number of retry attempts for the LLM API call
-    LLM_API_RETRY_WAIT_SECONDS: int = 2  # Time to wait between retry attempts
+    LLM_API_RETRY_WAIT_SECONDS: int = 2  # Base of the decorrelated-jitter backoff
+    LLM_API_RETRY_MAX_WAIT_SECONDS: int = 30  # Longest pause between two attempts
+    LLM_API_RETRY_BUDGET_RATIO: float = 0.2  # Retries allowed per call, on average
+    LLM_API_RETRY_BUDGET_MIN_PER_MINUTE: float = 10  # Retries allowed even when idle
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5  # Consecutive failures that open it
+    CIRCUIT_BREAKER_RESET_SECONDS: int = 30  # Fail-fast period before a probe call
     LLM_API_TIMEOUT_SECONDS: int = 120  # Timeout for the entire generation call
+    LLM_STREAMING_ENABLED: bool = True  # Stream report chunks to the browser via SSE
+    LLM_STREAM_FLUSH_SECONDS: float = 2.0  # How often streamed text is saved to the DB
+
+    # Background Job Settings
+    REPORT_JOB_WORKERS: int = 2  # Reports generated concurrently per process
+    REPORT_JOB_QUEUE_SIZE: int = 20  # Jobs allowed to wait before /upload rejects
+    REPORT_JOB_RETENTION_SECONDS: int = 3600  # How long finished jobs stay pollable
+    EXTRACTION_MAX_WORKERS: int = (
+        4  # Extraction processes per app process (0 = threads)
+    )
+    EXTRACTION_TIMEOUT_SECONDS: int = 120  # A worker still busy after this is killed
+    EXTRACTION_MEMORY_LIMIT_MB: int = 2048  # Address space of a worker (0 = no limit)
+    EXTRACTION_TASKS_PER_WORKER: int = 50  # Files handled before a worker is replaced
+
+    # PDF Text Layer Settings
+    PDF_TEXT_LAYER_ENABLED: bool = True  # Send text pages as text, not as images
+    PDF_TEXT_MIN_CHARS_PER_PAGE: int = 50  # Pages with less text are treated as scans
+    PDF_MAX_IMAGE_COVERAGE: float = 0.5  # Pages with more image area go to vision
+
+    # Image Normalization Settings
+    IMAGE_NORMALIZATION_ENABLED: bool = True  # Downsize and re-encode photos
+    IMAGE_MAX_LONG_EDGE: int = 2048  # Pixels on the long edge after downsizing
+    IMAGE_JPEG_QUALITY: int = 85  # Quality of the re-encoded JPEGs
+    IMAGE_CACHE_DIR: Optional[str] = None  # Normalized copies; defaults to temp dir
+    IMAGE_CACHE_MAX_MB: int = 1024  # Size before least-recently-used pruning
+    IMAGE_DEDUP_ENABLED: bool = True  # Send near-duplicate photos only once
+    IMAGE_DEDUP_MAX_DISTANCE: int = 5  # Differing dHash bits (of 64) for duplicates
+
+    # Email Settings
+    EML_MAX_ATTACHMENT_MB: int = 25  # Larger attachments are skipped
+    EML_MAX_TOTAL_ATTACHMENTS_MB: int = 100  # Attachment bytes saved per message
+    EML_MAX_NESTING_DEPTH: int = 3  # Levels of forwarded .eml attachments followed
+    EML_ATTACHMENT_WORKERS: int = 4  # Attachments of one message processed at once
+    EMAIL_COMPACTION_ENABLED: bool = True  # Drop quoted replies repeated in a thread
+
+    # Extraction Cache Settings
+    EXTRACTION_CACHE_ENABLED: bool = True  # Reuse results for re-uploaded documents
+    EXTRACTION_CACHE_PATH: Optional[str] = None  # SQLite file; defaults to the temp dir
+    EXTRACTION_CACHE_MAX_MB: int = 512  # Total size before least-recently-used eviction
 
     LOG_LEVEL: str = "INFO"
 
@@ -1,5 +1,35 @@
+from typing import List
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 
 # Initialize the SQLAlchemy extension, but don't bind it to the app yet.
 # This will be done in the main app factory.
 db = SQLAlchemy()
+
+
+def add_missing_columns() -> List[str]:
+    """Adds nullable model columns that are missing from existing tables.
+
+    db.create_all() creates missing tables but never alters existing ones, so
+    columns added to a model later would otherwise be absent from older databases.
+    Must be called within an app context. Returns the added "table.column" names.
+    """
+    inspector = inspect(db.engine)
+    added: List[str] = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    )
+                )
+            added.append(f"{table.name}.{column.name}")
+    return added
@@ -0,0 +1,191 @@
+"""Persistent, content-addressed cache of document extraction results.
+
+Results are keyed by the SHA-256 of the file bytes plus the extractor name and
+version and a digest of the settings the extraction depends on, so a re-uploaded
+document costs a hash instead of a full parse, while bumping an extractor's
+version or changing those settings invalidates its old entries. The cache lives in
+a SQLite file so that it is shared by the extraction worker processes and
+survives restarts; it is bounded by total size with least-recently-used
+eviction and keeps hit/miss counters.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """Returns the hex SHA-256 digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """SQLite-backed LRU cache mapping (file hash, extractor, version) to a result."""
+
+    def __init__(self, db_path: str, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """A connection committed on success, rolled back on error, then closed."""
+        with contextlib.closing(self._connect()) as conn, conn:
+            yield conn
+
+    def _init_db(self) -> None:
+        with self._transaction() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+                """)
+
+    @staticmethod
+    def make_key(
+        file_hash: str, extractor: str, version: int, settings_key: str = ""
+    ) -> str:
+        key = f"{file_hash}:{extractor}:v{version}"
+        return f"{key}:{settings_key}" if settings_key else key
+
+    def _increment(self, conn: sqlite3.Connection, counter: str) -> None:
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (counter,),
+        )
+
+    def get(
+        self, file_hash: str, extractor: str, version: int, settings_key: str = ""
+    ) -> Optional[Any]:
+        """Returns the cached result, or None on a miss."""
+        key = self.make_key(file_hash, extractor, version, settings_key)
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._increment(conn, "misses")
+                return None
+            conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._increment(conn, "hits")
+        return json.loads(row[0])
+
+    def put(
+        self,
+        file_hash: str,
+        extractor: str,
+        version: int,
+        result: Any,
+        settings_key: str = "",
+    ) -> None:
+        """Stores a result and evicts least-recently-used entries over the size limit."""
+        value = json.dumps(result)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            logger.info(
+                f"Extraction result for {extractor} ({size} bytes) exceeds the cache size limit. Not caching."
+            )
+            return
+        key = self.make_key(file_hash, extractor, version, settings_key)
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            evicted = conn.execute(
+                """
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (
+                            ORDER BY last_access DESC, key
+                        ) AS running_size
+                        FROM entries
+                    ) WHERE running_size > ?
+                )
+                """,
+                (self.max_bytes,),
+            ).rowcount
+            if evicted:
+                conn.execute(
+                    "INSERT INTO counters (name, value) VALUES ('evictions', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (evicted,),
+                )
+                logger.info(f"Evicted {evicted} entries from the extraction cache.")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss/eviction counters and the current size of the cache."""
+        with self._transaction() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, total_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "total_bytes": total_bytes,
+        }
+
+    def clear(self) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
+
+
+_cache: Optional[ExtractionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Returns the process-wide extraction cache, or None if caching is disabled."""
+    global _cache
+    if not settings.EXTRACTION_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            db_path = settings.EXTRACTION_CACHE_PATH or os.path.join(
+                tempfile.gettempdir(), "extraction_cache.sqlite3"
+            )
+            _cache = ExtractionCache(
+                db_path, settings.EXTRACTION_CACHE_MAX_MB * 1024 * 1024
+            )
+        return _cache
@@ -0,0 +1,155 @@
+"""Process-wide Gemini client with a pooled, keep-alive HTTP transport.
+
+Building a ``genai.Client`` per report meant fresh TLS handshakes for the cache
+lookup, the uploads, the generation and the deletes of every report. The shared
+client keeps its connections open between calls and reports; it is warmed up
+when the server starts and closed when it stops.
+
+The async transport belongs to the event loop it is first used on (the report
+job loop). A caller running on another live loop gets a client of its own,
+reused for as long as that loop lives, so that connections are never shared
+across loops; it is released when the loop closes or the server stops.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from google import genai
+from google.genai import types
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[genai.Client] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_client_lock = threading.Lock()
+# Clients of the other event loops that asked for one. The loops are held
+# strongly so that a client is closed, not just dropped, once its loop closes.
+_loop_clients: Dict[asyncio.AbstractEventLoop, genai.Client] = {}
+
+
+def _build_client() -> genai.Client:
+    limits = httpx.Limits(
+        max_connections=settings.GEMINI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.GEMINI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.GEMINI_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    http_options = types.HttpOptions(
+        client_args={"limits": limits}, async_client_args={"limits": limits}
+    )
+    return genai.Client(api_key=settings.GEMINI_API_KEY, http_options=http_options)
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _http_clients(client: genai.Client):
+    # google-genai has no public close(); the pools are the client's httpx clients.
+    api_client = getattr(client, "_api_client", None)
+    return (
+        getattr(api_client, "_async_httpx_client", None),
+        getattr(api_client, "_httpx_client", None),
+    )
+
+
+def _close_sync_pool(client: genai.Client) -> None:
+    """Closes the sync pool of a client whose loop is gone (its async one died with it)."""
+    _, sync_http = _http_clients(client)
+    try:
+        if sync_http is not None:
+            sync_http.close()
+    except Exception as e:
+        logger.warning(f"Error closing a Gemini client: {e}")
+
+
+async def _close_pools(client: genai.Client) -> None:
+    async_http, sync_http = _http_clients(client)
+    if async_http is not None:
+        await async_http.aclose()
+    if sync_http is not None:
+        sync_http.close()
+
+
+def get_gemini_client() -> genai.Client:
+    """Returns the Gemini client of the calling event loop, creating it on first use."""
+    global _client, _client_loop
+    loop = _running_loop()
+    with _client_lock:
+        if (
+            _client is not None
+            and _client_loop is not None
+            and _client_loop.is_closed()
+        ):
+            # The loop that owned the async connections is gone.
+            _close_sync_pool(_client)
+            _client, _client_loop = None, None
+        for other_loop, other_client in list(_loop_clients.items()):
+            if other_loop.is_closed():
+                del _loop_clients[other_loop]
+                _close_sync_pool(other_client)
+        if _client is None:
+            _client = _build_client()
+            logger.info(
+                f"Created shared Gemini client (max {settings.GEMINI_HTTP_MAX_CONNECTIONS} connections)."
+            )
+        if _client_loop is None:
+            _client_loop = loop
+        if loop is not None and loop is not _client_loop:
+            client = _loop_clients.get(loop)
+            if client is None:
+                logger.debug("Creating a Gemini client for a foreign event loop.")
+                client = _loop_clients[loop] = _build_client()
+            return client
+        return _client
+
+
+async def warm_up_gemini_client() -> None:
+    """Opens the client's connections ahead of the first report.
+
+    Fetches the configured model's metadata through both the async transport
+    (generation) and the sync one (caches and uploads run in threads).
+    """
+    if not settings.GEMINI_API_KEY:
+        logger.info("Skipping Gemini client warm-up: GEMINI_API_KEY not set.")
+        return
+    client = get_gemini_client()
+    started = time.perf_counter()
+    try:
+        await client.aio.models.get(model=settings.LLM_MODEL_NAME)
+        await asyncio.to_thread(client.models.get, model=settings.LLM_MODEL_NAME)
+        logger.info(f"Gemini client warmed up in {time.perf_counter() - started:.2f}s.")
+    except Exception as e:
+        logger.warning(f"Gemini client warm-up failed: {e}")
+
+
+async def close_gemini_client() -> None:
+    """Closes the connection pools of every client. Call it on the owning loop.
+
+    The clients of other loops that are still running are closed on their loop.
+    """
+    global _client, _client_loop
+    with _client_lock:
+        client, _client, _client_loop = _client, None, None
+        loop_clients = list(_loop_clients.items())
+        _loop_clients.clear()
+    for loop, loop_client in loop_clients:
+        if loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(_close_pools(loop_client), loop)
+        else:
+            _close_sync_pool(loop_client)
+    if client is None:
+        return
+    try:
+        await _close_pools(client)
+        logger.info("Closed shared Gemini client.")
+    except Exception as e:
+        logger.warning(f"Error closing the Gemini client: {e}")
@@ -0,0 +1,152 @@
+"""Registry of documents already uploaded to the Gemini File API.
+
+The File API keeps an upload for a limited time (48 hours), so the same PDF or
+photo uploaded for one report can be referenced again by later reports instead
+of being uploaded once more. The registry maps the SHA-256 of the file bytes
+(plus the MIME type) to the Gemini file name, URI and expiry. Files are no longer
+deleted right after each report; instead, entries that are about to expire are
+garbage-collected.
+"""
+
+import contextlib
+import datetime
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from google.genai import types
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiFileRegistry:
+    """SQLite-backed map from file content hash to a reusable Gemini ``File``."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """A connection committed on success, rolled back on error, then closed."""
+        with contextlib.closing(self._connect()) as conn, conn:
+            yield conn
+
+    def _init_db(self) -> None:
+        with self._transaction() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    content_hash TEXT NOT NULL,
+                    mime_type TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    uri TEXT NOT NULL,
+                    display_name TEXT,
+                    expire_time REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (content_hash, mime_type)
+                )
+                """)
+
+    def lookup(
+        self, content_hash: str, mime_type: str, min_remaining_seconds: float
+    ) -> Optional[types.File]:
+        """Returns a previously uploaded file that stays valid for at least
+        ``min_remaining_seconds``, or None."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT name, uri, display_name, expire_time FROM uploads "
+                "WHERE content_hash = ? AND mime_type = ? AND expire_time > ?",
+                (content_hash, mime_type, now + min_remaining_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE uploads SET last_used = ? WHERE content_hash = ? AND mime_type = ?",
+                (now, content_hash, mime_type),
+            )
+        name, uri, display_name, expire_time = row
+        return types.File(
+            name=name,
+            uri=uri,
+            mime_type=mime_type,
+            display_name=display_name,
+            expiration_time=datetime.datetime.fromtimestamp(
+                expire_time, tz=datetime.timezone.utc
+            ),
+        )
+
+    def register(self, content_hash: str, uploaded_file: types.File) -> None:
+        """Records a freshly uploaded file so that later reports can reuse it."""
+        if uploaded_file.expiration_time is not None:
+            expire_time = uploaded_file.expiration_time.timestamp()
+        else:
+            expire_time = time.time() + settings.GEMINI_FILE_TTL_HOURS * 3600
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads "
+                "(content_hash, mime_type, name, uri, display_name, expire_time, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    content_hash,
+                    uploaded_file.mime_type,
+                    uploaded_file.name,
+                    uploaded_file.uri,
+                    uploaded_file.display_name,
+                    expire_time,
+                    time.time(),
+                ),
+            )
+
+    def discard(self, names: List[str]) -> None:
+        """Forgets files that turned out to be unusable (e.g. deleted remotely)."""
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM uploads WHERE name = ?", [(n,) for n in names]
+            )
+
+    def pop_expiring(self, min_remaining_seconds: float) -> List[str]:
+        """Removes and returns the names of files that can no longer be reused."""
+        cutoff = time.time() + min_remaining_seconds
+        with self._transaction() as conn:
+            names = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT name FROM uploads WHERE expire_time <= ?", (cutoff,)
+                ).fetchall()
+            ]
+            conn.execute("DELETE FROM uploads WHERE expire_time <= ?", (cutoff,))
+        return names
+
+    def stats(self) -> Dict[str, int]:
+        with self._transaction() as conn:
+            (files,) = conn.execute("SELECT COUNT(*) FROM uploads").fetchone()
+        return {"files": files}
+
+
+_registry: Optional[GeminiFileRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_gemini_file_registry() -> Optional[GeminiFileRegistry]:
+    """Returns the process-wide upload registry, or None if reuse is disabled."""
+    global _registry
+    if not settings.GEMINI_FILE_REUSE_ENABLED:
+        return None
+    with _registry_lock:
+        if _registry is None:
+            db_path = settings.GEMINI_FILE_REGISTRY_PATH or os.path.join(
+                tempfile.gettempdir(), "gemini_file_registry.sqlite3"
+            )
+            _registry = GeminiFileRegistry(db_path)
+        return _registry
@@ -0,0 +1,369 @@
+"""Rate and concurrency governor shared by every call made to Gemini.
+
+All app processes (Hypercorn workers) coordinate through one SQLite file, which
+holds:
+
+- a token bucket of requests per minute (GEMINI_REQUESTS_PER_MINUTE), drawn by
+  every call: generations, uploads, cache operations and deletes;
+- a token bucket of input tokens per minute (GEMINI_TOKENS_PER_MINUTE), drawn by
+  generations with their estimated prompt size and corrected with the actual
+  usage once the response arrives;
+- leases of the generations in flight, at most GEMINI_MAX_CONCURRENT_GENERATIONS;
+- the callers waiting for capacity, at most GEMINI_MAX_QUEUED_CALLS. Past that,
+  or after GEMINI_MAX_QUEUE_WAIT_SECONDS of waiting, GeminiOverloadedError is
+  raised instead of piling up more work.
+
+A 429 / RESOURCE_EXHAUSTED answer halves both rates and pauses all callers for
+the Retry-After (or RetryInfo) delay the API suggests; every successful call
+then restores part of the rate. Throughput thus settles just under the real
+quota instead of collapsing into retries fired in lockstep.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from google.api_core import exceptions as google_exceptions
+from google.genai import errors as genai_errors
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_MIN_RATE_FACTOR = 0.1  # Rates never drop below this share of the configured quota
+_RATE_RECOVERY_STEP = 0.05  # Share of the quota restored by each successful call
+_MAX_POLL_SECONDS = 2.0  # Waiters re-check at least this often
+_DEFAULT_COOLDOWN_SECONDS = 10.0  # Pause after a 429 without a retry hint
+
+
+class GeminiOverloadedError(Exception):
+    """Raised when a Gemini call cannot be scheduled: the queue is full or the wait too long."""
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    if isinstance(
+        e, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+    ):
+        return True
+    if isinstance(e, genai_errors.APIError):
+        return e.code == 429
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429
+    return False
+
+
+def _parse_seconds(value: Any) -> Optional[float]:
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*s?\s*", str(value))
+    return float(match.group(1)) if match else None
+
+
+def retry_after_seconds(e: BaseException) -> Optional[float]:
+    """The delay a rate-limit error asks for, from Retry-After or google.rpc.RetryInfo."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        delay = _parse_seconds(headers.get("retry-after", ""))
+        if delay is not None:
+            return delay
+    details = getattr(e, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details", [])
+    if isinstance(details, list):
+        for detail in details:
+            if isinstance(detail, dict) and detail.get("@type", "").endswith(
+                "RetryInfo"
+            ):
+                return _parse_seconds(detail.get("retryDelay", ""))
+    return None
+
+
+class GeminiGovernor:
+    """SQLite-backed token buckets, generation leases and wait queue."""
+
+    def __init__(
+        self,
+        db_path: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_concurrent_generations: int,
+        max_queued_calls: int,
+    ):
+        self.db_path = db_path
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrent_generations = max_concurrent_generations
+        self.max_queued_calls = max_queued_calls
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _init_db(self) -> None:
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value REAL NOT NULL)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS slots (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+                """)
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Any:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _load_state(self, conn: sqlite3.Connection, now: float) -> Dict[str, float]:
+        """Reads the buckets, refilled for the time elapsed since the last update."""
+        state = dict(conn.execute("SELECT key, value FROM state").fetchall())
+        factor = state.get("rate_factor", 1.0)
+        elapsed = max(now - state.get("updated", now), 0.0)
+        requests_capacity = self.requests_per_minute * factor
+        tokens_capacity = self.tokens_per_minute * factor
+        state["rate_factor"] = factor
+        state["requests"] = min(
+            state.get("requests", requests_capacity) + elapsed * requests_capacity / 60,
+            requests_capacity,
+        )
+        state["tokens"] = min(
+            state.get("tokens", tokens_capacity) + elapsed * tokens_capacity / 60,
+            tokens_capacity,
+        )
+        state["cooldown_until"] = state.get("cooldown_until", 0.0)
+        state["updated"] = now
+        return state
+
+    @staticmethod
+    def _save_state(conn: sqlite3.Connection, state: Dict[str, float]) -> None:
+        conn.executemany(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+            list(state.items()),
+        )
+
+    def _enqueue(self, slot_id: str) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE expires < ?", (now,))
+            (queued,) = conn.execute(
+                "SELECT COUNT(*) FROM slots WHERE kind = 'waiting'"
+            ).fetchone()
+            if queued >= self.max_queued_calls:
+                return False
+            conn.execute(
+                "INSERT INTO slots (id, kind, expires) VALUES (?, 'waiting', ?)",
+                (slot_id, now + settings.GEMINI_MAX_QUEUE_WAIT_SECONDS + 60),
+            )
+        return True
+
+    def _try_acquire(self, slot_id: str, tokens: int, generation: bool) -> float:
+        """Takes capacity for one call; returns 0 on success, else the seconds to wait."""
+        now = time.time()
+        with self._transaction() as conn:
+            state = self._load_state(conn, now)
+            wait = state["cooldown_until"] - now
+            if generation:
+                (in_flight,) = conn.execute(
+                    "SELECT COUNT(*) FROM slots WHERE kind = 'active' AND expires >= ?",
+                    (now,),
+                ).fetchone()
+                if in_flight >= self.max_concurrent_generations:
+                    wait = max(wait, _MAX_POLL_SECONDS)
+            requests_rate = self.requests_per_minute * state["rate_factor"] / 60
+            if state["requests"] < 1:
+                wait = max(wait, (1 - state["requests"]) / requests_rate)
+            # A prompt larger than the bucket only needs a full bucket to start
+            tokens_rate = self.tokens_per_minute * state["rate_factor"] / 60
+            needed_tokens = min(tokens, tokens_rate * 60)
+            if state["tokens"] < needed_tokens:
+                wait = max(wait, (needed_tokens - state["tokens"]) / tokens_rate)
+            if wait > 0:
+                self._save_state(conn, state)
+                return wait
+
+            state["requests"] -= 1
+            state["tokens"] -= tokens
+            self._save_state(conn, state)
+            if generation:
+                conn.execute(
+                    "UPDATE slots SET kind = 'active', expires = ? WHERE id = ?",
+                    (now + settings.LLM_API_TIMEOUT_SECONDS + 60, slot_id),
+                )
+            else:
+                conn.execute("DELETE FROM slots WHERE id = ?", (slot_id,))
+        return 0.0
+
+    def _release(self, slot_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE id = ?", (slot_id,))
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, generation: bool = False, estimated_tokens: int = 0
+    ) -> AsyncIterator[None]:
+        """Waits for capacity, then runs the body as one Gemini call.
+
+        Rate-limit errors raised by the body slow every process down; other
+        outcomes, errors included (the upstream answered), count as successes. A
+        cancelled call counts as neither.
+        """
+        slot_id = uuid.uuid4().hex
+        if not await asyncio.to_thread(self._enqueue, slot_id):
+            raise GeminiOverloadedError(
+                f"Too many Gemini calls waiting ({self.max_queued_calls})."
+            )
+        deadline = time.monotonic() + settings.GEMINI_MAX_QUEUE_WAIT_SECONDS
+        acquired = False
+        try:
+            while True:
+                wait = await asyncio.to_thread(
+                    self._try_acquire, slot_id, estimated_tokens, generation
+                )
+                if wait <= 0:
+                    acquired = True
+                    break
+                if time.monotonic() + min(wait, _MAX_POLL_SECONDS) > deadline:
+                    raise GeminiOverloadedError(
+                        f"No Gemini capacity within {settings.GEMINI_MAX_QUEUE_WAIT_SECONDS} seconds."
+                    )
+                # Jitter keeps the waiters of all processes from waking up together
+                await asyncio.sleep(
+                    min(wait, _MAX_POLL_SECONDS) * random.uniform(0.8, 1.2)
+                )
+        finally:
+            if not acquired:
+                await asyncio.to_thread(self._release, slot_id)
+
+        try:
+            yield
+        except BaseException as e:
+            if is_rate_limit_error(e):
+                await asyncio.to_thread(
+                    self.record_rate_limited, retry_after_seconds(e)
+                )
+            elif isinstance(e, Exception):
+                await asyncio.to_thread(self.record_success)
+            raise
+        else:
+            await asyncio.to_thread(self.record_success)
+        finally:
+            if generation:
+                await asyncio.to_thread(self._release, slot_id)
+
+    def record_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """Halves the rates and pauses all calls after a 429."""
+        now = time.time()
+        delay = retry_after if retry_after is not None else _DEFAULT_COOLDOWN_SECONDS
+        with self._transaction() as conn:
+            state = self._load_state(conn, now)
+            state["rate_factor"] = max(state["rate_factor"] / 2, _MIN_RATE_FACTOR)
+            state["requests"] = min(
+                state["requests"], self.requests_per_minute * state["rate_factor"]
+            )
+            state["tokens"] = min(
+                state["tokens"], self.tokens_per_minute * state["rate_factor"]
+            )
+            state["cooldown_until"] = max(state["cooldown_until"], now + delay)
+            self._save_state(conn, state)
+        logger.warning(
+            f"Gemini rate limit hit: pausing calls for {delay:.1f}s, "
+            f"rates lowered to {state['rate_factor']:.0%} of the configured quota."
+        )
+
+    def record_success(self) -> None:
+        """Restores part of the rate after a rate limit, once calls succeed again."""
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM state WHERE key = 'rate_factor'"
+            ).fetchone()
+        if row is None or row[0] >= 1.0:
+            return
+        with self._transaction() as conn:
+            state = self._load_state(conn, time.time())
+            state["rate_factor"] = min(state["rate_factor"] + _RATE_RECOVERY_STEP, 1.0)
+            self._save_state(conn, state)
+
+    def record_tokens(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Charges (or refunds) the difference between a call's estimate and its usage."""
+        with self._transaction() as conn:
+            state = self._load_state(conn, time.time())
+            state["tokens"] -= actual_tokens - estimated_tokens
+            self._save_state(conn, state)
+
+    def stats(self) -> Dict[str, float]:
+        now = time.time()
+        with self._transaction() as conn:
+            state = self._load_state(conn, now)
+            counts = dict(
+                conn.execute(
+                    "SELECT kind, COUNT(*) FROM slots WHERE expires >= ? GROUP BY kind",
+                    (now,),
+                ).fetchall()
+            )
+        return {
+            "in_flight_generations": counts.get("active", 0),
+            "queued_calls": counts.get("waiting", 0),
+            "rate_factor": round(state["rate_factor"], 2),
+            "cooldown_seconds": round(max(state["cooldown_until"] - now, 0.0), 1),
+            "requests_available": int(state["requests"]),
+            "tokens_available": int(state["tokens"]),
+        }
+
+
+_governor: Optional[GeminiGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_gemini_governor() -> Optional[GeminiGovernor]:
+    """Returns the process-wide governor, or None if GEMINI_GOVERNOR_ENABLED is off."""
+    global _governor
+    if not settings.GEMINI_GOVERNOR_ENABLED:
+        return None
+    with _governor_lock:
+        if _governor is None:
+            db_path = settings.GEMINI_GOVERNOR_PATH or os.path.join(
+                tempfile.gettempdir(), "gemini_governor.sqlite3"
+            )
+            _governor = GeminiGovernor(
+                db_path,
+                requests_per_minute=settings.GEMINI_REQUESTS_PER_MINUTE,
+                tokens_per_minute=settings.GEMINI_TOKENS_PER_MINUTE,
+                max_concurrent_generations=settings.GEMINI_MAX_CONCURRENT_GENERATIONS,
+                max_queued_calls=settings.GEMINI_MAX_QUEUED_CALLS,
+            )
+        return _governor
+
+
+@contextlib.asynccontextmanager
+async def gemini_call(
+    generation: bool = False, estimated_tokens: int = 0
+) -> AsyncIterator[None]:
+    """Runs the body as one governed Gemini call (ungoverned when the governor is off)."""
+    governor = get_gemini_governor()
+    if governor is None:
+        yield
+        return
+    async with governor.slot(generation, estimated_tokens):
+        yield
@@ -0,0 +1,274 @@
+"""Background job engine used to run report generation outside the request cycle.
+
+Jobs are executed as asyncio tasks on a dedicated event loop that lives in a
+daemon thread. A fixed number of worker tasks consume the queue, so at most
+``max_workers`` reports are processed concurrently, and the queue itself is
+bounded so bursts are rejected instead of piling up without limit.
+
+Jobs are held in the memory of the process only, so the app must be served by a
+single process; jobs in flight when it stops are lost.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Coroutine, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobState:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCESS = "success"
+    ERROR = "error"
+
+    TERMINAL = (SUCCESS, ERROR)
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """In-memory record of a queued or running job."""
+
+    def __init__(self, job_id: str, payload: Dict[str, Any]):
+        self.id = job_id
+        self.payload = payload
+        self.state = JobState.QUEUED
+        self.stage = "queued"
+        self.error: Optional[str] = None
+        self.messages: List[Dict[str, str]] = []
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Set once the outcome has been reported back to the user who submitted it
+        self.delivered = False
+        self._lock = threading.Lock()
+        # Incremental output (e.g. streamed report text) for live subscribers
+        self._output: List[str] = []
+        self._output_changed = threading.Condition(self._lock)
+
+    def set_stage(self, stage: str) -> None:
+        with self._lock:
+            self.stage = stage
+        logger.info(f"Job {self.id} entered stage '{stage}'.")
+
+    def add_message(self, message: str, category: str = "info") -> None:
+        with self._lock:
+            self.messages.append({"message": message, "category": category})
+
+    def append_output(self, text: str) -> None:
+        with self._output_changed:
+            self._output.append(text)
+            self._output_changed.notify_all()
+
+    def wait_for_output(self, offset: int, timeout: float) -> List[str]:
+        """Blocks until output beyond ``offset`` exists, the job finishes, or timeout.
+
+        Returns the output chunks from ``offset`` onwards (possibly empty).
+        """
+        with self._output_changed:
+            self._output_changed.wait_for(
+                lambda: len(self._output) > offset or self.is_finished, timeout
+            )
+            return self._output[offset:]
+
+    def output_text(self) -> str:
+        with self._lock:
+            return "".join(self._output)
+
+    def mark_finished(self) -> None:
+        with self._output_changed:
+            self.finished_at = time.time()
+            self.stage = "done"
+            self._output_changed.notify_all()
+        logger.info(f"Job {self.id} finished with state '{self.state}'.")
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in JobState.TERMINAL
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "id": self.id,
+                "state": self.state,
+                "stage": self.stage,
+                "error": self.error,
+                "messages": list(self.messages),
+                "submitted_at": self.submitted_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+JobHandler = Callable[[Job], Awaitable[None]]
+StartHook = Callable[[], None]
+
+
+class JobQueue:
+    """A bounded queue of jobs processed by asyncio workers on a background loop."""
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queue_size: int = 20,
+        retention_seconds: int = 3600,
+    ):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.retention_seconds = retention_seconds
+        self._handler: Optional[JobHandler] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._queue: Optional["asyncio.Queue[Job]"] = None
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Deque[str] = collections.deque()
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+        self._start_hooks: List[StartHook] = []
+
+    def set_handler(self, handler: JobHandler) -> None:
+        self._handler = handler
+
+    def add_start_hook(self, hook: StartHook) -> None:
+        """Registers a function called each time the loop starts, e.g. to schedule
+        background tasks on it with run_coroutine."""
+        self._start_hooks.append(hook)
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Starts the background event loop and its worker tasks (idempotent)."""
+        with self._lock:
+            if self.is_running:
+                return
+            self._started.clear()
+            self._thread = threading.Thread(
+                target=self._run_loop, name="report-job-loop", daemon=True
+            )
+            self._thread.start()
+        self._started.wait()
+        logger.info(
+            f"Job queue started with {self.max_workers} workers (max queue size {self.max_queue_size})."
+        )
+        for hook in self._start_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Job queue start hook failed: {e}", exc_info=True)
+
+    def _run_loop(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        for worker_index in range(self.max_workers):
+            loop.create_task(self._worker(worker_index))
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+    async def _worker(self, worker_index: int) -> None:
+        assert self._queue is not None
+        while True:
+            job = await self._queue.get()
+            with self._lock:
+                if job.id in self._pending:
+                    self._pending.remove(job.id)
+            job.state = JobState.RUNNING
+            job.started_at = time.time()
+            logger.info(f"Worker {worker_index} picked up job {job.id}.")
+            try:
+                if self._handler is None:
+                    raise RuntimeError("No job handler has been registered.")
+                await self._handler(job)
+                if job.state == JobState.RUNNING:
+                    job.state = JobState.SUCCESS
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+                job.state = JobState.ERROR
+                job.error = job.error or str(e)
+            finally:
+                job.mark_finished()
+                self._queue.task_done()
+
+    def submit(self, job_id: str, payload: Dict[str, Any]) -> Job:
+        """Enqueues a job and returns immediately.
+
+        Raises:
+            JobQueueFullError: If ``max_queue_size`` jobs are already waiting.
+        """
+        self.start()
+        job = Job(job_id, payload)
+        with self._lock:
+            self._prune_finished_jobs()
+            if len(self._pending) >= self.max_queue_size:
+                raise JobQueueFullError(
+                    f"Job queue is full ({self.max_queue_size} jobs waiting)."
+                )
+            self._jobs[job_id] = job
+            self._pending.append(job_id)
+        assert self._loop is not None and self._queue is not None
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        logger.info(f"Enqueued job {job_id}. Queue depth: {self.queue_depth()}.")
+        return job
+
+    def run_coroutine(
+        self, coro: Coroutine[Any, Any, Any]
+    ) -> "concurrent.futures.Future[Any]":
+        """Schedules a coroutine on the job loop from any thread."""
+        self.start()
+        assert self._loop is not None
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """Returns the 1-based position of a waiting job, or None if not waiting."""
+        with self._lock:
+            try:
+                return self._pending.index(job_id) + 1
+            except ValueError:
+                return None
+
+    def _prune_finished_jobs(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.is_finished and job.finished_at and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self) -> None:
+        """Stops the background loop. Jobs still running are abandoned."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._thread = None
+        if loop is not None and thread is not None and thread.is_alive():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+            logger.info("Job queue stopped.")
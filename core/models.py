@@ -34,12 +34,26 @@ class ReportLog(db.Model):
     api_cost_usd = Column(Float, nullable=True)
     error_message = Column(Text, nullable=True)
 
+    # Usage reported by the LLM API for the generation call
+    prompt_tokens = Column(Integer, nullable=True)  # Includes cached_tokens
+    cached_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    thinking_tokens = Column(Integer, nullable=True)
+    upload_bytes = Column(Integer, nullable=True)
+    # JSON object of seconds per stage (extraction, prompt_cache, upload, generation)
+    stage_timings = Column(Text, nullable=True)
+
     # The full, raw text generated by the LLM
     llm_raw_response = Column(Text, nullable=True)
 
     # The final text after user edits (if any)
     final_report_text = Column(Text, nullable=True)
 
+    # Gemini cache holding the claim's documents for follow-up edits; shared by
+    # the reports generated from the same documents, deleted with the last one
+    context_cache_name = Column(String(255), nullable=True)
+    context_cache_expires_at = Column(DateTime, nullable=True)
+
     # Establish the one-to-many relationship
     documents = relationship("DocumentLog", back_populates="report")
 
@@ -1,4 +1,12 @@
+import hashlib
+import logging
 import os
+import stat
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 
 def _load_prompt_from_file(file_path: str) -> str:
@@ -24,7 +32,113 @@ _system_instruction_path = os.path.join(_current_dir, "system_instruction.txt")
 _style_guide_path = os.path.join(_current_dir, "style_guide.txt")
 _schema_report_path = os.path.join(_current_dir, "schema_report.txt")
 
-# Load the prompts from their files
+# The prompts as loaded at import time. Code that must see edits made while the
+# app is running should use prompt_registry.get_prompts() instead.
 SYSTEM_INSTRUCTION: str = _load_prompt_from_file(_system_instruction_path)
 GUIDA_STILE_TERMINOLOGIA_ED_ESEMPI: str = _load_prompt_from_file(_style_guide_path)
 SCHEMA_REPORT: str = _load_prompt_from_file(_schema_report_path)
+
+
+class PromptSet:
+    """A consistent snapshot of the three prompt texts and their combined hash."""
+
+    def __init__(self, system_instruction: str, style_guide: str, schema_report: str):
+        self.system_instruction = system_instruction
+        self.style_guide = style_guide
+        self.schema_report = schema_report
+        digest = hashlib.sha256()
+        for text in (style_guide, schema_report, system_instruction):
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\0")
+        self.hash = digest.hexdigest()
+
+
+class PromptRegistry:
+    """Serves the prompt files, reloading them when they change on disk.
+
+    Each access compares the files' modification time, size and inode with those
+    seen at the last load, so edits made from the admin panel (or by hand, or by
+    another process) are picked up on the next report without a restart.
+    Listeners are notified whenever the prompt texts actually change.
+    """
+
+    def __init__(self, paths: Dict[str, str]):
+        self.paths = paths
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple[Any, ...]] = None
+        self._prompts: Optional[PromptSet] = None
+        self._listeners: List[Callable[[PromptSet], None]] = []
+
+    def _file_signature(self) -> Tuple[Any, ...]:
+        signature = []
+        for path in self.paths.values():
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def add_change_listener(self, listener: Callable[[PromptSet], None]) -> None:
+        self._listeners.append(listener)
+
+    def get_prompts(self) -> PromptSet:
+        """Returns the current prompts, reloading them if a file has changed."""
+        changed: Optional[PromptSet] = None
+        with self._lock:
+            signature = self._file_signature()
+            if self._prompts is None or signature != self._signature:
+                prompts = PromptSet(
+                    system_instruction=_load_prompt_from_file(
+                        self.paths["system_instruction"]
+                    ),
+                    style_guide=_load_prompt_from_file(self.paths["style_guide"]),
+                    schema_report=_load_prompt_from_file(self.paths["schema_report"]),
+                )
+                if self._prompts is not None and prompts.hash != self._prompts.hash:
+                    changed = prompts
+                self._prompts, self._signature = prompts, signature
+            current = self._prompts
+        if changed is not None:
+            logger.info(f"Prompt files changed; new prompt hash {changed.hash[:12]}.")
+            for listener in self._listeners:
+                try:
+                    listener(changed)
+                except Exception as e:
+                    logger.error(f"Prompt change listener failed: {e}", exc_info=True)
+        return current
+
+    def write(self, name: str, content: str) -> None:
+        """Atomically replaces a prompt file and reloads the prompts.
+
+        Raises:
+            KeyError: If ``name`` is not a known prompt.
+            OSError: If the file cannot be written.
+        """
+        path = self.paths[name]
+        directory = os.path.dirname(path)
+        fd, temp_path = tempfile.mkstemp(
+            dir=directory, prefix=".prompt-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+            # mkstemp creates the file as 0600; keep the permissions of the prompt
+            if os.path.exists(path):
+                os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+            # Readers see either the old or the new file, never a partial one.
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.get_prompts()
+
+
+prompt_registry = PromptRegistry(
+    {
+        "system_instruction": _system_instruction_path,
+        "style_guide": _style_guide_path,
+        "schema_report": _schema_report_path,
+    }
+)
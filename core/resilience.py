@@ -0,0 +1,266 @@
+"""Retries and circuit breaking for the calls made to Gemini.
+
+Each kind of operation (generation, upload, cache, delete) has a
+ResiliencePolicy made of:
+
+- decorrelated-jitter backoff: every wait is drawn between the base delay and
+  three times the previous one (capped at LLM_API_RETRY_MAX_WAIT_SECONDS), so
+  that callers failing together spread their retries out;
+- a retry budget: every call deposits LLM_API_RETRY_BUDGET_RATIO of a retry and
+  every retry withdraws one, with a floor of LLM_API_RETRY_BUDGET_MIN_PER_MINUTE.
+  During an outage retries stop once the budget is spent instead of multiplying
+  the load;
+- a circuit breaker: after CIRCUIT_BREAKER_FAILURE_THRESHOLD consecutive
+  transient failures the operation fails fast with CircuitOpenError for
+  CIRCUIT_BREAKER_RESET_SECONDS, then a single probe call decides whether it
+  closes again.
+
+Rate-limit errors are retried but do not trip the breaker: the upstream is
+healthy, and the pause is managed by core.gemini_governor. Errors that are not
+transient (e.g. 400 Bad Request) are never retried and count as a healthy
+answer. The state is kept per process and shown on the admin system page.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from core.config import settings
+from core.gemini_governor import is_rate_limit_error, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(
+            f"Circuit breaker '{name}' is open; calls resume in {retry_in:.0f}s."
+        )
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._last_failure: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self._state == STATE_OPEN:
+                retry_in = self._opened_at + self.reset_seconds - time.monotonic()
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self._state = STATE_HALF_OPEN
+            if self._state == STATE_HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.name, self.reset_seconds)
+                self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info(f"Circuit breaker '{self.name}' closed again.")
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error: BaseException) -> None:
+        with self._lock:
+            self._failures += 1
+            self._last_failure = f"{type(error).__name__}: {error}"[:200]
+            self._probe_in_flight = False
+            if (
+                self._state == STATE_HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                if self._state != STATE_OPEN:
+                    logger.error(
+                        f"Circuit breaker '{self.name}' opened after {self._failures} "
+                        f"failures; failing fast for {self.reset_seconds}s."
+                    )
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Frees the half-open probe slot after a call that proved nothing either way."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if (
+                self._state == STATE_OPEN
+                and time.monotonic() >= self._opened_at + self.reset_seconds
+            ):
+                return STATE_HALF_OPEN
+            return self._state
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            retry_in = 0.0
+            if state == STATE_OPEN:
+                retry_in = self._opened_at + self.reset_seconds - time.monotonic()
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_in_seconds": round(max(retry_in, 0.0)),
+                "last_failure": self._last_failure,
+            }
+
+
+class RetryBudget:
+    """Caps retries to a share of recent calls, plus a small steady allowance."""
+
+    def __init__(self, ratio: float, min_per_minute: float):
+        self.ratio = ratio
+        self.min_per_minute = min_per_minute
+        self._capacity = max(min_per_minute, 1.0)
+        self._balance = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._balance = min(
+            self._balance + (now - self._updated) * self.min_per_minute / 60,
+            self._capacity,
+        )
+        self._updated = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill()
+            self._balance = min(self._balance + self.ratio, self._capacity)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    @property
+    def balance(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._balance
+
+
+def _decorrelated_jitter(previous: float) -> float:
+    base = settings.LLM_API_RETRY_WAIT_SECONDS
+    return min(
+        settings.LLM_API_RETRY_MAX_WAIT_SECONDS,
+        random.uniform(base, max(previous * 3, base)),
+    )
+
+
+class ResiliencePolicy:
+    """Retry budget, backoff and circuit breaker of one kind of Gemini operation."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+            settings.CIRCUIT_BREAKER_RESET_SECONDS,
+        )
+        self.budget = RetryBudget(
+            settings.LLM_API_RETRY_BUDGET_RATIO,
+            settings.LLM_API_RETRY_BUDGET_MIN_PER_MINUTE,
+        )
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[T]],
+        is_transient: Callable[[BaseException], bool],
+    ) -> T:
+        """Awaits ``func()``, retrying transient errors within the attempts and budget.
+
+        Raises CircuitOpenError without calling ``func`` while the breaker is open,
+        and the last error once retries are exhausted or not allowed.
+        """
+        self.budget.deposit()
+        delay = 0.0
+        attempt = 1
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await func()
+            except Exception as e:
+                if not is_transient(e):
+                    # The upstream answered; the request itself was at fault
+                    self.breaker.record_success()
+                    raise
+                if is_rate_limit_error(e):
+                    self.breaker.release_probe()
+                else:
+                    self.breaker.record_failure(e)
+                if attempt >= settings.LLM_API_RETRY_ATTEMPTS:
+                    raise
+                if not self.budget.try_withdraw():
+                    logger.warning(
+                        f"Retry budget of '{self.name}' exhausted; not retrying {e!r}."
+                    )
+                    raise
+                delay = _decorrelated_jitter(delay)
+                delay = max(delay, retry_after_seconds(e) or 0.0)
+                logger.warning(
+                    f"'{self.name}' attempt {attempt} failed ({e!r}); retrying in {delay:.1f}s."
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled: nothing was learned about the upstream
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+
+_policies: Dict[str, ResiliencePolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(name: str) -> ResiliencePolicy:
+    """Returns the process-wide policy of an operation, creating it on first use."""
+    with _policies_lock:
+        if name not in _policies:
+            _policies[name] = ResiliencePolicy(name)
+        return _policies[name]
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """State of every breaker and retry budget of this process, for the admin page."""
+    with _policies_lock:
+        policies = list(_policies.values())
+    return [
+        {**policy.breaker.snapshot(), "retry_budget": round(policy.budget.balance, 1)}
+        for policy in sorted(policies, key=lambda p: p.name)
+    ]
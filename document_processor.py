@@ -1,22 +1,34 @@
-import base64  # Added for decoding attachments
+import csv
+import datetime
 import functools
+import hashlib
 import io
 import logging
 import mimetypes  # Added for MIME type guessing
 import os
-import pathlib  # Added for path manipulation
-from typing import Any, Callable, Dict, List, TypeVar, Union, cast  # Added cast
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Callable, Dict, Iterator, List, Set, TypeVar, Union
+from xml.etree import ElementTree
 
 import fitz  # PyMuPDF for PDFs - still used for basic validation or if needed for non-AI tasks
-import mailparser  # Added for .eml files
 import openpyxl  # For XLSX files
-from docx import Document as DocxDocument
 
 # import pytesseract # For OCR - No longer needed for PDF/image text extraction by LLM
 from PIL import (  # For image handling - potentially for validation, no longer for OCR
     Image,
 )
 
+import eml_parser
+import extractor_registry
+import token_budget
+from core.config import settings
+from core.extraction_cache import get_extraction_cache, hash_file
+from html_to_text import html_to_text
+from image_dedup import try_perceptual_hash
+from image_normalizer import try_normalize_image
+
 logger = logging.getLogger(__name__)
 
 # pytesseract.pytesseract.tesseract_cmd = r'<full_path_to_your_tesseract_executable>' # No longer needed
@@ -78,31 +90,148 @@ def handle_extraction_errors(
     return decorator
 
 
+def _page_needs_vision(page: Any, text: str) -> bool:
+    """True for scanned or image-heavy pages whose text layer does not carry their content."""
+    if len(text) < settings.PDF_TEXT_MIN_CHARS_PER_PAGE:
+        return True
+    # Broken font encodings extract as replacement characters
+    if text.count("\ufffd") > len(text) * 0.05:
+        return True
+    page_area = page.rect.get_area()
+    if not page_area:
+        return True
+    image_area = sum(
+        (fitz.Rect(info["bbox"]) & page.rect).get_area()
+        for info in page.get_image_info()
+    )
+    return image_area / page_area > settings.PDF_MAX_IMAGE_COVERAGE
+
+
+def _write_page_subset(doc: Any, page_numbers: List[int], pdf_path: str) -> str:
+    """Saves the given pages of ``doc`` as a new PDF next to the original."""
+    stem, _ = os.path.splitext(pdf_path)
+    subset_path = f"{stem}_pagine_scansionate.pdf"
+    subset = fitz.open()
+    try:
+        for number in page_numbers:
+            subset.insert_pdf(doc, from_page=number, to_page=number)
+        subset.save(subset_path, garbage=3, deflate=True)
+    finally:
+        subset.close()
+    return subset_path
+
+
+def _split_pdf_by_text_layer(
+    doc: Any, pdf_path: str
+) -> Union[Dict[str, Any], List[Dict[str, Any]], None]:
+    """Extracts the text of pages that have a usable text layer.
+
+    Returns a text part if every page has one, a text part plus a vision part for a
+    sub-PDF of the remaining pages if only some do, and None if none do.
+    """
+    filename = os.path.basename(pdf_path)
+    page_texts: List[str] = []
+    vision_pages: List[int] = []
+    for page in doc:
+        text = page.get_text("text").strip()
+        if _page_needs_vision(page, text):
+            vision_pages.append(page.number)
+            page_texts.append("")
+        else:
+            page_texts.append(text)
+
+    if len(vision_pages) == len(page_texts):
+        return None
+
+    text_part = {
+        "type": "text",
+        "filename": filename,
+        "original_filetype": "pdf",
+    }
+    if not vision_pages:
+        text_part["content"] = "\n\n".join(
+            f"--- Pagina {number} ---\n{text}"
+            for number, text in enumerate(page_texts, start=1)
+        )
+        logger.info(
+            f"Using the text layer of all {len(page_texts)} pages of {filename}."
+        )
+        return text_part
+
+    subset_path = _write_page_subset(doc, vision_pages, pdf_path)
+    subset_name = os.path.basename(subset_path)
+    text_part["content"] = "\n\n".join(
+        (
+            f"--- Pagina {number}: scansione, vedi il documento {subset_name} ---"
+            if number - 1 in vision_pages
+            else f"--- Pagina {number} ---\n{text}"
+        )
+        for number, text in enumerate(page_texts, start=1)
+    )
+    logger.info(
+        f"Using the text layer of {len(page_texts) - len(vision_pages)} pages of {filename}; "
+        f"{len(vision_pages)} pages go to the model as {subset_name}."
+    )
+    return [
+        text_part,
+        {
+            "type": "vision",
+            "path": subset_path,
+            "mime_type": "application/pdf",
+            "filename": subset_name,
+            "page_count": len(vision_pages),
+        },
+    ]
+
+
 # PDF and Image "extraction" functions will now just return file info for the LLM
 @handle_extraction_errors()
-def prepare_pdf_for_llm(pdf_path: str) -> Dict[str, str]:
-    """Prepares PDF file information for LLM processing."""
+def prepare_pdf_for_llm(
+    pdf_path: str,
+) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """Prepares PDF file information for LLM processing.
+
+    Pages with a usable text layer are sent as text; the whole file (or a sub-PDF
+    of the scanned and image-heavy pages) is sent to the model as a vision file.
+    """
     # Basic validation: can it be opened?
     try:
         doc = fitz.open(pdf_path)
-        doc.close()
     except Exception as e:
         logger.error(f"PDF file {pdf_path} is likely corrupted or not a valid PDF: {e}")
         raise  # Re-raise to be caught by decorator
+    try:
+        page_count = doc.page_count  # Used by the token budget planner
+        if settings.PDF_TEXT_LAYER_ENABLED:
+            try:
+                split = _split_pdf_by_text_layer(doc, pdf_path)
+                if split is not None:
+                    return split
+            except Exception as e:
+                logger.warning(
+                    f"Could not read the text layer of {pdf_path}, sending it as a whole: {e}"
+                )
+    finally:
+        doc.close()
     return {
         "type": "vision",
         "path": pdf_path,
         "mime_type": "application/pdf",
         "filename": os.path.basename(pdf_path),
+        "page_count": page_count,
     }
 
 
 @handle_extraction_errors()
-def prepare_image_for_llm(image_path: str) -> Dict[str, str]:
+def prepare_image_for_llm(image_path: str) -> Dict[str, Any]:
     """Prepares image file information for LLM processing."""
     # Basic validation: can it be opened by PIL?
     try:
         img = Image.open(image_path)
+        # Hashed here, while the image is open, to find near-duplicates later
+        dhash = try_perceptual_hash(img)
+        # The original's resolution tells which near-duplicate is the sharper one
+        source_width, source_height = img.width, img.height
         img.close()
     except Exception as e:
         logger.error(
@@ -116,48 +245,239 @@ def prepare_image_for_llm(image_path: str) -> Dict[str, str]:
             f"Could not determine a valid image MIME type for {image_path}, defaulting to application/octet-stream."
         )
         mime_type = "application/octet-stream"  # Fallback, though Gemini might reject
+
+    # Send a downsized, metadata-free copy; the original if that is not possible
+    normalized = try_normalize_image(image_path)
+    if normalized is not None:
+        return {
+            "type": "vision",
+            "path": normalized.path,
+            "mime_type": normalized.mime_type,
+            "filename": os.path.basename(image_path),
+            "width": normalized.width,
+            "height": normalized.height,
+            "source_width": source_width,
+            "source_height": source_height,
+            "dhash": dhash,
+        }
     return {
         "type": "vision",
         "path": image_path,
         "mime_type": mime_type,
         "filename": os.path.basename(image_path),
+        "source_width": source_width,
+        "source_height": source_height,
+        "dhash": dhash,
     }
 
 
+def _max_extracted_chars() -> int:
+    """Characters of text beyond which an extractor stops: more can never be sent."""
+    return int(
+        token_budget.available_input_tokens() * settings.TOKEN_ESTIMATE_CHARS_PER_TOKEN
+    )
+
+
+CONTEXT_LIMIT_NOTICE = (
+    "[AVVISO: estrazione interrotta, il file supera il limite di contesto del modello]"
+)
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+
+def _iter_docx_blocks(xml_file: IO[bytes]) -> Iterator[str]:
+    """Yields the paragraphs and table rows of a WordprocessingML part in document order.
+
+    Table rows are yielded as their cell texts joined by " | ", with an empty
+    block before and after each table. Nested tables and text boxes are folded
+    into the cell or paragraph that contains them.
+    """
+    paragraphs: List[List[str]] = []  # Runs of the open paragraphs, innermost last
+    cells: List[List[str]] = []  # Paragraphs of the open table cells
+    rows: List[List[str]] = []  # Cell texts of the open table rows
+    fallback_depth = 0  # Legacy copies of text boxes repeat the same text
+
+    for event, elem in ElementTree.iterparse(xml_file, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == _MC_FALLBACK:
+                fallback_depth += 1
+            elif fallback_depth:
+                continue
+            elif tag == _W_NS + "p":
+                paragraphs.append([])
+            elif tag == _W_NS + "tc":
+                cells.append([])
+            elif tag == _W_NS + "tr":
+                rows.append([])
+            elif tag == _W_NS + "tbl" and not cells:
+                yield ""
+            continue
+
+        if tag == _MC_FALLBACK:
+            fallback_depth -= 1
+        elif fallback_depth:
+            continue
+        elif tag == _W_NS + "t" and paragraphs:
+            paragraphs[-1].append(elem.text or "")
+        elif tag == _W_NS + "tab" and paragraphs:
+            paragraphs[-1].append("\t")
+        elif tag in (_W_NS + "br", _W_NS + "cr") and paragraphs:
+            paragraphs[-1].append("\n")
+        elif tag == _W_NS + "p":
+            text = "".join(paragraphs.pop())
+            if paragraphs:
+                paragraphs[-1].append(f" {text} ")
+            elif cells:
+                cells[-1].append(text)
+            else:
+                yield text
+                elem.clear()
+        elif tag == _W_NS + "tc":
+            rows[-1].append(" ".join(p.strip() for p in cells.pop() if p.strip()))
+        elif tag == _W_NS + "tr":
+            row = rows.pop()
+            if any(row):
+                if cells:
+                    cells[-1].append(" | ".join(row))
+                else:
+                    yield " | ".join(row)
+            if not cells:
+                elem.clear()
+        elif tag == _W_NS + "tbl" and not cells:
+            yield ""
+            elem.clear()
+
+
 @handle_extraction_errors(
     {"type": "text", "content": "", "filename": ""}
 )  # filename will be overwritten
 def extract_text_from_docx(docx_path: str) -> Dict[str, str]:
-    """Extracts text from a DOCX file."""
-    doc = DocxDocument(docx_path)
-    full_text: List[str] = [para.text for para in doc.paragraphs]
+    """Extracts text from a DOCX file, including tables, headers and footers.
+
+    The XML parts are read straight from the archive with an incremental
+    parser instead of building the python-docx object model. Headers come
+    first and footers last (identical ones only once); the body keeps
+    paragraphs and tables in document order.
+    """
+    max_chars = _max_extracted_chars()
+    sections: List[str] = []
+    total_chars = 0
+    truncated = False
+
+    with zipfile.ZipFile(docx_path) as archive:
+        names = archive.namelist()
+        headers = sorted(n for n in names if re.fullmatch(r"word/header\d*\.xml", n))
+        footers = sorted(n for n in names if re.fullmatch(r"word/footer\d*\.xml", n))
+        parts = [(n, "Header") for n in headers]
+        parts.append(("word/document.xml", ""))
+        parts.extend((n, "Footer") for n in footers)
+
+        seen_texts: Set[str] = set()
+        for part_name, label in parts:
+            lines: List[str] = []
+            with archive.open(part_name) as xml_file:
+                for block in _iter_docx_blocks(xml_file):
+                    if not block.strip():
+                        if not lines or not lines[-1]:
+                            continue  # Runs of empty paragraphs become one blank line
+                        block = ""
+                    lines.append(block)
+                    total_chars += len(block) + 1
+                    if total_chars > max_chars:
+                        truncated = True
+                        break
+            text = "\n".join(lines).strip()
+            if not text or (label and text in seen_texts):
+                continue
+            seen_texts.add(text)
+            sections.append(f"--- {label} ---\n{text}" if label else text)
+            if truncated:
+                logger.warning(
+                    f"Stopped reading {docx_path} at {part_name}: "
+                    f"over {max_chars} characters, more than the model can take."
+                )
+                sections.append(CONTEXT_LIMIT_NOTICE)
+                break
+
     return {
         "type": "text",
-        "content": "\n".join(full_text),
+        "content": "\n\n".join(sections),
         "filename": os.path.basename(docx_path),
     }
 
 
+def _format_xlsx_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        if value.time() == datetime.time(0):
+            return value.date().isoformat()
+        return value.isoformat(sep=" ")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
 @handle_extraction_errors(
     {"type": "text", "content": "", "filename": ""}
 )  # filename will be overwritten
 def extract_text_from_xlsx(xlsx_path: str) -> Dict[str, str]:
-    """Extracts text from an XLSX file, converting sheets to CSV-like text."""
-    text_content: str = ""
-    workbook = openpyxl.load_workbook(xlsx_path)
-    for sheet_name in workbook.sheetnames:
-        text_content += f"--- Sheet: {sheet_name} ---\n"
-        sheet = workbook[sheet_name]
-        for row in sheet.iter_rows():
-            row_values: List[str] = [
-                str(cell.value) if cell.value is not None else "" for cell in row
-            ]
-            text_content += ",".join(row_values) + "\n"
-        text_content += "\n"
-    workbook.close()
+    """Extracts text from an XLSX file, converting sheets to CSV text.
+
+    The workbook is streamed in read-only, values-only mode. Empty trailing
+    cells and rows are dropped (runs of empty rows inside a sheet become one
+    blank line), and extraction stops once the text can no longer fit in the
+    model's context.
+    """
+    max_chars = _max_extracted_chars()
+    chunks: List[str] = []
+    total_chars = 0
+    truncated = False
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    workbook = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            # Formatting often inflates the declared dimensions; only stored rows are read
+            sheet.reset_dimensions()
+            chunks.append(f"--- Sheet: {sheet.title} ---\n")
+            has_rows = blank_pending = False
+            for row in sheet.iter_rows(values_only=True):
+                values = [_format_xlsx_value(value) for value in row]
+                while values and not values[-1]:
+                    values.pop()
+                if not values:
+                    blank_pending = has_rows
+                    continue
+                if blank_pending:
+                    chunks.append("\n")
+                    blank_pending = False
+                has_rows = True
+                writer.writerow(values)
+                line = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                chunks.append(line)
+                total_chars += len(line)
+                if total_chars > max_chars:
+                    truncated = True
+                    break
+            chunks.append("\n")
+            if truncated:
+                logger.warning(
+                    f"Stopped reading {xlsx_path} at sheet {sheet.title}: "
+                    f"over {max_chars} characters, more than the model can take."
+                )
+                chunks.append(CONTEXT_LIMIT_NOTICE + "\n")
+                break
+    finally:
+        workbook.close()
     return {
         "type": "text",
-        "content": text_content,
+        "content": "".join(chunks),
         "filename": os.path.basename(xlsx_path),
     }
 
@@ -172,185 +492,334 @@ def extract_text_from_txt(txt_path: str) -> Dict[str, str]:
     return {"type": "text", "content": content, "filename": os.path.basename(txt_path)}
 
 
+_HTML_CHARSET_RE = re.compile(rb"<meta[^>]+charset=[\"']?([\w-]+)", re.IGNORECASE)
+
+
+@handle_extraction_errors({"type": "text", "content": "", "filename": ""})
+def extract_text_from_html(html_path: str) -> Dict[str, str]:
+    """Extracts the readable text of an HTML file, without markup, styles or scripts."""
+    with open(html_path, "rb") as f:
+        data = f.read()
+    match = _HTML_CHARSET_RE.search(data[:4096])
+    charset = match.group(1).decode("ascii") if match else "utf-8"
+    try:
+        html = data.decode(charset, errors="replace")
+    except LookupError:
+        html = data.decode("utf-8", errors="replace")
+    return {
+        "type": "text",
+        "content": html_to_text(html),
+        "filename": os.path.basename(html_path),
+    }
+
+
+_EML_HEADER_LABELS = {
+    "From": "Da",
+    "To": "A",
+    "Cc": "Cc",
+    "Date": "Data",
+    "Subject": "Oggetto",
+}
+
+
 @handle_extraction_errors(
     []
 )  # On error, return an empty list to match the new signature
-def process_eml_file(eml_path: str, upload_folder: str) -> List[Dict[str, Any]]:
+def process_eml_file(
+    eml_path: str, upload_folder: str, depth: int = 0
+) -> List[Dict[str, Any]]:
     """
     Processes an .eml file, extracting its text body and saving/processing attachments.
     Returns a FLAT LIST of dictionaries, one for the text content and one for each processed attachment part.
-    """
-    mail = mailparser.parse_from_file(eml_path)
 
-    # The list that will be returned, containing all content parts from the EML.
-    all_parts: List[Dict[str, Any]] = []
-
-    # Extract plain text body
-    # Prioritize text_plain, then html (converted to text by mailparser), then body
-    text_content = ""
-    if mail.text_plain:
-        text_content = "\n".join(mail.text_plain)
-    elif mail.text_html:
-        text_content = "\n".join(
-            mail.text_html
-        )  # mailparser often provides a text version from html
+    The message is parsed by eml_parser, which streams attachments to disk within
+    the configured size caps. Attachments are then processed concurrently;
+    forwarded messages are followed up to EML_MAX_NESTING_DEPTH levels.
+    """
+    attachments_dir = os.path.join(upload_folder, "email_attachments")
+    parsed = eml_parser.parse_eml(eml_path, attachments_dir)
+
+    # Prioritize text_plain, then html converted to text
+    if parsed.text_plain:
+        body = "\n".join(parsed.text_plain)
+    elif parsed.text_html:
+        body = "\n\n".join(html_to_text(html) for html in parsed.text_html)
     else:
-        text_content = mail.body if mail.body else ""
-        if not text_content:
-            logger.warning(
-                f"EML file {eml_path} has no discernible text body (text_plain, text_html, or body)."
-            )
+        body = ""
+        logger.warning(f"EML file {eml_path} has no discernible text body.")
+    header_block = "\n".join(
+        f"{_EML_HEADER_LABELS[name]}: {value}" for name, value in parsed.headers.items()
+    )
 
-    # Add the main email body as the first part
-    all_parts.append(
+    # The list that will be returned, containing all content parts from the EML.
+    # The main email body comes first
+    all_parts: List[Dict[str, Any]] = [
         {
             "type": "text",
-            "content": text_content,
+            "content": f"{header_block}\n\n{body}" if header_block else body,
             "filename": f"{os.path.basename(eml_path)} (body)",  # Clarify this is the body
             "original_filetype": "eml",
         }
-    )
-
-    # Ensure the 'out' directory for attachments exists within the upload_folder
-    attachments_output_dir = pathlib.Path(upload_folder) / "email_attachments"
-    attachments_output_dir.mkdir(parents=True, exist_ok=True)
-
-    for attachment in mail.attachments:
-        original_filename = attachment.get("filename", "untitled_attachment")
-        payload = attachment.get("payload", "")
-
-        if not payload:
+    ]
+
+    def _process_attachment(
+        attachment: eml_parser.EmailAttachment,
+    ) -> List[Dict[str, Any]]:
+        if attachment.path is None:
+            return [
+                {
+                    "type": "error",
+                    "filename": attachment.filename,
+                    "message": f"Allegato non elaborato ({attachment.skipped_reason})",
+                }
+            ]
+        # Forwarded messages are recognized by content, whatever their file name
+        attachment_type = extractor_registry.sniff_file_type(attachment.path)
+        if attachment_type is not None and attachment_type.name == "eml":
+            if depth >= settings.EML_MAX_NESTING_DEPTH:
+                logger.warning(
+                    f"Not opening {attachment.filename} from {eml_path}: "
+                    f"more than {settings.EML_MAX_NESTING_DEPTH} nested emails."
+                )
+                return [
+                    {
+                        "type": "error",
+                        "filename": attachment.filename,
+                        "message": "Messaggio inoltrato non elaborato (troppi livelli di inoltro)",
+                    }
+                ]
+            nested = process_eml_file(attachment.path, upload_folder, depth + 1)
+            return nested if isinstance(nested, list) else []
+
+        # Let process_uploaded_file handle filtering of the attachment types.
+        attachment_parts = process_uploaded_file(attachment.path, upload_folder)
+        if isinstance(attachment_parts, list):
+            return attachment_parts
+        if attachment_parts.get("type") in ["error", "unsupported"]:
+            # Log error/unsupported cases but don't add them to the parts list
             logger.warning(
-                f"Attachment '{original_filename}' in {eml_path} has no payload. Skipping."
+                f"Could not process or skipped attachment '{attachment.filename}' from {eml_path}. Info: {attachment_parts}"
             )
-            continue
+            return []
+        return [attachment_parts]
+
+    if len(parsed.attachments) > 1 and settings.EML_ATTACHMENT_WORKERS > 1:
+        with ThreadPoolExecutor(
+            max_workers=settings.EML_ATTACHMENT_WORKERS
+        ) as executor:
+            results = list(executor.map(_process_attachment, parsed.attachments))
+    else:
+        results = [_process_attachment(a) for a in parsed.attachments]
+    for attachment_parts in results:
+        all_parts.extend(attachment_parts)
 
-        # CORRECTED LOGIC: Attempt to process ALL attachments, letting process_uploaded_file handle filtering.
-        try:
-            decoded_payload = base64.b64decode(payload)
-            # Sanitize filename (simple sanitization)
-            safe_filename = "".join(
-                c if c.isalnum() or c in (".", "_", "-") else "_"
-                for c in original_filename
-            )
-            if not safe_filename:
-                content_type = attachment.get("mail_content_type", "")
-                safe_filename = f"attachment_{content_type.split('/')[-1] if '/' in content_type else 'bin'}"
-
-            attachment_save_path = attachments_output_dir / safe_filename
-
-            # Avoid overwriting if file with same name exists by appending a number
-            counter = 1
-            temp_path = attachment_save_path
-            while temp_path.exists():
-                name_part, ext_part = temp_path.stem, temp_path.suffix
-                # Remove previous counter if exists to avoid names like file_1_2_3
-                if name_part.endswith(f"_{counter-1}") and counter > 1:
-                    name_part = name_part[: -(len(str(counter - 1)) + 1)]
-                temp_path = (
-                    attachments_output_dir / f"{name_part}_{counter}{ext_part}"
-                )
-                counter += 1
-            attachment_save_path = temp_path
+    return all_parts
 
-            with open(attachment_save_path, "wb") as f:
-                f.write(decoded_payload)
-            logger.info(
-                f"Saved attachment '{attachment_save_path.name}' from {eml_path} to {attachments_output_dir}"
-            )
 
-            # Recursively process the saved attachment.
-            # This will now correctly handle .docx, .xlsx, .txt, etc., in addition to PDF/images.
-            attachment_parts = process_uploaded_file(
-                str(attachment_save_path), upload_folder
-            )
+def _is_cacheable_result(result: Union[Dict[str, Any], List[Dict[str, Any]]]) -> bool:
+    """A result can be reused only if it does not point at files of this upload."""
+    parts = result if isinstance(result, list) else [result]
+    if not parts:
+        # process_eml_file returns an empty list on error
+        return False
+    return all(
+        part.get("type") not in ["error", "unsupported"] and "path" not in part
+        for part in parts
+    )
 
-            if not attachment_parts:
-                continue
 
-            if isinstance(attachment_parts, list):
-                # If it's a list (from a nested .eml), extend our list with its parts
-                all_parts.extend(attachment_parts)
-            elif attachment_parts.get("type") not in ["error", "unsupported"]:
-                # If it's a dict for a valid file type, append it
-                all_parts.append(cast(Dict[str, Any], attachment_parts))
-            else:
-                # Log error/unsupported cases but don't add them to the parts list
-                logger.warning(
-                    f"Could not process or skipped attachment '{attachment_save_path.name}' from {eml_path}. Info: {attachment_parts}"
-                )
+def _relabel_cached_result(cached: Dict[str, Any], filename: str) -> Any:
+    """Adapts a cached result to the name under which the file was uploaded this time."""
+    result = cached["result"]
+    cached_filename = cached["filename"]
+    if isinstance(result, dict):
+        result["filename"] = filename
+    else:
+        for part in result:
+            if part.get("filename") == f"{cached_filename} (body)":
+                part["filename"] = f"{filename} (body)"
+    return result
+
+
+def _extraction_settings_key() -> str:
+    """Digest of the settings that change what the extractors return for a file."""
+    values = [
+        _max_extracted_chars(),
+        settings.PDF_TEXT_LAYER_ENABLED,
+        settings.PDF_TEXT_MIN_CHARS_PER_PAGE,
+        settings.PDF_MAX_IMAGE_COVERAGE,
+        settings.IMAGE_NORMALIZATION_ENABLED,
+        settings.IMAGE_MAX_LONG_EDGE,
+        settings.IMAGE_JPEG_QUALITY,
+        settings.EML_MAX_ATTACHMENT_MB,
+        settings.EML_MAX_TOTAL_ATTACHMENTS_MB,
+        settings.EML_MAX_NESTING_DEPTH,
+    ]
+    return hashlib.sha256(repr(values).encode("utf-8")).hexdigest()[:16]
+
+
+def _extract_with_cache(
+    file_type: extractor_registry.FileType, filepath: str, upload_folder: str
+) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """Runs a file type's extractor, serving and storing its result in the extraction cache."""
+    version = file_type.version
+    cache = get_extraction_cache() if version is not None else None
+    if cache is None or version is None:
+        return file_type.extractor(filepath, upload_folder)
+
+    filename = os.path.basename(filepath)
+    file_hash = None
+    settings_key = _extraction_settings_key()
+    try:
+        file_hash = hash_file(filepath)
+        cached = cache.get(file_hash, file_type.name, version, settings_key)
+        if cached is not None:
+            logger.info(f"Extraction cache hit for {filename} ({file_type.name}).")
+            return _relabel_cached_result(cached, filename)
+    except Exception as e:
+        logger.warning(f"Extraction cache lookup failed for {filepath}: {e}")
 
-        except base64.binascii.Error as b64e:
-            logger.error(
-                f"Base64 decoding error for attachment '{original_filename}' in {eml_path}: {b64e}"
-            )
-        except IOError as ioe:
-            logger.error(
-                f"IOError saving attachment '{original_filename}' from {eml_path}: {ioe}"
+    result = file_type.extractor(filepath, upload_folder)
+
+    if file_hash is not None and _is_cacheable_result(result):
+        try:
+            cache.put(
+                file_hash,
+                file_type.name,
+                version,
+                {"filename": filename, "result": result},
+                settings_key,
             )
         except Exception as e:
-            logger.error(
-                f"Unexpected error processing attachment '{original_filename}' from {eml_path}: {e}",
-                exc_info=True,
-            )
-
-    return all_parts
+            logger.warning(f"Could not store extraction result for {filepath}: {e}")
+    return result
 
 
 def process_uploaded_file(
     filepath: str, upload_folder: str
 ) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
-    """Determines file type and calls the appropriate processing function.
+    """Recognizes the file's type from its content and runs the matching extractor.
 
-    Returns a dictionary for most file types, but a list of dictionaries for .eml files.
+    Returns a dictionary for most file types, but a list of dictionaries for .eml files
+    and for PDFs that mix text pages with scanned ones.
     """
     _, ext = os.path.splitext(filepath)
     ext = ext.lower()
     filename: str = os.path.basename(filepath)  # Moved here for all return paths
 
-    processing_function: Union[Callable[..., Any], None] = None
-
-    if ext == ".pdf":
-        processing_function = prepare_pdf_for_llm
-    elif ext in [".png", ".jpg", ".jpeg", ".webp", ".gif"]:  # Added more image types
-        processing_function = prepare_image_for_llm
-    elif ext == ".docx":
-        processing_function = extract_text_from_docx
-    elif ext == ".xlsx":
-        processing_function = extract_text_from_xlsx
-    elif ext == ".txt":
-        processing_function = extract_text_from_txt
-    elif ext == ".eml":
-        # For .eml, we need to pass the upload_folder to save attachments
-        # The functools.partial allows us to pre-fill the 'upload_folder' argument
-        # This will return a List[Dict[str, Any]]
-        processing_function = functools.partial(
-            process_eml_file, upload_folder=upload_folder
-        )
-    else:
+    file_type = extractor_registry.sniff_file_type(filepath)
+    if file_type is None:
         logger.warning(f"Unsupported file type: {ext} for file {filepath}")
         return {
             "type": "unsupported",
             "filename": filename,
             "message": f"Unsupported file type: {ext}",
         }
+    if ext not in file_type.extensions:
+        logger.warning(
+            f"{filename} has extension '{ext}' but contains {file_type.name}; "
+            f"processing it as {file_type.name}."
+        )
 
-    if processing_function:
-        result = processing_function(filepath)
-
-        # If the result is a dictionary (most cases), ensure filename is present.
-        # If it's a list (from an .eml), its elements are assumed to be correctly formatted.
-        if isinstance(result, dict):
-            if "filename" not in result or not result["filename"]:
-                result["filename"] = filename
-        return result
-
-    # Should not be reached if logic is correct, but as a fallback:
-    logger.error(
-        f"No processing function determined for {filepath}, though extension seemed supported."
-    )
-    return {
-        "type": "error",
-        "filename": filename,
-        "message": "Internal error: No processing function found.",
-    }
+    result = _extract_with_cache(file_type, filepath, upload_folder)
+
+    # If the result is a dictionary (most cases), ensure filename is present.
+    # If it's a list (from an .eml), its elements are assumed to be correctly formatted.
+    if isinstance(result, dict):
+        if "filename" not in result or not result["filename"]:
+            result["filename"] = filename
+    return result
+
+
+# Extractors are looked up when called, so that they can be replaced after registration.
+# process_eml_file's version also covers the extractors it calls for attachments.
+_BUILTIN_FILE_TYPES = [
+    extractor_registry.FileType(
+        "pdf",
+        "application/pdf",
+        (".pdf",),
+        extractor_registry.looks_like_pdf,
+        lambda path, folder: prepare_pdf_for_llm(path),
+        extractor_registry.COST_VISION,
+        version=1,
+    ),
+    extractor_registry.FileType(
+        "png",
+        "image/png",
+        (".png",),
+        extractor_registry.looks_like_png,
+        lambda path, folder: prepare_image_for_llm(path),
+        extractor_registry.COST_VISION,
+    ),
+    extractor_registry.FileType(
+        "jpeg",
+        "image/jpeg",
+        (".jpg", ".jpeg"),
+        extractor_registry.looks_like_jpeg,
+        lambda path, folder: prepare_image_for_llm(path),
+        extractor_registry.COST_VISION,
+    ),
+    extractor_registry.FileType(
+        "webp",
+        "image/webp",
+        (".webp",),
+        extractor_registry.looks_like_webp,
+        lambda path, folder: prepare_image_for_llm(path),
+        extractor_registry.COST_VISION,
+    ),
+    extractor_registry.FileType(
+        "gif",
+        "image/gif",
+        (".gif",),
+        extractor_registry.looks_like_gif,
+        lambda path, folder: prepare_image_for_llm(path),
+        extractor_registry.COST_VISION,
+    ),
+    extractor_registry.FileType(
+        "docx",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        (".docx",),
+        extractor_registry.looks_like_docx,
+        lambda path, folder: extract_text_from_docx(path),
+        extractor_registry.COST_CPU,
+        version=2,
+    ),
+    extractor_registry.FileType(
+        "xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        (".xlsx",),
+        extractor_registry.looks_like_xlsx,
+        lambda path, folder: extract_text_from_xlsx(path),
+        extractor_registry.COST_CPU,
+        version=2,
+    ),
+    extractor_registry.FileType(
+        "html",
+        "text/html",
+        (".html", ".htm"),
+        extractor_registry.looks_like_html,
+        lambda path, folder: extract_text_from_html(path),
+        extractor_registry.COST_CPU,
+        version=1,
+    ),
+    extractor_registry.FileType(
+        "eml",
+        "message/rfc822",
+        (".eml",),
+        extractor_registry.looks_like_email,
+        lambda path, folder: process_eml_file(path, folder),
+        extractor_registry.COST_CPU,
+        version=4,
+    ),
+    extractor_registry.FileType(
+        "txt",
+        "text/plain",
+        (".txt",),
+        extractor_registry.looks_like_text,
+        lambda path, folder: extract_text_from_txt(path),
+        extractor_registry.COST_IO,
+        version=1,
+    ),
+]
+for _file_type in _BUILTIN_FILE_TYPES:
+    extractor_registry.register_file_type(_file_type)
@@ -0,0 +1,236 @@
+"""Thread-aware compaction of the email bodies of an upload.
+
+Claim emails are reply chains: every message repeats the previous ones as
+quoted text, together with the same signatures and legal disclaimers. The body
+of each email is split into its own new text and the messages it quotes (found
+through "> " markers and reply headers such as "Il ... ha scritto:", "On ...
+wrote:" or Outlook's "Da:/Inviato:/Oggetto:" block). Across all emails of the
+upload each message is then kept once, preferring the email it was written in
+over a quote of it, and paragraphs repeated in several messages (signatures,
+disclaimers) are kept only where they first appear.
+"""
+
+import logging
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Header lines that process_eml_file puts at the top of each body
+_OWN_HEADER_RE = re.compile(r"^(Da|A|Cc|Data|Oggetto): ")
+_QUOTE_PREFIX_RE = re.compile(r"^(\s*>)+ ?")
+_SEPARATOR_RE = re.compile(
+    r"^\s*(-{2,}\s*(original message|messaggio originale|forwarded message|"
+    r"messaggio inoltrato|inizio messaggio inoltrato)\s*-{2,}|_{10,})\s*$",
+    re.IGNORECASE,
+)
+# "On <date>, <sender> wrote:" / "Il giorno <date>, <sender> ha scritto:", alone
+# or split over two lines; the verb must be a whole word ("Il sottoscritto:" is
+# not a reply header)
+_REPLY_INTRO_RE = re.compile(r"^\s*(On|Il|Le|Am|El)\s+\S", re.IGNORECASE)
+_REPLY_OUTRO_RE = re.compile(
+    r"\S\s+(wrote|ha scritto|a écrit|schrieb|escribió)\s*:\s*$", re.IGNORECASE
+)
+_OUTLOOK_FROM_RE = re.compile(r"^\s*\*?(From|Da|De|Von)\s*:\*?\s", re.IGNORECASE)
+_OUTLOOK_SUBJECT_RE = re.compile(
+    r"^\s*\*?(Subject|Oggetto|Objet|Betreff|Asunto)\s*:", re.IGNORECASE
+)
+
+# Shorter texts are too generic ("Grazie", "Cordiali saluti") to be treated as copies
+_MIN_DUPLICATE_CHARS = 30
+_MIN_BOILERPLATE_CHARS = 20
+
+
+class _Segment:
+    """The new text of an email, or one message quoted in it."""
+
+    def __init__(self, header: Optional[List[str]] = None, quoted: bool = False):
+        self.header: List[str] = header or []
+        self.lines: List[str] = []
+        self.quoted = quoted or bool(header)
+        self.keep = True
+
+    @property
+    def body(self) -> str:
+        return "\n".join(self.lines).strip()
+
+
+def _fingerprint(text: str) -> str:
+    """Lower-cased text without spaces or punctuation, so re-wrapped quotes still match."""
+    return re.sub(r"\W+", "", text.lower())
+
+
+def _reply_header_length(lines: List[str], start: int) -> int:
+    """Number of lines of the reply header starting at ``start`` (0 if there is none)."""
+    line = _QUOTE_PREFIX_RE.sub("", lines[start])
+    if _SEPARATOR_RE.match(line):
+        if start + 1 < len(lines):
+            return 1 + _reply_header_length(lines, start + 1)
+        return 1
+    if _REPLY_INTRO_RE.match(line):
+        if _REPLY_OUTRO_RE.search(line):
+            return 1
+        if start + 1 < len(lines) and _REPLY_OUTRO_RE.search(
+            _QUOTE_PREFIX_RE.sub("", lines[start + 1])
+        ):
+            return 2
+    if _OUTLOOK_FROM_RE.match(line):
+        for offset in range(1, 6):
+            if start + offset >= len(lines):
+                break
+            if _OUTLOOK_SUBJECT_RE.match(
+                _QUOTE_PREFIX_RE.sub("", lines[start + offset])
+            ):
+                return offset + 1
+    return 0
+
+
+def _split_email(content: str) -> Tuple[List[str], List[_Segment]]:
+    """Splits a body into its header lines, its new text and the messages it quotes."""
+    lines = content.split("\n")
+    header: List[str] = []
+    while lines and _OWN_HEADER_RE.match(lines[0]):
+        header.append(lines.pop(0))
+
+    new_text = _Segment()
+    segments = [new_text]
+    index = 0
+    while index < len(lines):
+        header_length = _reply_header_length(lines, index)
+        if header_length:
+            reply_header = [
+                _QUOTE_PREFIX_RE.sub("", line).strip()
+                for line in lines[index : index + header_length]
+            ]
+            segments.append(_Segment([line for line in reply_header if line]))
+            index += header_length
+            continue
+        line = lines[index]
+        is_quote = bool(_QUOTE_PREFIX_RE.match(line))
+        current = segments[-1]
+        if is_quote and not current.quoted:
+            current = _Segment(quoted=True)
+            segments.append(current)
+        elif not is_quote and current.quoted and not current.header and line.strip():
+            # Text after an inline quote is new text again
+            current = new_text
+        current.lines.append(_QUOTE_PREFIX_RE.sub("", line) if is_quote else line)
+        index += 1
+    return header, segments
+
+
+def _drop_repeated_paragraphs(segment: _Segment, seen: Set[str]) -> int:
+    """Removes paragraphs of ``segment`` already kept elsewhere; returns how many."""
+    paragraphs = re.split(r"\n\s*\n", segment.body)
+    kept: List[str] = []
+    removed = 0
+    for paragraph in paragraphs:
+        fingerprint = _fingerprint(paragraph)
+        if len(fingerprint) >= _MIN_BOILERPLATE_CHARS:
+            if fingerprint in seen:
+                removed += 1
+                continue
+            seen.add(fingerprint)
+        kept.append(paragraph)
+    segment.lines = "\n\n".join(kept).split("\n")
+    return removed
+
+
+def _render(header: List[str], segments: List[_Segment]) -> str:
+    blocks: List[str] = ["\n".join(header)] if header else []
+    new_text = segments[0]
+    if new_text.keep:
+        if new_text.body:
+            blocks.append(new_text.body)
+    else:
+        blocks.append("[Messaggio già presente in un'altra email caricata]")
+    omitted = 0
+    for segment in segments[1:]:
+        if not segment.keep:
+            omitted += 1
+        elif segment.body:
+            blocks.append(
+                "\n".join(["[Messaggio citato]", *segment.header, segment.body])
+            )
+    if omitted:
+        blocks.append(
+            f"[{omitted} messaggi citati omessi: già presenti altrove nel thread]"
+        )
+    return "\n\n".join(blocks)
+
+
+def compact_email_bodies(
+    parts: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """Removes quoted messages and boilerplate repeated across the emails of an upload.
+
+    Returns the parts, in their original order, and a flash message summing up
+    what was removed.
+    """
+    if not settings.EMAIL_COMPACTION_ENABLED:
+        return parts, []
+    email_indexes = [
+        i
+        for i, part in enumerate(parts)
+        if part.get("type") == "text"
+        and part.get("original_filetype") == "eml"
+        and part.get("content")
+    ]
+    if not email_indexes:
+        return parts, []
+
+    split = {i: _split_email(parts[i]["content"]) for i in email_indexes}
+
+    # The new text of every email is registered before any quote, so the copy kept
+    # of a message is the email it was written in whenever that email was uploaded
+    order = [split[i][1][0] for i in email_indexes] + [
+        segment for i in email_indexes for segment in split[i][1][1:]
+    ]
+    kept_fingerprints: List[str] = []
+    removed_messages = 0
+    for segment in order:
+        fingerprint = _fingerprint(segment.body)
+        if not fingerprint:
+            continue
+        duplicate = fingerprint in kept_fingerprints or (
+            len(fingerprint) >= _MIN_DUPLICATE_CHARS
+            and any(fingerprint in kept for kept in kept_fingerprints)
+        )
+        if duplicate:
+            segment.keep = False
+            removed_messages += 1
+        else:
+            kept_fingerprints.append(fingerprint)
+
+    seen_paragraphs: Set[str] = set()
+    removed_paragraphs = 0
+    compacted = list(parts)
+    chars_before = chars_after = 0
+    for i in email_indexes:
+        header, segments = split[i]
+        for segment in segments:
+            if segment.keep:
+                removed_paragraphs += _drop_repeated_paragraphs(
+                    segment, seen_paragraphs
+                )
+        content = _render(header, segments)
+        chars_before += len(parts[i]["content"])
+        chars_after += len(content)
+        compacted[i] = {**parts[i], "content": content}
+
+    if not removed_messages and not removed_paragraphs:
+        return parts, []
+    logger.info(
+        f"Compacted {len(email_indexes)} emails from {chars_before} to {chars_after} characters: "
+        f"{removed_messages} repeated messages and {removed_paragraphs} repeated blocks removed."
+    )
+    return compacted, [
+        (
+            f"Email threads compacted: {removed_messages} repeated message(s) and "
+            f"{removed_paragraphs} repeated signature/disclaimer block(s) removed "
+            f"({chars_before} → {chars_after} characters).",
+            "info",
+        )
+    ]
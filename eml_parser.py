@@ -0,0 +1,315 @@
+"""Streaming MIME parser for .eml files.
+
+The message is read line by line: each part is decoded incrementally
+(base64, quoted-printable or raw) and attachments are written straight to disk,
+so memory use does not grow with the size of a forwarded thread. Attachments
+over EML_MAX_ATTACHMENT_MB, or past EML_MAX_TOTAL_ATTACHMENTS_MB for the
+message, are skipped while their lines are still consumed. Only the headers of
+each part are handed to the standard library's header parser.
+"""
+
+import binascii
+import email.policy
+import logging
+import os
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_MAX_HEADER_BYTES = 256 * 1024  # Headers beyond this are ignored
+_HEADER_NAMES = ("From", "To", "Cc", "Date", "Subject")
+
+
+class EmailAttachment:
+    """An attachment saved to disk, or skipped (``path`` None) with a reason."""
+
+    def __init__(
+        self,
+        filename: str,
+        content_type: str,
+        path: Optional[str] = None,
+        size: int = 0,
+        skipped_reason: Optional[str] = None,
+    ):
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = size
+        self.skipped_reason = skipped_reason
+
+
+class ParsedEmail:
+    """Headers, inline text bodies and attachments of a message."""
+
+    def __init__(self) -> None:
+        self.headers: Dict[str, str] = {}
+        self.text_plain: List[str] = []
+        self.text_html: List[str] = []
+        self.attachments: List[EmailAttachment] = []
+
+
+class _Base64Decoder:
+    def __init__(self) -> None:
+        self._pending = b""
+
+    def feed(self, line: bytes) -> bytes:
+        data = self._pending + b"".join(line.split())
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        try:
+            return binascii.a2b_base64(data[:usable])
+        except binascii.Error:
+            return b""
+
+    def finish(self) -> bytes:
+        if not self._pending.strip(b"="):
+            return b""
+        try:
+            return binascii.a2b_base64(self._pending + b"=" * (-len(self._pending) % 4))
+        except binascii.Error:
+            return b""
+
+
+class _LineDecoder:
+    """Quoted-printable or identity decoding; the line break before a boundary is dropped."""
+
+    def __init__(self, quoted_printable: bool):
+        self._quoted_printable = quoted_printable
+        self._pending_eol = b""
+
+    def feed(self, line: bytes) -> bytes:
+        content = line.rstrip(b"\r\n")
+        eol = line[len(content) :]
+        output = self._pending_eol
+        if self._quoted_printable:
+            if content.endswith(b"="):  # Soft line break
+                content, eol = content[:-1], b""
+            output += binascii.a2b_qp(content)
+        else:
+            output += content
+        self._pending_eol = eol
+        return output
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _Sink:
+    """Collects a decoded part in memory or in a file, up to ``limit`` bytes."""
+
+    def __init__(self, limit: int, path: Optional[str] = None):
+        self.limit = limit
+        self.path = path
+        self.size = 0
+        self.overflow = False
+        self._chunks: List[bytes] = []
+        self._file: Optional[BinaryIO] = open(path, "xb") if path else None
+
+    def write(self, data: bytes) -> None:
+        if self.overflow or not data:
+            return
+        self.size += len(data)
+        if self.size > self.limit:
+            self.overflow = True
+            self._chunks = []
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                os.remove(self.path)  # type: ignore[arg-type]
+            return
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._chunks.append(data)
+
+    def close(self) -> bytes:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return b"".join(self._chunks)
+
+
+def _safe_filename(name: str) -> str:
+    return "".join(c if c.isalnum() or c in (".", "_", "-") else "_" for c in name)
+
+
+class _StreamingEmailParser:
+    def __init__(self, attachments_dir: str):
+        self.attachments_dir = attachments_dir
+        self.result = ParsedEmail()
+        self.total_attachment_bytes = 0
+        self.max_attachment_bytes = settings.EML_MAX_ATTACHMENT_MB * 1024 * 1024
+        self.max_total_bytes = settings.EML_MAX_TOTAL_ATTACHMENTS_MB * 1024 * 1024
+
+    @staticmethod
+    def _delimiter(
+        line: bytes, boundaries: List[bytes]
+    ) -> Optional[Tuple[bytes, bool]]:
+        """Returns (boundary, is_closing) if ``line`` delimits one of ``boundaries``."""
+        if not line.startswith(b"--"):
+            return None
+        stripped = line.rstrip(b" \t\r\n")
+        for boundary in reversed(boundaries):
+            if stripped == b"--" + boundary:
+                return boundary, False
+            if stripped == b"--" + boundary + b"--":
+                return boundary, True
+        return None
+
+    def _skip_to_delimiter(
+        self, reader: BinaryIO, boundaries: List[bytes]
+    ) -> Optional[bytes]:
+        while True:
+            line = reader.readline()
+            if not line or self._delimiter(line, boundaries):
+                return line or None
+
+    @staticmethod
+    def _read_headers(reader: BinaryIO) -> EmailMessage:
+        lines: List[bytes] = []
+        size = 0
+        while True:
+            line = reader.readline()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+            size += len(line)
+            if size <= _MAX_HEADER_BYTES:
+                lines.append(line)
+        parser = BytesHeaderParser(policy=email.policy.default)
+        return parser.parsebytes(b"".join(lines))  # type: ignore[return-value]
+
+    def parse_entity(
+        self, reader: BinaryIO, boundaries: List[bytes], is_root: bool = False
+    ) -> Optional[bytes]:
+        """Parses one entity; returns the delimiter line that ended it, or None at EOF."""
+        headers = self._read_headers(reader)
+        if is_root:
+            for name in _HEADER_NAMES:
+                try:
+                    value = headers.get(name)
+                except Exception:  # Malformed header values are left out
+                    value = None
+                if value:
+                    self.result.headers[name] = str(value)
+
+        boundary = None
+        if headers.get_content_maintype() == "multipart":
+            boundary = headers.get_boundary()
+        if boundary:
+            inner = boundaries + [boundary.encode("utf-8", "replace")]
+            line = self._skip_to_delimiter(reader, inner)  # Preamble
+            while line is not None:
+                delimiter = self._delimiter(line, inner)
+                if delimiter is None or delimiter[0] != inner[-1]:
+                    return line  # An enclosing boundary ends this multipart early
+                if delimiter[1]:
+                    return self._skip_to_delimiter(reader, boundaries)  # Epilogue
+                line = self.parse_entity(reader, inner)
+            return None
+        return self._read_leaf(reader, boundaries, headers)
+
+    def _open_sink(self, headers: EmailMessage) -> Tuple[Optional[_Sink], str]:
+        """Chooses where a leaf part goes: an inline body, a file, or nowhere."""
+        content_type = headers.get_content_type()
+        try:
+            filename = headers.get_filename()
+        except Exception:
+            filename = None
+        is_attachment = (
+            headers.get_content_disposition() == "attachment"
+            or bool(filename)
+            or headers.get_content_maintype() != "text"
+        )
+        if not is_attachment:
+            if content_type in ("text/plain", "text/html"):
+                return _Sink(self.max_attachment_bytes), "inline"
+            return None, "ignored"
+
+        number = len(self.result.attachments) + 1
+        if not filename:
+            if content_type == "message/rfc822":
+                filename = f"messaggio_inoltrato_{number}.eml"
+            else:
+                filename = f"allegato_{number}.{headers.get_content_subtype()}"
+        attachment = EmailAttachment(filename, content_type)
+        self.result.attachments.append(attachment)
+
+        remaining = self.max_total_bytes - self.total_attachment_bytes
+        if remaining <= 0:
+            attachment.skipped_reason = "total attachment size limit reached"
+            return None, "attachment"
+        base_name = _safe_filename(filename) or f"allegato_{number}"
+        stem, extension = os.path.splitext(base_name)
+        counter = 0
+        while True:
+            candidate = base_name if counter == 0 else f"{stem}_{counter}{extension}"
+            path = os.path.join(self.attachments_dir, candidate)
+            try:
+                sink = _Sink(min(self.max_attachment_bytes, remaining), path)
+                break
+            except FileExistsError:
+                counter += 1
+        attachment.path = path
+        return sink, "attachment"
+
+    def _read_leaf(
+        self, reader: BinaryIO, boundaries: List[bytes], headers: EmailMessage
+    ) -> Optional[bytes]:
+        sink, kind = self._open_sink(headers)
+        encoding = str(headers.get("Content-Transfer-Encoding", "")).strip().lower()
+        if encoding == "base64":
+            decoder = _Base64Decoder()
+        else:
+            decoder = _LineDecoder(quoted_printable=encoding == "quoted-printable")
+
+        ending: Optional[bytes] = None
+        while True:
+            line = reader.readline()
+            if not line:
+                break
+            if self._delimiter(line, boundaries):
+                ending = line
+                break
+            if sink is not None:
+                sink.write(decoder.feed(line))
+        if sink is None:
+            return ending
+        sink.write(decoder.finish())
+        data = sink.close()
+
+        if kind == "inline":
+            charset = headers.get_content_charset() or "utf-8"
+            try:
+                text = data.decode(charset, errors="replace")
+            except LookupError:
+                text = data.decode("utf-8", errors="replace")
+            if headers.get_content_type() == "text/html":
+                self.result.text_html.append(text)
+            else:
+                self.result.text_plain.append(text)
+            return ending
+
+        attachment = self.result.attachments[-1]
+        if sink.overflow:
+            attachment.path = None
+            attachment.skipped_reason = "attachment size limit exceeded"
+            logger.warning(
+                f"Skipped attachment {attachment.filename}: larger than {sink.limit} bytes."
+            )
+        else:
+            attachment.size = sink.size
+            self.total_attachment_bytes += sink.size
+        return ending
+
+
+def parse_eml(eml_path: str, attachments_dir: str) -> ParsedEmail:
+    """Parses an .eml file, saving its attachments into ``attachments_dir``."""
+    os.makedirs(attachments_dir, exist_ok=True)
+    parser = _StreamingEmailParser(attachments_dir)
+    with open(eml_path, "rb") as stream:
+        parser.parse_entity(stream, [], is_root=True)
+    return parser.result
@@ -0,0 +1,265 @@
+"""Parallel, sandboxed document extraction for multi-file uploads.
+
+Extraction (openpyxl, XML and MIME parsing, PyMuPDF, Pillow) is CPU-bound and
+synchronous, so the files of an upload are fanned out to a bounded pool of
+worker processes instead of being parsed one after another on the event loop.
+Files whose type has the I/O cost class (see extractor_registry) are cheap
+enough to be read in a thread, which spares them the round trip to a worker.
+
+Each worker process handles one file at a time under an address-space limit
+(EXTRACTION_MEMORY_LIMIT_MB). A file that is not done within
+EXTRACTION_TIMEOUT_SECONDS gets its worker killed, and a worker that dies takes
+only its own file down: both come back as {"type": "error"} entries. Workers
+are replaced after EXTRACTION_TASKS_PER_WORKER files so that memory leaked by
+the parsers does not build up.
+"""
+
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from multiprocessing.context import BaseContext
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import document_processor
+import extractor_registry
+from core.config import settings
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; workers then run without a memory limit
+    resource = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+ExtractionResult = Union[Dict[str, Any], List[Dict[str, Any]], BaseException]
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def _worker_main(conn: Connection, memory_limit_mb: int) -> None:
+    """Loop of a worker process: runs the functions it is sent, one at a time."""
+    if memory_limit_mb > 0 and resource is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        function, args = task
+        try:
+            conn.send(("ok", function(*args)))
+        except BaseException as e:  # MemoryError included
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """A sandboxed worker process."""
+
+    def __init__(self, context: BaseContext):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, settings.EXTRACTION_MEMORY_LIMIT_MB),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks_done = 0
+
+    def run(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Runs ``function(*args)`` in the worker process.
+
+        Raises ExtractionTimeout after EXTRACTION_TIMEOUT_SECONDS, EOFError if the
+        process died, and RuntimeError if the function raised.
+        """
+        self.tasks_done += 1
+        self.conn.send((function, args))
+        if not self.conn.poll(settings.EXTRACTION_TIMEOUT_SECONDS):
+            raise ExtractionTimeout()
+        status, payload = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def stop(self, kill: bool = False) -> None:
+        if not kill:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """Bounded set of sandboxed worker processes, started on demand."""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        # "spawn" avoids forking a process that already runs the job loop thread.
+        self._context = multiprocessing.get_context("spawn")
+        # One dispatcher thread per worker: each waits on a single worker at a time
+        self._dispatcher = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="extraction"
+        )
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.conn.close()
+        return _Worker(self._context)
+
+    def _release(self, worker: _Worker, healthy: bool) -> None:
+        with self._lock:
+            if (
+                healthy
+                and not self._closed
+                and worker.tasks_done < settings.EXTRACTION_TASKS_PER_WORKER
+            ):
+                self._idle.append(worker)
+                return
+        worker.stop(kill=not healthy)
+
+    def run(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Runs ``function(*args)`` in a worker; a hung or dead worker is discarded."""
+        worker = self._acquire()
+        healthy = False
+        try:
+            result = worker.run(function, *args)
+            healthy = True
+            return result
+        except RuntimeError:
+            healthy = True  # The function failed, the process is fine
+            raise
+        finally:
+            self._release(worker, healthy)
+
+    def extract(self, filepath: str, work_dir: str) -> Any:
+        """Runs document_processor.process_uploaded_file on one file in a worker."""
+        filename = os.path.basename(filepath)
+        try:
+            return self.run(
+                document_processor.process_uploaded_file, filepath, work_dir
+            )
+        except ExtractionTimeout:
+            logger.error(
+                f"Extraction of {filepath} timed out after "
+                f"{settings.EXTRACTION_TIMEOUT_SECONDS} seconds; its worker was killed."
+            )
+            message = "Extraction timed out"
+        except (EOFError, OSError) as e:
+            logger.error(f"Extraction worker died while processing {filepath}: {e!r}")
+            message = (
+                "Extraction worker crashed (the file may be malformed or too large)"
+            )
+        except RuntimeError as e:
+            logger.error(f"Extraction of {filepath} failed in its worker: {e}")
+            message = f"Unexpected error: {e}"
+        return {"type": "error", "filename": filename, "message": message}
+
+    async def extract_async(self, filepath: str, work_dir: str) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._dispatcher, self.extract, filepath, work_dir
+        )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+        self._dispatcher.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[SandboxPool] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> Optional[SandboxPool]:
+    """Returns the shared worker pool, creating it on first use.
+
+    Returns None when EXTRACTION_MAX_WORKERS is 0, in which case extraction runs
+    in threads of the current process, without a sandbox.
+    """
+    global _pool
+    if settings.EXTRACTION_MAX_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(settings.EXTRACTION_MAX_WORKERS)
+            logger.info(
+                f"Started extraction pool with {settings.EXTRACTION_MAX_WORKERS} sandboxed workers."
+            )
+        return _pool
+
+
+def shutdown_extraction_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+atexit.register(shutdown_extraction_pool)
+
+
+async def extract_files(
+    filepaths: List[str], upload_dir: str
+) -> List[ExtractionResult]:
+    """Runs document_processor.process_uploaded_file on every file concurrently.
+
+    Each file gets its own working folder under ``upload_dir`` so that attachments
+    unpacked from concurrently processed .eml files never collide.
+
+    Returns:
+        One entry per input path, in the same order: the processor's result, or the
+        exception raised while extracting that file.
+    """
+    file_types = await asyncio.to_thread(
+        lambda: [extractor_registry.sniff_file_type(path) for path in filepaths]
+    )
+    # Unrecognized files are rejected by the processor without being parsed
+    needs_worker = [
+        file_type is not None and file_type.cost != extractor_registry.COST_IO
+        for file_type in file_types
+    ]
+    pool = _get_pool() if any(needs_worker) else None
+
+    tasks = []
+    for index, filepath in enumerate(filepaths):
+        work_dir = os.path.join(upload_dir, f"extracted_{index}")
+        if pool is None or not needs_worker[index]:
+            tasks.append(
+                asyncio.to_thread(
+                    document_processor.process_uploaded_file, filepath, work_dir
+                )
+            )
+        else:
+            tasks.append(pool.extract_async(filepath, work_dir))
+
+    logger.info(f"Extracting {len(filepaths)} files in parallel.")
+    results: List[ExtractionResult] = await asyncio.gather(
+        *tasks, return_exceptions=True
+    )
+    return results
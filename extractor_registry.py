@@ -0,0 +1,220 @@
+"""Registry of the supported file types, recognized by their content.
+
+Each file type declares a cheap probe run on the first bytes of a file, the
+extensions it is usually uploaded with, the extractor that handles it, the
+extractor's cost class and its version. process_uploaded_file chooses the
+extractor from what a file contains rather than from its name, extraction_pool
+uses the cost class to decide where an extraction runs, and the version keys
+the extraction cache. New formats are added with register_file_type, without
+touching the dispatcher.
+"""
+
+import logging
+import os
+import re
+import zipfile
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cost classes
+COST_IO = "io"  # Little more than reading the file: runs in a thread
+COST_CPU = (
+    "cpu"  # Parsing in Python (XML, MIME, spreadsheets): runs in a worker process
+)
+COST_VISION = (
+    "vision"  # Prepared (rendered, resized) for the model: runs in a worker process
+)
+
+HEADER_PROBE_BYTES = 8192
+
+Probe = Callable[[bytes, str], bool]
+Extractor = Callable[[str, str], Any]
+
+
+class FileType:
+    """A file format, how to recognize it and how to extract it.
+
+    ``extractor`` is called with the file path and the folder where the
+    extraction may write files (e.g. email attachments). A ``version`` of None
+    means the extractor's results are never cached; bump it whenever the
+    extractor's output changes, so that results cached by the previous version
+    are no longer served.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        mime_type: str,
+        extensions: Tuple[str, ...],
+        probe: Probe,
+        extractor: Extractor,
+        cost: str,
+        version: Optional[int] = None,
+    ):
+        self.name = name
+        self.mime_type = mime_type
+        self.extensions = extensions
+        self.probe = probe
+        self.extractor = extractor
+        self.cost = cost
+        self.version = version
+
+
+# In probing order: formats with an unambiguous signature before the text-based ones
+_file_types: List[FileType] = []
+
+
+def register_file_type(file_type: FileType, before: Optional[str] = None) -> None:
+    """Adds a file type, replacing any registered under the same name.
+
+    New types are probed after the existing ones, unless ``before`` names the
+    type they must be tried ahead of (e.g. a text-based format before "txt").
+    """
+    unregister_file_type(file_type.name)
+    names = [registered.name for registered in _file_types]
+    position = names.index(before) if before in names else len(_file_types)
+    _file_types.insert(position, file_type)
+
+
+def unregister_file_type(name: str) -> None:
+    _file_types[:] = [f for f in _file_types if f.name != name]
+
+
+def get_file_type(name: str) -> Optional[FileType]:
+    return next((f for f in _file_types if f.name == name), None)
+
+
+def file_type_for_extension(extension: str) -> Optional[FileType]:
+    """Returns the type a file name suggests, e.g. for ".jpg" or "jpg"."""
+    extension = "." + extension.lower().lstrip(".")
+    return next((f for f in _file_types if extension in f.extensions), None)
+
+
+def read_header(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(HEADER_PROBE_BYTES)
+
+
+def sniff_file_type(path: str) -> Optional[FileType]:
+    """Recognizes a file from its first bytes.
+
+    The type suggested by the extension is tried first, so that ambiguous
+    content (any UTF-8 text) keeps the meaning its name gives it; the other
+    types are then probed in order. Files that cannot be read, and empty ones,
+    get the type of their extension so that its extractor reports the problem.
+    Returns None when no registered type recognizes the content.
+    """
+    by_extension = file_type_for_extension(os.path.splitext(path)[1])
+    try:
+        header = read_header(path)
+    except OSError:
+        return by_extension
+    if not header:
+        return by_extension
+
+    candidates = [by_extension] if by_extension else []
+    candidates += [f for f in _file_types if f is not by_extension]
+    for file_type in candidates:
+        try:
+            if file_type.probe(header, path):
+                return file_type
+        except Exception as e:
+            logger.warning(f"Probe for {file_type.name} failed on {path}: {e}")
+    return None
+
+
+# Probes for the built-in formats
+
+
+def looks_like_pdf(header: bytes, path: str) -> bool:
+    # Some writers put a few bytes of garbage before the signature
+    return b"%PDF-" in header[:1024]
+
+
+def looks_like_png(header: bytes, path: str) -> bool:
+    return header.startswith(b"\x89PNG\r\n\x1a\n")
+
+
+def looks_like_jpeg(header: bytes, path: str) -> bool:
+    return header.startswith(b"\xff\xd8\xff")
+
+
+def looks_like_gif(header: bytes, path: str) -> bool:
+    return header[:6] in (b"GIF87a", b"GIF89a")
+
+
+def looks_like_webp(header: bytes, path: str) -> bool:
+    return header[:4] == b"RIFF" and header[8:12] == b"WEBP"
+
+
+def _zip_contains(header: bytes, path: str, member: str) -> bool:
+    """Checks an Office Open XML package; only the zip's central directory is read."""
+    if not header.startswith(b"PK\x03\x04"):
+        return False
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return member in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+def looks_like_docx(header: bytes, path: str) -> bool:
+    return _zip_contains(header, path, "word/document.xml")
+
+
+def looks_like_xlsx(header: bytes, path: str) -> bool:
+    return _zip_contains(header, path, "xl/workbook.xml")
+
+
+_HTML_START_RE = re.compile(
+    rb"^\s*(<\?xml[^>]*>\s*)?(<!--.*?-->\s*)*<(!doctype\s+html|html|head|body)\b",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def looks_like_html(header: bytes, path: str) -> bool:
+    return bool(_HTML_START_RE.match(header.lstrip(b"\xef\xbb\xbf")))
+
+
+_HEADER_LINE_RE = re.compile(rb"^([!-9;-~]+):")
+_EMAIL_HEADERS = {
+    b"from",
+    b"to",
+    b"subject",
+    b"date",
+    b"message-id",
+    b"mime-version",
+    b"received",
+    b"return-path",
+    b"delivered-to",
+}
+
+
+def looks_like_email(header: bytes, path: str) -> bool:
+    """An RFC 5322 header block with at least two of the usual message headers."""
+    names = set()
+    lines = header.splitlines()
+    if lines and lines[0].startswith(b"From "):  # mbox separator line
+        lines = lines[1:]
+    for line in lines:
+        if not line.strip():
+            break
+        if line[:1] in (b" ", b"\t"):  # Folded header
+            continue
+        match = _HEADER_LINE_RE.match(line)
+        if not match:
+            return False
+        names.add(match.group(1).lower())
+    return len(names & _EMAIL_HEADERS) >= 2
+
+
+def looks_like_text(header: bytes, path: str) -> bool:
+    if b"\x00" in header:
+        return False
+    try:
+        header.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # The probe may have cut a multi-byte character in half
+        return len(header) == HEADER_PROBE_BYTES and e.start >= len(header) - 3
+    return True
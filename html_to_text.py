@@ -0,0 +1,196 @@
+"""Conversion of HTML email bodies and attachments to plain text.
+
+Built on the standard library's HTMLParser. Style, script and hidden blocks
+are dropped, and whitespace is collapsed as a browser would. Block elements
+become line breaks, list items get "- " or "1. " markers, and tables are kept
+row by row with cells separated by " | ". Blockquotes are prefixed with "> ",
+like plain-text replies, so that email_compaction recognizes quoted messages.
+"""
+
+import re
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+_SKIPPED_TAGS = {"style", "script", "head", "noscript", "template", "svg", "title"}
+_VOID_TAGS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+_BLOCK_TAGS = {
+    "address",
+    "article",
+    "aside",
+    "center",
+    "dd",
+    "div",
+    "dl",
+    "dt",
+    "fieldset",
+    "figure",
+    "footer",
+    "form",
+    "header",
+    "hr",
+    "li",
+    "main",
+    "nav",
+    "ol",
+    "pre",
+    "section",
+    "ul",
+}
+# Blocks followed by an empty line
+_PARAGRAPH_TAGS = {"p", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "table"}
+_HIDDEN_STYLE_RE = re.compile(r"display\s*:\s*none|visibility\s*:\s*hidden", re.I)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.lines: List[str] = []
+        self._inline: List[str] = []
+        self._skip_depth = 0
+        self._quote_depth = 0
+        self._pre_depth = 0
+        self._lists: List[Optional[int]] = []  # None for <ul>, next number for <ol>
+        self._tables: List[List[List[str]]] = []  # Rows of cells of the open tables
+        self._cells: List[List[str]] = []  # Text of the open cells
+
+    # Output helpers
+
+    def _write(self, text: str) -> None:
+        (self._cells[-1] if self._cells else self._inline).append(text)
+
+    def _flush_line(self) -> None:
+        text = "".join(self._inline).strip()
+        self._inline = []
+        if text:
+            self.lines.append("> " * self._quote_depth + text)
+
+    def _break(self, blank: bool = False) -> None:
+        if self._cells:
+            self._cells[-1].append(" ")
+            return
+        self._flush_line()
+        if blank and self.lines and self.lines[-1]:
+            self.lines.append("")
+
+    # HTMLParser callbacks
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skip_depth:
+            if tag not in _VOID_TAGS:
+                self._skip_depth += 1
+            return
+        style = dict(attrs).get("style") or ""
+        if tag in _SKIPPED_TAGS or (
+            tag not in _VOID_TAGS and _HIDDEN_STYLE_RE.search(style)
+        ):
+            self._skip_depth = 1
+            return
+
+        if tag == "br":
+            if self._cells:
+                self._cells[-1].append(" ")
+            else:
+                self._flush_line()
+        elif tag == "table":
+            self._break(blank=True)
+            self._tables.append([])
+        elif tag == "tr" and self._tables:
+            self._tables[-1].append([])
+        elif tag in ("td", "th") and self._tables:
+            if not self._tables[-1]:
+                self._tables[-1].append([])
+            self._cells.append([])
+        elif tag in ("ul", "ol"):
+            self._break()
+            self._lists.append(1 if tag == "ol" else None)
+        elif tag == "li":
+            self._break()
+            marker = "- "
+            if self._lists and self._lists[-1] is not None:
+                marker = f"{self._lists[-1]}. "
+                self._lists[-1] += 1
+            self._write("  " * max(len(self._lists) - 1, 0) + marker)
+        elif tag == "blockquote":
+            self._break(blank=True)
+            self._quote_depth += 1
+        elif tag == "pre":
+            self._break()
+            self._pre_depth += 1
+        elif tag in _PARAGRAPH_TAGS:
+            self._break(blank=True)
+        elif tag in _BLOCK_TAGS:
+            self._break()
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+
+        if tag in ("td", "th") and self._cells:
+            text = _WHITESPACE_RE.sub(" ", "".join(self._cells.pop())).strip()
+            self._tables[-1][-1].append(text)
+        elif tag == "table" and self._tables:
+            rows = [" | ".join(row) for row in self._tables.pop() if any(row)]
+            if self._cells:
+                # A nested table is folded into the cell that contains it
+                self._cells[-1].append(" ; ".join(rows))
+            else:
+                for row in rows:
+                    self.lines.append("> " * self._quote_depth + row)
+                self._break(blank=True)
+        elif tag in ("ul", "ol") and self._lists:
+            self._lists.pop()
+            self._break(blank=not self._lists)
+        elif tag == "blockquote":
+            self._break(blank=True)
+            self._quote_depth = max(self._quote_depth - 1, 0)
+        elif tag == "pre":
+            self._break()
+            self._pre_depth = max(self._pre_depth - 1, 0)
+        elif tag in _PARAGRAPH_TAGS:
+            self._break(blank=True)
+        elif tag in _BLOCK_TAGS:
+            self._break()
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth:
+            return
+        if self._pre_depth and not self._cells:
+            lines = data.split("\n")
+            for line in lines[:-1]:
+                self._inline.append(line)
+                self._flush_line()
+            self._inline.append(lines[-1])
+            return
+        self._write(_WHITESPACE_RE.sub(" ", data))
+
+    def close(self) -> None:
+        super().close()
+        self._flush_line()
+
+
+def html_to_text(html: str) -> str:
+    """Returns the readable text of an HTML document."""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines: List[str] = []
+    for line in extractor.lines:
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip()
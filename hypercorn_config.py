@@ -21,7 +21,9 @@ loglevel = "debug"
 accesslog = "-"
 
 # You can add other Hypercorn settings here if needed, for example:
-# workers = 2
+# Keep workers at 1: report jobs live in the memory of the process that runs
+# them, and their status and stream endpoints only see that process's jobs.
+# workers = 1
 # worker_class = "asyncio" # or "uvloop" if uvloop is installed
 
 # Ensure your Flask app is referenced correctly if you were to define 'application_path' here
@@ -0,0 +1,129 @@
+"""Collapsing of near-duplicate photos within one upload.
+
+Claim bundles often contain burst shots and the same photo attached to several
+emails. Every image gets a 64-bit difference hash (dHash) when it is prepared
+for the model; before generation, images whose hashes differ in at most
+IMAGE_DEDUP_MAX_DISTANCE bits are collapsed into the one whose original has
+the highest resolution. The kept part lists the names of the images it stands for, which
+llm_handler turns into a note in the prompt.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_HASH_SIZE = 8
+
+
+def perceptual_hash(img: Image.Image) -> str:
+    """Returns the 64-bit dHash of an image as 16 hex digits.
+
+    Each bit tells whether a pixel of the 9x8 grayscale thumbnail is brighter
+    than its right neighbour, so the hash survives resizing and re-encoding.
+    The image is hashed as displayed (after its EXIF rotation), like the copy
+    sent to the model. JPEGs are decoded at reduced scale (this changes ``img``
+    in place).
+    """
+    if img.format == "JPEG":
+        img.draft("L", (_HASH_SIZE * 8, _HASH_SIZE * 8))
+    upright = ImageOps.exif_transpose(img)
+    small = upright.convert("L").resize(
+        (_HASH_SIZE + 1, _HASH_SIZE), Image.Resampling.LANCZOS
+    )
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(_HASH_SIZE):
+        for col in range(_HASH_SIZE):
+            offset = row * (_HASH_SIZE + 1) + col
+            value = (value << 1) | (pixels[offset + 1] > pixels[offset])
+    return f"{value:016x}"
+
+
+def try_perceptual_hash(img: Image.Image) -> Optional[str]:
+    """Like perceptual_hash, but returns None if the image cannot be decoded."""
+    try:
+        return perceptual_hash(img)
+    except Exception as e:
+        logger.warning(f"Could not compute a perceptual hash: {e}")
+        return None
+
+
+def hamming_distance(first: str, second: str) -> int:
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
+
+
+def _pixels(part: Dict[str, Any]) -> int:
+    # The copies sent are all downsized to IMAGE_MAX_LONG_EDGE, so the originals decide
+    width = part.get("source_width") or part.get("width") or 0
+    height = part.get("source_height") or part.get("height") or 0
+    return width * height
+
+
+def collapse_near_duplicates(
+    parts: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """Keeps one image per group of near-duplicates.
+
+    Returns the remaining parts, in their original order, and flash messages
+    about every merge. The kept image takes the position of the first one of
+    its group and lists the other names under ``duplicates``.
+    """
+    if not settings.IMAGE_DEDUP_ENABLED:
+        return parts, []
+
+    kept: List[Dict[str, Any]] = []
+    # Index of each group's representative in ``kept``, with its hash
+    groups: List[Tuple[int, str]] = []
+    messages: List[Tuple[str, str]] = []
+
+    for part in parts:
+        image_hash = part.get("dhash")
+        is_image = part.get("type") == "vision" and str(
+            part.get("mime_type", "")
+        ).startswith("image/")
+        if not is_image or not image_hash:
+            kept.append(part)
+            continue
+
+        match = next(
+            (
+                index
+                for index, group_hash in groups
+                if hamming_distance(image_hash, group_hash)
+                <= settings.IMAGE_DEDUP_MAX_DISTANCE
+            ),
+            None,
+        )
+        if match is None:
+            groups.append((len(kept), image_hash))
+            kept.append(part)
+            continue
+
+        representative = kept[match]
+        duplicates = list(representative.get("duplicates", []))
+        if _pixels(part) > _pixels(representative):
+            # Keep the sharper copy where the group first appeared
+            duplicates.append(representative["filename"])
+            kept[match] = {**part, "duplicates": duplicates}
+        else:
+            duplicates.append(part["filename"])
+            kept[match] = {**representative, "duplicates": duplicates}
+        logger.info(
+            f"Collapsed near-duplicate photo {duplicates[-1]} into {kept[match]['filename']}."
+        )
+
+    for part in kept:
+        if part.get("duplicates"):
+            messages.append(
+                (
+                    f"{len(part['duplicates'])} near-duplicate photo(s) of {part['filename']} "
+                    f"were merged: {', '.join(part['duplicates'])}.",
+                    "info",
+                )
+            )
+    return kept, messages
@@ -0,0 +1,157 @@
+"""Normalization of uploaded photos before they are sent to Gemini.
+
+Phone photos of a claim are often 12 MP JPEGs of several megabytes each, far
+more than the model needs to read them. Each image is rotated according to its
+EXIF orientation, downsized to IMAGE_MAX_LONG_EDGE pixels on its long edge and
+re-encoded without metadata: JPEG at IMAGE_JPEG_QUALITY, or PNG for images with
+transparency and for PNG screenshots, whose text would suffer from JPEG
+artifacts. Results are stored in a directory keyed by the SHA-256 of the source
+bytes and the settings, so a re-uploaded photo is not processed again and keeps
+producing the same bytes (which lets the Gemini file registry reuse its upload).
+"""
+
+import logging
+import os
+import tempfile
+import time
+from typing import NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+from core.config import settings
+from core.extraction_cache import hash_file
+
+logger = logging.getLogger(__name__)
+
+# Bump when the output of normalize_image changes for the same settings.
+NORMALIZER_VERSION = 1
+
+
+class NormalizedImage(NamedTuple):
+    path: str
+    mime_type: str
+    width: int
+    height: int
+
+
+def _cache_dir() -> str:
+    directory = settings.IMAGE_CACHE_DIR or os.path.join(
+        tempfile.gettempdir(), "normalized_images"
+    )
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _keeps_png(img: Image.Image) -> bool:
+    return img.format == "PNG" or img.mode in ("RGBA", "LA", "P")
+
+
+def _prune_cache(directory: str, keep: str) -> None:
+    """Deletes the least recently used images once the directory exceeds its limit.
+
+    Images used within the last LLM_API_TIMEOUT_SECONDS are never deleted: the
+    job that produced them may not have uploaded them yet (see mark_in_use).
+    """
+    max_bytes = settings.IMAGE_CACHE_MAX_MB * 1024 * 1024
+    in_use_since = time.time() - settings.LLM_API_TIMEOUT_SECONDS
+    total = 0
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.startswith("."):
+            stat = entry.stat()
+            total += stat.st_size
+            if entry.path != keep and stat.st_mtime < in_use_since:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def normalize_image(image_path: str) -> NormalizedImage:
+    """Returns the normalized copy of an image, creating it if it is not cached."""
+    source_hash = hash_file(image_path)
+    directory = _cache_dir()
+    key = (
+        f"{source_hash}-{settings.IMAGE_MAX_LONG_EDGE}-"
+        f"{settings.IMAGE_JPEG_QUALITY}-v{NORMALIZER_VERSION}"
+    )
+    for extension, mime_type in ((".jpg", "image/jpeg"), (".png", "image/png")):
+        cached_path = os.path.join(directory, key + extension)
+        if os.path.exists(cached_path):
+            with Image.open(cached_path) as cached:
+                width, height = cached.size
+            os.utime(cached_path)  # Marks the entry as recently used for pruning
+            logger.info(f"Normalized image cache hit for {image_path}.")
+            return NormalizedImage(cached_path, mime_type, width, height)
+
+    started = time.perf_counter()
+    with Image.open(image_path) as source:
+        keep_png = _keeps_png(source)
+        # Only the first frame of animated images is kept
+        img = ImageOps.exif_transpose(source)
+        img.thumbnail(
+            (settings.IMAGE_MAX_LONG_EDGE, settings.IMAGE_MAX_LONG_EDGE),
+            Image.Resampling.LANCZOS,
+        )
+        if keep_png:
+            if img.mode not in ("RGB", "RGBA", "L", "LA"):
+                img = img.convert("RGBA")
+            extension, mime_type, save_args = ".png", "image/png", {"optimize": True}
+        else:
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            extension, mime_type, save_args = (
+                ".jpg",
+                "image/jpeg",
+                {"quality": settings.IMAGE_JPEG_QUALITY, "optimize": True},
+            )
+        width, height = img.size
+        output_path = os.path.join(directory, key + extension)
+        # Written under a temporary name so that concurrent workers never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=extension)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                # No exif/icc_profile arguments: the output carries no metadata
+                img.save(f, format="PNG" if keep_png else "JPEG", **save_args)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    logger.info(
+        f"Normalized {image_path} ({os.path.getsize(image_path)} bytes) to "
+        f"{width}x{height} {mime_type} ({os.path.getsize(output_path)} bytes) "
+        f"in {time.perf_counter() - started:.2f}s."
+    )
+    _prune_cache(directory, keep=output_path)
+    return NormalizedImage(output_path, mime_type, width, height)
+
+
+def mark_in_use(path: str) -> None:
+    """Marks a normalized image as recently used, so that pruning spares it.
+
+    Called right before the image is uploaded; paths outside the cache are left alone.
+    """
+    if os.path.dirname(os.path.abspath(path)) != os.path.abspath(_cache_dir()):
+        return
+    try:
+        os.utime(path)
+    except OSError as e:
+        logger.warning(f"Could not mark {path} as in use: {e}")
+
+
+def try_normalize_image(image_path: str) -> Optional[NormalizedImage]:
+    """Like normalize_image, but returns None (to send the original) on any failure."""
+    if not settings.IMAGE_NORMALIZATION_ENABLED:
+        return None
+    try:
+        return normalize_image(image_path)
+    except Exception as e:
+        logger.warning(f"Could not normalize {image_path}, sending the original: {e}")
+        return None
@@ -1,28 +1,33 @@
 import asyncio
+import datetime
+import hashlib
 import logging
 import os
-from typing import Any, Dict, List, Optional, Tuple, Union
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
 import httpx  # For timeout in native async call
 from google import genai
 from google.api_core import exceptions as google_exceptions
 from google.genai import errors as genai_errors
 from google.genai import types
-from tenacity import (
-    AsyncRetrying,
-    RetryError,
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_fixed,
-)
 
+import image_normalizer
+import report_sections
+import token_budget
+from core import resilience
 from core.config import settings
-from core.prompt_config import (
-    GUIDA_STILE_TERMINOLOGIA_ED_ESEMPI,
-    SCHEMA_REPORT,
-    SYSTEM_INSTRUCTION,
+from core.extraction_cache import hash_file
+from core.gemini_client import get_gemini_client
+from core.gemini_file_registry import get_gemini_file_registry
+from core.gemini_governor import (
+    GeminiOverloadedError,
+    gemini_call,
+    get_gemini_governor,
+    is_rate_limit_error,
 )
+from core.prompt_config import PromptSet, prompt_registry
 
 logger = logging.getLogger(__name__)
 
@@ -37,153 +42,1050 @@ RETRIABLE_GEMINI_EXCEPTIONS = (
     httpx.PoolTimeout,
 )
 
+ChunkCallback = Callable[[str], Awaitable[None]]
+
+
+def _is_retriable(e: BaseException) -> bool:
+    return isinstance(e, RETRIABLE_GEMINI_EXCEPTIONS) or is_rate_limit_error(e)
+
+
+def _as_int(value: Any) -> Optional[int]:
+    return value if isinstance(value, int) else None
+
+
+def _add_tokens(total: Optional[int], value: Any) -> Optional[int]:
+    value = _as_int(value)
+    if value is None:
+        return total
+    return (total or 0) + value
+
+
+class LLMGenerationResult:
+    """Outcome of a report generation: the text plus token usage and timings.
+
+    ``text`` holds either the report or, on failure, a message starting with
+    "Error". Token counts come from the response's usage metadata and stay None
+    if the API did not report them.
+    """
+
+    def __init__(self) -> None:
+        self.text: str = ""
+        self.model: str = settings.LLM_MODEL_NAME
+        self.prompt_tokens: Optional[int] = None  # Includes the cached tokens
+        self.cached_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self.thinking_tokens: Optional[int] = None
+        self.upload_bytes: int = 0  # Bytes sent to the File API for this report
+        # Cache holding the claim's documents for follow-up edits (see revise_report)
+        self.context_cache_name: Optional[str] = None
+        self.context_cache_expires_at: Optional[datetime.datetime] = None
+        self.timings: Dict[str, float] = {}  # Seconds per stage
+
+    @property
+    def is_error(self) -> bool:
+        return not self.text or self.text.strip().lower().startswith("error")
+
+    def record_usage(self, response: Any) -> None:
+        """Adds the usage of a generation call; continuation rounds add up."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self.prompt_tokens = _add_tokens(
+            self.prompt_tokens, getattr(usage, "prompt_token_count", None)
+        )
+        self.cached_tokens = _add_tokens(
+            self.cached_tokens, getattr(usage, "cached_content_token_count", None)
+        )
+        self.output_tokens = _add_tokens(
+            self.output_tokens, getattr(usage, "candidates_token_count", None)
+        )
+        self.thinking_tokens = _add_tokens(
+            self.thinking_tokens, getattr(usage, "thoughts_token_count", None)
+        )
+
+    @property
+    def cost_usd(self) -> Optional[float]:
+        """Cost of the generation call according to LLM_PRICES_USD_PER_MILLION_TOKENS."""
+        prices = settings.LLM_PRICES_USD_PER_MILLION_TOKENS.get(self.model)
+        if prices is None:
+            logger.warning(f"No price configured for model {self.model}.")
+            return None
+        if self.prompt_tokens is None and self.output_tokens is None:
+            return None
+        cached = self.cached_tokens or 0
+        uncached = max((self.prompt_tokens or 0) - cached, 0)
+        cost = (
+            uncached * prices["input"]
+            + cached * prices.get("cached_input", prices["input"])
+            + (self.output_tokens or 0) * prices["output"]
+            + (self.thinking_tokens or 0) * prices.get("thinking", prices["output"])
+        )
+        return cost / 1_000_000
 
-async def _get_or_create_prompt_cache(client: genai.Client) -> Optional[str]:
-    """Retries an existing prompt cache or creates a new one.
 
-    Checks for a cache name in settings. If found, tries to retrieve it.
-    If not found or invalid, creates a new cache with predefined prompts.
+class LLMStreamInterruptedError(Exception):
+    """Raised when a streamed generation fails after some output was already emitted.
+
+    Such a stream is not retried, since replaying it would duplicate the chunks the
+    caller has already received.
+    """
+
+    def __init__(self, partial_text: str, cause: BaseException):
+        super().__init__(
+            f"Stream interrupted after {len(partial_text)} characters: {cause!r}"
+        )
+        self.partial_text = partial_text
+        self.cause = cause
+
+
+async def _generate_content(
+    client: genai.Client,
+    contents: List[Union[str, types.Part, types.File]],
+    config: types.GenerateContentConfig,
+    on_chunk: Optional[ChunkCallback] = None,
+) -> Tuple[Any, Optional[str]]:
+    """Runs a single generation call, bounded by LLM_API_TIMEOUT_SECONDS.
+
+    Without ``on_chunk`` this is a plain ``generate_content`` call. With it, the
+    streaming API is used and every text chunk is handed to ``on_chunk`` as soon as
+    it arrives.
 
     Returns:
-        Optional[str]: The name of the active cache, or None if an error occurs.
+        A tuple of the response (the last chunk when streaming) and the full
+        streamed text, which is None for non-streaming calls.
     """
-    existing_cache_name = settings.REPORT_PROMPT_CACHE_NAME
-    active_cache_name: Optional[str] = None
+    if on_chunk is None:
+        response = await asyncio.wait_for(
+            client.aio.models.generate_content(
+                model=settings.LLM_MODEL_NAME,
+                contents=contents,
+                config=config,
+            ),
+            timeout=settings.LLM_API_TIMEOUT_SECONDS,
+        )
+        return response, None
+
+    streamed_parts: List[str] = []
+    last_chunk: Any = None
+
+    async def _consume_stream() -> None:
+        nonlocal last_chunk
+        stream = await client.aio.models.generate_content_stream(
+            model=settings.LLM_MODEL_NAME,
+            contents=contents,
+            config=config,
+        )
+        async for chunk in stream:
+            last_chunk = chunk
+            chunk_text = chunk.text
+            if chunk_text:
+                streamed_parts.append(chunk_text)
+                await on_chunk(chunk_text)
+
+    try:
+        await asyncio.wait_for(
+            _consume_stream(), timeout=settings.LLM_API_TIMEOUT_SECONDS
+        )
+    except Exception as e:
+        if streamed_parts:
+            raise LLMStreamInterruptedError("".join(streamed_parts), e) from e
+        raise
+    return last_chunk, "".join(streamed_parts)
+
+
+def _response_text(response: Any) -> str:
+    """Text of a (non-streamed) response, joined from the candidates' parts if needed."""
+    try:
+        if response.text:
+            return response.text
+        if response.candidates:
+            parts_text: List[str] = []
+            for candidate in response.candidates:
+                if candidate.content and candidate.content.parts:
+                    for part in candidate.content.parts:
+                        if hasattr(part, "text") and part.text is not None:
+                            parts_text.append(part.text)
+            return "".join(parts_text)
+    except AttributeError as e:
+        logger.warning(
+            f"AttributeError while accessing response text or parts: {e}.",
+            exc_info=True,
+        )
+    return ""
+
+
+def _finish_reason_name(response: Any) -> Optional[str]:
+    candidates = getattr(response, "candidates", None)
+    if not isinstance(candidates, list) or not candidates:
+        return None
+    finish_reason = getattr(candidates[0], "finish_reason", None)
+    if finish_reason is None:
+        return None
+    return finish_reason.name if hasattr(finish_reason, "name") else str(finish_reason)
+
+
+async def _continue_truncated_report(
+    client: genai.Client,
+    prompt_parts: List[Union[str, types.Part, types.File]],
+    config: types.GenerateContentConfig,
+    report_text: str,
+    schema_report: str,
+    estimated_tokens: int,
+    on_chunk: Optional[ChunkCallback],
+    metrics: "LLMGenerationResult",
+) -> str:
+    """Completes a report whose generation stopped at the output token limit.
+
+    Each round cuts the report back to its last complete section and asks the
+    model to resume from the heading of the section it was cut in, with the
+    complete sections as context; the continuation is stitched onto them. Gives
+    up after LLM_CONTINUATION_MAX_ROUNDS rounds, or when a round does not get
+    past the section the previous one resumed from.
+
+    Returns:
+        The stitched report, or an "Error..." message.
+    """
+    headings = report_sections.section_headings(schema_report)
+    resumed_index = -1
+    for round_number in range(1, settings.LLM_CONTINUATION_MAX_ROUNDS + 1):
+        prefix, heading = report_sections.split_before_last_section(
+            report_text, headings
+        )
+        if heading is None or headings.index(heading) <= resumed_index:
+            logger.warning("Continuation would not get past the truncated section.")
+            break
+        resumed_index = headings.index(heading)
+        logger.warning(
+            f"Generation stopped at MAX_TOKENS; continuation round {round_number} "
+            f"resumes from section '{heading}'."
+        )
+        if on_chunk is not None:
+            # The live preview is append-only: mark where the resumed text starts
+            await on_chunk(
+                f"\n\n[... generazione ripresa dalla sezione {heading} ...]\n\n"
+            )
+
+        contents = prompt_parts + [
+            report_sections.continuation_instruction(prefix, heading)
+        ]
+        round_tokens = estimated_tokens + token_budget.estimate_text_tokens(prefix)
+
+        async def _generate_continuation() -> Any:
+            async with gemini_call(generation=True, estimated_tokens=round_tokens):
+                return await _generate_content(client, contents, config, on_chunk)
+
+        try:
+            response, streamed_text = await resilience.get_policy("generate").call(
+                _generate_continuation, _is_retriable
+            )
+        except LLMStreamInterruptedError as e:
+            logger.error(f"LLM stream failed mid-continuation: {e}", exc_info=True)
+            return f"Error: The LLM stream was interrupted after {len(e.partial_text)} characters. Details: {e.cause}"
+        except asyncio.TimeoutError as e:
+            logger.error(f"LLM continuation call timed out: {e}", exc_info=True)
+            return "Error: The LLM API call timed out."
+
+        metrics.record_usage(response)
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = _as_int(getattr(usage, "prompt_token_count", None))
+        governor = get_gemini_governor()
+        if governor is not None and prompt_tokens is not None:
+            await asyncio.to_thread(governor.record_tokens, round_tokens, prompt_tokens)
+
+        continuation = (
+            streamed_text if streamed_text is not None else _response_text(response)
+        )
+        if not continuation:
+            logger.error(f"Continuation round {round_number} returned no text.")
+            break
+        report_text = report_sections.stitch(prefix, continuation, heading)
+        if _finish_reason_name(response) != types.FinishReason.MAX_TOKENS.name:
+            logger.info(f"Report completed after {round_number} continuation rounds.")
+            return report_text
+
+    return "Error: Content generation reached maximum token limit. The generated text may be incomplete."
+
+
+def _to_part(part: Union[str, types.Part, types.File]) -> types.Part:
+    if isinstance(part, types.File):
+        return types.Part.from_uri(file_uri=part.uri, mime_type=part.mime_type)
+    if isinstance(part, str):
+        return types.Part(text=part)
+    return part
+
+
+async def _create_document_cache(
+    client: genai.Client,
+    prompts: PromptSet,
+    document_parts: List[Union[str, types.Part, types.File]],
+    ttl_seconds: int,
+    display_name: str,
+) -> Optional[types.CachedContent]:
+    """Caches the prompts together with the documents of one report.
+
+    Returns:
+        The cache, or None if it could not be created (e.g. the documents are
+        below the model's minimum cacheable size).
+    """
+    model_id_for_creation = settings.LLM_MODEL_NAME
+    if model_id_for_creation.startswith("models/"):
+        model_id_for_creation = model_id_for_creation.split("/")[-1]
+    contents = [
+        types.Content(
+            parts=[
+                types.Part(text=prompts.style_guide),
+                types.Part(text=prompts.schema_report),
+                *[_to_part(part) for part in document_parts],
+            ],
+            role="user",
+        )
+    ]
+    try:
+        cache = await _run_with_retry(
+            lambda: client.caches.create(
+                model=model_id_for_creation,
+                config={
+                    "contents": contents,
+                    "system_instruction": types.Content(
+                        parts=[types.Part(text=prompts.system_instruction)],
+                        role="system",
+                    ),
+                    "ttl": f"{ttl_seconds}s",
+                    "display_name": display_name,
+                },
+            )
+        )
+    except Exception as e:
+        logger.warning(f"Could not cache the documents of the report: {e}")
+        return None
+    logger.info(f"Created document cache {cache.name} with TTL {ttl_seconds}s.")
+    return cache
+
+
+async def _delete_cached_content(client: genai.Client, name: str) -> None:
+    try:
+        await _run_with_retry(lambda: client.caches.delete(name=name))
+        logger.info(f"Deleted cached content {name}.")
+    except Exception as e:
+        logger.warning(f"Could not delete cached content {name}: {e}")
+
+
+class _SectionStreams:
+    """Forwards the chunks of concurrently generated sections in report order.
+
+    The first unfinished section streams live; the chunks of the following ones
+    are held back and flushed as soon as every section before them is done.
+    """
+
+    def __init__(self, on_chunk: ChunkCallback, count: int):
+        self._on_chunk = on_chunk
+        self._buffers: List[List[str]] = [[] for _ in range(count)]
+        self._finished = [False] * count
+        self._current = 0
+        self._lock = asyncio.Lock()
+
+    def writer(self, index: int) -> ChunkCallback:
+        async def _write(text: str) -> None:
+            async with self._lock:
+                if index == self._current:
+                    await self._on_chunk(text)
+                else:
+                    self._buffers[index].append(text)
+
+        return _write
+
+    async def finish(self, index: int) -> None:
+        async with self._lock:
+            self._finished[index] = True
+            while self._current < len(self._finished) and self._finished[self._current]:
+                self._current += 1
+                if self._current < len(self._buffers):
+                    await self._on_chunk("\n\n")
+                    for text in self._buffers[self._current]:
+                        await self._on_chunk(text)
+                    self._buffers[self._current] = []
+
+
+async def _generate_sections(
+    client: genai.Client,
+    prompts: PromptSet,
+    headings: List[str],
+    document_parts: List[Union[str, types.Part, types.File]],
+    prompt_parts: List[Union[str, types.Part, types.File]],
+    generation_config_args: Dict[str, Any],
+    estimated_tokens: int,
+    on_chunk: Optional[ChunkCallback],
+    metrics: "LLMGenerationResult",
+    context_cache_name: Optional[str] = None,
+) -> str:
+    """Generates the sections of the schema concurrently and assembles them.
+
+    The documents are cached once, with the prompts, for the duration of the
+    report so that every section call reads the same context without sending it
+    again; if that fails, each call sends ``prompt_parts`` (which rely on the
+    shared prompt cache when ``generation_config_args`` names one). A claim's
+    ``context_cache_name``, when given, is used instead and kept. The sections
+    are then checked by a consistency pass, unless LLM_CONSISTENCY_PASS_ENABLED
+    is off.
+
+    Returns:
+        The assembled report, or an "Error..." message.
+    """
+    cache_name = None
+    if context_cache_name is None:
+        stage_started = time.perf_counter()
+        section_cache = await _create_document_cache(
+            client,
+            prompts,
+            document_parts,
+            settings.LLM_SECTION_CACHE_TTL_SECONDS,
+            f"report-sections-{int(time.time())}",
+        )
+        cache_name = section_cache.name if section_cache else None
+        metrics.timings["document_cache"] = time.perf_counter() - stage_started
+    if context_cache_name:
+        config_args = {**generation_config_args, "cached_content": context_cache_name}
+        context_parts: List[Union[str, types.Part, types.File]] = []
+    elif cache_name:
+        config_args = {**generation_config_args, "cached_content": cache_name}
+        context_parts = []
+    else:
+        config_args = generation_config_args
+        context_parts = prompt_parts
+    config = types.GenerateContentConfig(**config_args)
+    streams = _SectionStreams(on_chunk, len(headings)) if on_chunk else None
+    governor = get_gemini_governor()
+
+    async def _generate_section(index: int) -> str:
+        contents = context_parts + [
+            report_sections.section_instruction(headings, index)
+        ]
+        section_on_chunk = streams.writer(index) if streams else None
+
+        async def _attempt() -> Any:
+            async with gemini_call(generation=True, estimated_tokens=estimated_tokens):
+                return await _generate_content(
+                    client, contents, config, section_on_chunk
+                )
+
+        try:
+            response, streamed_text = await resilience.get_policy("generate").call(
+                _attempt, _is_retriable
+            )
+        finally:
+            if streams:
+                await streams.finish(index)
+        metrics.record_usage(response)
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = _as_int(getattr(usage, "prompt_token_count", None))
+        if governor is not None and prompt_tokens is not None:
+            await asyncio.to_thread(
+                governor.record_tokens, estimated_tokens, prompt_tokens
+            )
+        if _finish_reason_name(response) == types.FinishReason.MAX_TOKENS.name:
+            raise RuntimeError("the section reached the maximum token limit")
+        text = streamed_text if streamed_text is not None else _response_text(response)
+        if not text:
+            raise RuntimeError("no text was generated")
+        return report_sections.trim_section(text, headings, index)
+
+    try:
+        stage_started = time.perf_counter()
+        logger.info(f"Generating {len(headings)} report sections concurrently.")
+        results = await asyncio.gather(
+            *[_generate_section(index) for index in range(len(headings))],
+            return_exceptions=True,
+        )
+        metrics.timings["sections"] = time.perf_counter() - stage_started
+        for heading, result in zip(headings, results):
+            if isinstance(result, (resilience.CircuitOpenError, GeminiOverloadedError)):
+                raise result
+            if isinstance(result, BaseException):
+                logger.error(
+                    f"Generation of section '{heading}' failed: {result}",
+                    exc_info=result,
+                )
+                return f"Error: Generation of section '{heading}' failed. Details: {result}"
+        report_text = report_sections.assemble(results)  # type: ignore[arg-type]
+
+        if settings.LLM_CONSISTENCY_PASS_ENABLED:
+            stage_started = time.perf_counter()
+            report_text = await _apply_consistency_pass(
+                client,
+                context_parts,
+                config_args,
+                report_text,
+                estimated_tokens,
+                metrics,
+            )
+            metrics.timings["consistency"] = time.perf_counter() - stage_started
+        return report_text
+    finally:
+        if cache_name:
+            await _delete_cached_content(client, cache_name)
+
+
+async def _apply_consistency_pass(
+    client: genai.Client,
+    context_parts: List[Union[str, types.Part, types.File]],
+    config_args: Dict[str, Any],
+    report_text: str,
+    estimated_tokens: int,
+    metrics: "LLMGenerationResult",
+) -> str:
+    """Asks for the corrections that make the sections agree and applies them.
+
+    The pass is best effort: when it fails, the assembled report is kept as is.
+    """
+    config = types.GenerateContentConfig(
+        **{
+            **config_args,
+            "max_output_tokens": settings.LLM_CONSISTENCY_MAX_TOKENS,
+            "temperature": 0.0,
+            "response_mime_type": "application/json",
+        }
+    )
+    contents = context_parts + [report_sections.consistency_instruction(report_text)]
+    round_tokens = estimated_tokens + token_budget.estimate_text_tokens(report_text)
+
+    async def _attempt() -> Any:
+        async with gemini_call(generation=True, estimated_tokens=round_tokens):
+            return await _generate_content(client, contents, config)
+
+    try:
+        response, _ = await resilience.get_policy("generate").call(
+            _attempt, _is_retriable
+        )
+    except Exception as e:
+        logger.warning(f"Consistency pass failed; keeping the assembled report: {e}")
+        return report_text
+    metrics.record_usage(response)
+    corrections = report_sections.parse_corrections(_response_text(response))
+    report_text, applied = report_sections.apply_corrections(report_text, corrections)
+    logger.info(
+        f"Consistency pass applied {applied} of {len(corrections)} corrections."
+    )
+    return report_text
+
+
+def _context_cache_display_name(
+    prompts: PromptSet, document_parts: List[Union[str, types.Part, types.File]]
+) -> str:
+    """Names a claim's context cache after the prompts and documents it holds."""
+    digest = hashlib.sha256(_prompt_cache_hash(prompts).encode("utf-8"))
+    for part in document_parts:
+        if isinstance(part, types.File):
+            digest.update(f"file:{part.uri}".encode("utf-8"))
+        else:
+            digest.update(str(part).encode("utf-8"))
+    return f"claim-context-{digest.hexdigest()[:32]}"
+
+
+def _edit_window_seconds() -> int:
+    return settings.REPORT_EDIT_WINDOW_HOURS * 3600
+
+
+async def _get_or_create_context_cache(
+    client: genai.Client,
+    prompts: PromptSet,
+    document_parts: List[Union[str, types.Part, types.File]],
+) -> Optional[Tuple[str, datetime.datetime]]:
+    """Returns a cache holding the prompts and documents of a claim.
+
+    A live cache holding the same bundle (e.g. when a claim is uploaded again)
+    is reused and its editing window restarted; otherwise a cache living
+    REPORT_EDIT_WINDOW_HOURS is created.
+
+    Returns:
+        The cache name and its expiry (naive UTC), or None if it could not be
+        created.
+    """
+    display_name = _context_cache_display_name(prompts, document_parts)
+    try:
+        caches = await _run_with_retry(lambda: list(client.caches.list()))
+    except Exception as e:
+        logger.warning(f"Could not list existing context caches: {e}")
+        caches = []
+    for cache in caches:
+        if (
+            cache.display_name == display_name
+            and cache.model
+            and cache.model.endswith(settings.LLM_MODEL_NAME)
+        ):
+            expires_at = await extend_context_cache(cache.name)
+            if expires_at is not None:
+                logger.info(f"Reusing context cache {cache.name} for the same claim.")
+                return cache.name, expires_at
+
+    cache = await _create_document_cache(
+        client, prompts, document_parts, _edit_window_seconds(), display_name
+    )
+    if cache is None:
+        return None
+    return cache.name, _context_cache_expiry(cache)
+
+
+def _context_cache_expiry(cache: types.CachedContent) -> datetime.datetime:
+    """Returns the expiry of a cache as naive UTC, as reported by the API when known.
+
+    The API's own timestamp lets delete_context_cache tell whether the cache was
+    extended since, without depending on the local clock.
+    """
+    if isinstance(cache.expire_time, datetime.datetime):
+        expire_time = cache.expire_time
+        if expire_time.tzinfo is not None:
+            expire_time = expire_time.astimezone(datetime.timezone.utc).replace(
+                tzinfo=None
+            )
+        return expire_time
+    return datetime.datetime.utcnow() + datetime.timedelta(
+        seconds=_edit_window_seconds()
+    )
+
+
+async def extend_context_cache(cache_name: str) -> Optional[datetime.datetime]:
+    """Restarts the editing window of a claim's context cache.
+
+    Returns:
+        The new expiry (naive UTC), or None if the cache no longer exists.
+    """
+    client = get_gemini_client()
+    try:
+        cache = await _run_with_retry(
+            lambda: client.caches.update(
+                name=cache_name,
+                config=types.UpdateCachedContentConfig(
+                    ttl=f"{_edit_window_seconds()}s"
+                ),
+            )
+        )
+    except Exception as e:
+        if not _is_not_found(e):
+            logger.error(
+                f"Failed to extend context cache {cache_name}: {e}", exc_info=True
+            )
+        return None
+    return _context_cache_expiry(cache)
+
+
+async def delete_context_cache(
+    cache_name: str, bound_until: Optional[datetime.datetime] = None
+) -> None:
+    """Deletes a claim's context cache once no report refers to it any more.
+
+    A report generated from the same documents may already be reusing the cache
+    before it is bound to it. Reuse restarts the editing window, so a cache that
+    now expires after ``bound_until`` (the expiry held by its last report) is kept.
+    """
+    client = get_gemini_client()
+    if bound_until is not None:
+        try:
+            cache = await _run_with_retry(lambda: client.caches.get(name=cache_name))
+        except Exception as e:
+            if not _is_not_found(e):
+                logger.warning(f"Could not check context cache {cache_name}: {e}")
+            return
+        if _context_cache_expiry(cache) > bound_until:
+            logger.info(f"Keeping context cache {cache_name}: it was reused since.")
+            return
+    await _delete_cached_content(client, cache_name)
+
+
+class PromptCacheHandle:
+    """In-memory handle of the active Gemini prompt cache, shared by all reports."""
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        expire_time: Optional[datetime.datetime],
+        prompt_hash: str,
+    ):
+        self.name = name
+        self.model = model
+        self.expire_time = expire_time
+        self.prompt_hash = prompt_hash
+
+    def seconds_left(self) -> float:
+        if self.expire_time is None:
+            return float("inf")
+        return self.expire_time.timestamp() - time.time()
+
+
+_prompt_cache_handle: Optional[PromptCacheHandle] = None
+_prompt_cache_locks: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]"
+) = weakref.WeakKeyDictionary()
+
+
+def _get_prompt_cache_lock() -> asyncio.Lock:
+    """Returns the lock serializing cache creation on the running event loop."""
+    loop = asyncio.get_running_loop()
+    lock = _prompt_cache_locks.get(loop)
+    if lock is None:
+        lock = _prompt_cache_locks[loop] = asyncio.Lock()
+    return lock
 
+
+def _prompt_cache_hash(prompts: PromptSet) -> str:
+    """Hashes the model and the prompt texts stored in the cache."""
+    digest = hashlib.sha256(settings.LLM_MODEL_NAME.encode("utf-8"))
+    digest.update(prompts.hash.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _prompt_cache_display_name(prompt_hash: str) -> str:
+    return f"{settings.CACHE_DISPLAY_NAME}-{prompt_hash[:12]}"
+
+
+def _is_fresh(handle: Optional[PromptCacheHandle], prompt_hash: str) -> bool:
+    return (
+        handle is not None
+        and handle.prompt_hash == prompt_hash
+        and handle.seconds_left() > settings.CACHE_REFRESH_MARGIN_HOURS * 3600
+    )
+
+
+def _is_not_found(e: Exception) -> bool:
+    return isinstance(e, google_exceptions.NotFound) or (
+        isinstance(e, genai_errors.ClientError) and e.code == 404
+    )
+
+
+def _invalidate_prompt_cache() -> None:
+    """Forgets the in-memory handle so that the next report resolves the cache again."""
+    global _prompt_cache_handle
+    _prompt_cache_handle = None
+
+
+async def _run_with_retry(func: Callable[[], Any], operation: str = "cache") -> Any:
+    """Runs a blocking Gemini SDK call in a thread, governed and retried on transient errors.
+
+    ``operation`` names the resilience policy (retry budget and circuit breaker)
+    the call is accounted to.
+    """
+
+    async def _attempt() -> Any:
+        async with gemini_call():
+            return await asyncio.to_thread(func)
+
+    return await resilience.get_policy(operation).call(_attempt, _is_retriable)
+
+
+def _handle_from_cache(
+    cache: types.CachedContent, prompt_hash: str
+) -> PromptCacheHandle:
+    return PromptCacheHandle(
+        name=cache.name,
+        model=cache.model,
+        expire_time=cache.expire_time,
+        prompt_hash=prompt_hash,
+    )
+
+
+def _matches(cache: types.CachedContent, prompt_hash: str) -> bool:
+    # Model name in cache includes 'models/' prefix
+    return (
+        bool(cache.model)
+        and cache.model.endswith(settings.LLM_MODEL_NAME)
+        and cache.display_name == _prompt_cache_display_name(prompt_hash)
+    )
+
+
+async def _find_prompt_cache(
+    client: genai.Client, prompt_hash: str
+) -> Optional[PromptCacheHandle]:
+    """Looks for an existing cache holding the current prompts.
+
+    The cache named in REPORT_PROMPT_CACHE_NAME is tried first; otherwise the
+    project's caches are searched by display name, which embeds the prompt hash,
+    so restarts and other processes reuse the same cache instead of creating one.
+    """
+    existing_cache_name = settings.REPORT_PROMPT_CACHE_NAME
     if existing_cache_name:
         logger.info(f"Attempting to retrieve existing cache: {existing_cache_name}")
+        # Ensure the cache name has the correct prefix for retrieval
+        cache_name_for_get = existing_cache_name
+        if not existing_cache_name.startswith("cachedContents/"):
+            cache_name_for_get = f"cachedContents/{existing_cache_name}"
         try:
-            # Ensure the cache name has the correct prefix for retrieval
-            cache_name_for_get = existing_cache_name
-            if not existing_cache_name.startswith("cachedContents/"):
-                cache_name_for_get = f"cachedContents/{existing_cache_name}"
-
-            @retry(
-                stop=stop_after_attempt(settings.LLM_API_RETRY_ATTEMPTS),
-                wait=wait_fixed(settings.LLM_API_RETRY_WAIT_SECONDS),
-                retry=retry_if_exception_type(RETRIABLE_GEMINI_EXCEPTIONS),
-                reraise=True,
-            )
-            def _get_cache_with_retry():
-                return client.caches.get(name=cache_name_for_get)
-
-            cache = await asyncio.to_thread(_get_cache_with_retry)
-            # Enhanced cache validation
+            cache = await _run_with_retry(
+                lambda: client.caches.get(name=cache_name_for_get)
+            )
             logger.info(
                 f"Retrieved cache: {cache.name}, model: {cache.model}, expires_time: {getattr(cache, 'expire_time', 'unknown')}"
             )
-            # Basic validation: check if it's for the same model and not expired (implicitly, get succeeds)
-            if cache.model.endswith(
-                settings.LLM_MODEL_NAME
-            ):  # Model name in cache includes 'models/' prefix
+            if _matches(cache, prompt_hash):
                 logger.info(
                     f"Successfully retrieved and validated existing cache: {cache.name}"
                 )
-                active_cache_name = cache.name
-            else:
-                logger.warning(
-                    f"Existing cache {existing_cache_name} is for a different model ({cache.model}) than expected ({settings.LLM_MODEL_NAME}). \
-                    Will create a new cache for {settings.LLM_MODEL_NAME}."
-                )
-        except google_exceptions.NotFound:
+                return _handle_from_cache(cache, prompt_hash)
             logger.warning(
-                f"Existing cache {existing_cache_name} not found. Will create a new one."
-            )
-        except RetryError as re:  # Catch tenacity's RetryError after attempts exhausted
-            logger.error(
-                f"Failed to retrieve cache {existing_cache_name} after multiple retries: {re}. Will attempt to create a new one.",
-                exc_info=True,
+                f"Existing cache {existing_cache_name} ({cache.display_name}, {cache.model}) does not hold the current prompts for {settings.LLM_MODEL_NAME}. \
+                Will look for or create a matching cache."
             )
         except Exception as e:
-            logger.error(
-                f"Error retrieving cache {existing_cache_name}: {e}. Will attempt to create a new one.",
-                exc_info=True,
-            )
-
-    if not active_cache_name:
-        logger.info(f"Creating new prompt cache for model: {settings.LLM_MODEL_NAME}")
-        try:
-            # Define content parts with roles
-            # The role for prompt-like content for the system/model to use is typically 'user'
-            # or 'model' if it's meant to be a pre-fill of a model's response.
-            # Given these are instructions and reference texts, 'user' seems appropriate.
-            cached_content_parts = [
-                types.Content(
-                    parts=[types.Part(text=GUIDA_STILE_TERMINOLOGIA_ED_ESEMPI)],
-                    role="user",
-                ),
-                types.Content(parts=[types.Part(text=SCHEMA_REPORT)], role="user"),
-            ]
-
-            ttl_seconds = settings.CACHE_TTL_DAYS * 24 * 60 * 60
-            ttl_string = f"{ttl_seconds}s"
-
-            # Ensure model name for cache creation is just the model ID, not prefixed with 'models/'
-            # The client.caches.create expects the pure model ID like 'gemini-1.5-flash-001'
-            # while cache.model from a get() call returns 'models/gemini-1.5-flash-001'.
-            model_id_for_creation = settings.LLM_MODEL_NAME
-            if model_id_for_creation.startswith("models/"):
-                model_id_for_creation = model_id_for_creation.split("/")[-1]
-
-            @retry(
-                stop=stop_after_attempt(settings.LLM_API_RETRY_ATTEMPTS),
-                wait=wait_fixed(settings.LLM_API_RETRY_WAIT_SECONDS),
-                retry=retry_if_exception_type(RETRIABLE_GEMINI_EXCEPTIONS),
-                reraise=True,
-            )
-            def _create_cache_with_retry():
-                return client.caches.create(
-                    model=model_id_for_creation,  # Use the raw model ID here
-                    config={
-                        "contents": cached_content_parts,  # Use the Content objects with roles
-                        "system_instruction": types.Content(
-                            parts=[types.Part(text=SYSTEM_INSTRUCTION)], role="system"
-                        ),  # System instruction should have role "system"
-                        "ttl": ttl_string,
-                        "display_name": settings.CACHE_DISPLAY_NAME,
-                    },
+            if _is_not_found(e):
+                logger.warning(
+                    f"Existing cache {existing_cache_name} not found. Will create a new one."
+                )
+            else:
+                logger.error(
+                    f"Error retrieving cache {existing_cache_name}: {e}. Will attempt to create a new one.",
+                    exc_info=True,
                 )
 
-            new_cache = await asyncio.to_thread(_create_cache_with_retry)
-            active_cache_name = new_cache.name
+    try:
+        caches = await _run_with_retry(lambda: list(client.caches.list()))
+    except Exception as e:
+        logger.warning(f"Could not list existing prompt caches: {e}")
+        return None
+    for cache in caches:
+        if _matches(cache, prompt_hash):
             logger.info(
-                f"Successfully created new cache: {active_cache_name} with TTL: {ttl_string}"
+                f"Found existing prompt cache {cache.name} for the current prompts."
             )
+            return _handle_from_cache(cache, prompt_hash)
+    return None
 
-            # Prepare the cache name for logging, ensuring no "cachedContents/" prefix.
-            log_cache_name = active_cache_name.replace("cachedContents/", "")
-            logger.info(
-                f'To reuse this cache in future runs, set the environment variable REPORT_PROMPT_CACHE_NAME="{log_cache_name}"'
+
+async def _extend_prompt_cache(
+    client: genai.Client, handle: PromptCacheHandle
+) -> Optional[PromptCacheHandle]:
+    """Resets the TTL of a cache. Returns None if the cache no longer exists."""
+    ttl_string = f"{settings.CACHE_TTL_DAYS * 24 * 60 * 60}s"
+    try:
+        cache = await _run_with_retry(
+            lambda: client.caches.update(
+                name=handle.name,
+                config=types.UpdateCachedContentConfig(ttl=ttl_string),
             )
-        except RetryError as re:
+        )
+    except Exception as e:
+        if not _is_not_found(e):
             logger.error(
-                f"Failed to create new prompt cache after multiple retries: {re}",
-                exc_info=True,
+                f"Failed to extend prompt cache {handle.name}: {e}", exc_info=True
             )
-            return None  # Or return LLMGenerationResult with error
-        except Exception as e:
-            logger.error(f"Failed to create new prompt cache: {e}", exc_info=True)
-            return None
+        return None
+    logger.info(f"Extended prompt cache {cache.name} until {cache.expire_time}.")
+    return _handle_from_cache(cache, handle.prompt_hash)
+
+
+async def _create_prompt_cache(
+    client: genai.Client, prompts: PromptSet, prompt_hash: str
+) -> Optional[PromptCacheHandle]:
+    """Creates a new cache with the current prompts."""
+    logger.info(f"Creating new prompt cache for model: {settings.LLM_MODEL_NAME}")
+    # The role for prompt-like content for the system/model to use is typically 'user'
+    # or 'model' if it's meant to be a pre-fill of a model's response.
+    # Given these are instructions and reference texts, 'user' seems appropriate.
+    cached_content_parts = [
+        types.Content(
+            parts=[types.Part(text=prompts.style_guide)],
+            role="user",
+        ),
+        types.Content(parts=[types.Part(text=prompts.schema_report)], role="user"),
+    ]
+
+    ttl_seconds = settings.CACHE_TTL_DAYS * 24 * 60 * 60
+    ttl_string = f"{ttl_seconds}s"
+
+    # Ensure model name for cache creation is just the model ID, not prefixed with 'models/'
+    # The client.caches.create expects the pure model ID like 'gemini-1.5-flash-001'
+    # while cache.model from a get() call returns 'models/gemini-1.5-flash-001'.
+    model_id_for_creation = settings.LLM_MODEL_NAME
+    if model_id_for_creation.startswith("models/"):
+        model_id_for_creation = model_id_for_creation.split("/")[-1]
+
+    try:
+        new_cache = await _run_with_retry(
+            lambda: client.caches.create(
+                model=model_id_for_creation,  # Use the raw model ID here
+                config={
+                    "contents": cached_content_parts,  # Use the Content objects with roles
+                    "system_instruction": types.Content(
+                        parts=[types.Part(text=prompts.system_instruction)],
+                        role="system",
+                    ),  # System instruction should have role "system"
+                    "ttl": ttl_string,
+                    "display_name": _prompt_cache_display_name(prompt_hash),
+                },
+            )
+        )
+    except Exception as e:
+        logger.error(f"Failed to create new prompt cache: {e}", exc_info=True)
+        return None
+
+    logger.info(
+        f"Successfully created new cache: {new_cache.name} with TTL: {ttl_string}"
+    )
+    # Prepare the cache name for logging, ensuring no "cachedContents/" prefix.
+    log_cache_name = new_cache.name.replace("cachedContents/", "")
+    logger.info(
+        f'To reuse this cache in future runs, set the environment variable REPORT_PROMPT_CACHE_NAME="{log_cache_name}"'
+    )
+    return _handle_from_cache(new_cache, prompt_hash)
+
 
-    return active_cache_name
+async def _get_or_create_prompt_cache(
+    client: genai.Client, prompts: Optional[PromptSet] = None
+) -> Optional[str]:
+    """Returns the name of a prompt cache holding the current prompts.
+
+    The handle is kept in memory, so the hot path makes no network call while the
+    cache has more than CACHE_REFRESH_MARGIN_HOURS left. Otherwise the cache is
+    extended, found again or created, under a lock so that concurrent reports
+    never create duplicate caches. While that is in progress, other reports keep
+    using the current cache, and the new handle is swapped in once it is ready.
+
+    Returns:
+        Optional[str]: The name of the active cache, or None if an error occurs.
+    """
+    global _prompt_cache_handle
+    if prompts is None:
+        prompts = prompt_registry.get_prompts()
+    prompt_hash = _prompt_cache_hash(prompts)
+    handle = _prompt_cache_handle
+    if _is_fresh(handle, prompt_hash):
+        return handle.name  # type: ignore[union-attr]
+
+    lock = _get_prompt_cache_lock()
+    if (
+        lock.locked()
+        and handle is not None
+        and handle.seconds_left() > settings.LLM_API_TIMEOUT_SECONDS
+    ):
+        return handle.name
+
+    async with lock:
+        handle = _prompt_cache_handle
+        if _is_fresh(handle, prompt_hash):
+            return handle.name  # type: ignore[union-attr]
+
+        if handle is None or handle.prompt_hash != prompt_hash:
+            handle = await _find_prompt_cache(client, prompt_hash)
+        if handle is not None and not _is_fresh(handle, prompt_hash):
+            handle = await _extend_prompt_cache(client, handle)
+        if handle is None:
+            handle = await _create_prompt_cache(client, prompts, prompt_hash)
+
+        _prompt_cache_handle = handle
+        return handle.name if handle else None
+
+
+async def refresh_prompt_cache() -> None:
+    """Makes sure a cache for the current prompts exists and is not about to expire."""
+    if not settings.GEMINI_API_KEY:
+        return
+    try:
+        await _get_or_create_prompt_cache(get_gemini_client())
+    except Exception as e:
+        logger.error(f"Background prompt cache refresh failed: {e}", exc_info=True)
+
+
+async def keep_prompt_cache_fresh() -> None:
+    """Extends or recreates the prompt cache before it expires. Runs until cancelled."""
+    while True:
+        await refresh_prompt_cache()
+        await asyncio.sleep(settings.CACHE_REFRESH_CHECK_SECONDS)
 
 
 async def generate_report_from_content(
-    processed_files: List[Dict[str, Any]], additional_text: str = ""
+    processed_files: List[Dict[str, Any]],
+    additional_text: str = "",
+    on_chunk: Optional[ChunkCallback] = None,
+) -> LLMGenerationResult:
+    """Generates an insurance report using Google Gemini with multimodal content and context caching.
+
+    When ``on_chunk`` is given (and LLM_STREAMING_ENABLED is set), the report is
+    generated with the streaming API and each text chunk is awaited through
+    ``on_chunk`` as it arrives; the full text is still returned at the end.
+
+    With LLM_CLAIM_CONTEXT_CACHE_ENABLED, the documents stay cached for the
+    report's editing window under ``context_cache_name`` (see revise_report); the
+    caller owns that cache, also when the generation failed.
+
+    Returns:
+        The report text (or an "Error..." message) with token usage, upload bytes
+        and per-stage timings.
+    """
+    result = LLMGenerationResult()
+    started = time.perf_counter()
+    result.text = await _generate_report(
+        processed_files, additional_text, on_chunk, result
+    )
+    result.timings["total"] = time.perf_counter() - started
+    return result
+
+
+class ReportRevision:
+    """A follow-up request on a report whose documents are in a context cache."""
+
+    def __init__(self, context_cache_name: str, current_report: str, request: str):
+        self.context_cache_name = context_cache_name
+        self.current_report = current_report
+        self.request = request
+
+
+async def revise_report(
+    revision: ReportRevision,
+    processed_files: Optional[List[Dict[str, Any]]] = None,
+    on_chunk: Optional[ChunkCallback] = None,
+) -> LLMGenerationResult:
+    """Applies a follow-up request (e.g. "rewrite section 4") to a finished report.
+
+    The claim's documents and the prompts are read from its context cache, so
+    only the delta is sent: the current report, the request and any new
+    documents in ``processed_files``. The model returns the sections it changes,
+    which replace those of the current report.
+
+    Returns:
+        The revised report (or an "Error..." message) with token usage and timings.
+    """
+    result = LLMGenerationResult()
+    started = time.perf_counter()
+    result.text = await _generate_report(
+        processed_files or [], "", on_chunk, result, revision
+    )
+    result.timings["total"] = time.perf_counter() - started
+    return result
+
+
+async def _generate_report(
+    processed_files: List[Dict[str, Any]],
+    additional_text: str,
+    on_chunk: Optional[ChunkCallback],
+    metrics: LLMGenerationResult,
+    revision: Optional[ReportRevision] = None,
 ) -> str:
-    """Generates an insurance report using Google Gemini with multimodal content and context caching."""
+    """Does the work of generate_report_from_content and revise_report, recording
+    metrics in ``metrics``."""
+    if not settings.LLM_STREAMING_ENABLED:
+        on_chunk = None
+
     if not settings.GEMINI_API_KEY:
         logger.error("GEMINI_API_KEY not configured in settings.")
         return "Error: LLM service is not configured (API key missing)."
 
-    client = genai.Client(api_key=settings.GEMINI_API_KEY)
+    client = get_gemini_client()
+    prompts = prompt_registry.get_prompts()
     uploaded_file_objects: List[types.File] = []
     temp_uploaded_file_names_for_api: List[str] = []
     final_prompt_parts: List[Union[str, types.Part, types.File]] = []
     active_cache_name_for_generation: Optional[str] = None
+    file_registry = get_gemini_file_registry()
+    reused_file_names: List[str] = []
 
     try:
-        active_cache_name_for_generation = await _get_or_create_prompt_cache(client)
+        if revision is not None:
+            # The context cache holds the prompts along with the documents
+            active_cache_name_for_generation = revision.context_cache_name
+        else:
+            stage_started = time.perf_counter()
+            active_cache_name_for_generation = await _get_or_create_prompt_cache(
+                client, prompts
+            )
+            metrics.timings["prompt_cache"] = time.perf_counter() - stage_started
 
         if not active_cache_name_for_generation:
             logger.warning(
@@ -192,14 +1094,15 @@ async def generate_report_from_content(
             # Fallback: Include prompts directly if caching failed
             final_prompt_parts.extend(
                 [
-                    GUIDA_STILE_TERMINOLOGIA_ED_ESEMPI,
+                    prompts.style_guide,
                     "\n\n",
-                    SCHEMA_REPORT,
+                    prompts.schema_report,
                     "\n\n",
-                    SYSTEM_INSTRUCTION,  # Add system instruction if not using cache where it's embedded
+                    prompts.system_instruction,  # Add system instruction if not using cache where it's embedded
                     "\n\n",
                 ]
             )
+        documents_start = len(final_prompt_parts)
 
         upload_coroutines = []
         processed_text_files_parts = []
@@ -221,7 +1124,34 @@ async def generate_report_from_content(
                 async def _upload_one_vision_file(
                     fp: str, display_name: str, mime_type: str
                 ) -> Union[types.File, None]:
-                    """Uploads a single file for vision processing to Gemini, handling potential errors."""
+                    """Uploads a single file for vision processing to Gemini, handling potential errors.
+
+                    If the same content was uploaded recently and is still valid, the
+                    registered upload is returned instead.
+                    """
+                    # Keeps a normalized copy from being pruned before it is read
+                    await asyncio.to_thread(image_normalizer.mark_in_use, fp)
+                    content_hash: Optional[str] = None
+                    if file_registry is not None:
+                        try:
+                            content_hash = await asyncio.to_thread(hash_file, fp)
+                            reusable_file = await asyncio.to_thread(
+                                file_registry.lookup,
+                                content_hash,
+                                mime_type,
+                                settings.GEMINI_FILE_REUSE_MARGIN_SECONDS,
+                            )
+                        except Exception as e:
+                            logger.warning(
+                                f"Could not check the upload registry for {display_name}: {e}"
+                            )
+                            reusable_file = None
+                        if reusable_file is not None:
+                            logger.info(
+                                f"Reusing Gemini upload {reusable_file.name} for {display_name}."
+                            )
+                            reused_file_names.append(reusable_file.name)
+                            return reusable_file
                     try:
                         logger.debug(
                             f"Attempting to upload file {display_name} from path: {fp} to Gemini."
@@ -234,28 +1164,28 @@ async def generate_report_from_content(
                             # mime_type="image/jpeg" # or "application/pdf", etc.
                         )
 
-                        @retry(
-                            stop=stop_after_attempt(settings.LLM_API_RETRY_ATTEMPTS),
-                            wait=wait_fixed(settings.LLM_API_RETRY_WAIT_SECONDS),
-                            retry=retry_if_exception_type(RETRIABLE_GEMINI_EXCEPTIONS),
-                            reraise=True,
+                        # Note: The client.files.upload might have its own timeout.
+                        # We are adding retries around it.
+                        uploaded_file = await _run_with_retry(
+                            lambda: client.files.upload(file=fp, config=upload_config),
+                            operation="upload",
+                        )
+                        metrics.upload_bytes += (
+                            uploaded_file.size_bytes or os.path.getsize(fp)
                         )
-                        def _upload_file_with_retry():
-                            # Note: The client.files.upload might have its own timeout.
-                            # We are adding retries around it.
-                            return client.files.upload(file=fp, config=upload_config)
-
-                        uploaded_file = await asyncio.to_thread(_upload_file_with_retry)
                         logger.debug(
                             f"Successfully uploaded file {display_name} (URI: {uploaded_file.uri}) to Gemini."
                         )
+                        if file_registry is not None and content_hash is not None:
+                            try:
+                                await asyncio.to_thread(
+                                    file_registry.register, content_hash, uploaded_file
+                                )
+                            except Exception as e:
+                                logger.warning(
+                                    f"Could not register upload {uploaded_file.name}: {e}"
+                                )
                         return uploaded_file
-                    except RetryError as re:
-                        logger.error(
-                            f"Failed to upload file {display_name} to Gemini after multiple retries: {re}",
-                            exc_info=True,
-                        )
-                        return None
                     except Exception as e:
                         logger.error(
                             f"Failed to upload file {display_name} to Gemini: {e}",
@@ -268,6 +1198,12 @@ async def generate_report_from_content(
                         file_path, display_name, mime_type_from_info
                     )
                 )
+                if file_info.get("duplicates"):
+                    processed_text_files_parts.append(
+                        f"\n\n[NOTA: La foto {display_name} è stata caricata una sola volta; "
+                        f"i file {', '.join(file_info['duplicates'])} ne sono copie quasi identiche "
+                        f"e non sono stati inviati.]\n\n"
+                    )
 
             elif file_info.get("type") == "text":
                 filename = file_info.get("filename", "documento testuale")
@@ -297,15 +1233,19 @@ async def generate_report_from_content(
             logger.info(
                 f"Starting upload of {len(upload_coroutines)} vision files to Gemini."
             )
+            stage_started = time.perf_counter()
             upload_results = await asyncio.gather(
                 *upload_coroutines, return_exceptions=False
             )  # return_exceptions=False handled in _upload_one_vision_file
+            metrics.timings["upload"] = time.perf_counter() - stage_started
             successful_uploads = 0
             failed_uploads = 0
             for result in upload_results:
                 if isinstance(result, types.File):
                     uploaded_file_objects.append(result)
-                    temp_uploaded_file_names_for_api.append(result.name)
+                    if file_registry is None:
+                        # Without the registry nothing else will reuse the upload
+                        temp_uploaded_file_names_for_api.append(result.name)
                     successful_uploads += 1
                 elif (
                     isinstance(result, tuple)
@@ -341,11 +1281,33 @@ async def generate_report_from_content(
         # These are `types.File` objects, which the API handles as references to uploaded content.
         final_prompt_parts.extend(uploaded_file_objects)
 
-        final_instruction = "\n\nAnalizza TUTTI i documenti, foto e testi forniti (sia quelli caricati come file referenziati, sia quelli inclusi direttamente come testo) e genera il report."
-        if active_cache_name_for_generation:
-            final_instruction += " Utilizza le istruzioni di stile, struttura e sistema precedentemente cachate."
+        # Everything after the prompts and before the final instruction
+        document_parts = final_prompt_parts[documents_start:]
+
+        if revision is None and settings.LLM_CLAIM_CONTEXT_CACHE_ENABLED:
+            # Keep the documents cached so that follow-up edits send only the delta
+            stage_started = time.perf_counter()
+            context_cache = await _get_or_create_context_cache(
+                client, prompts, document_parts
+            )
+            metrics.timings["context_cache"] = time.perf_counter() - stage_started
+            if context_cache is not None:
+                metrics.context_cache_name, metrics.context_cache_expires_at = (
+                    context_cache
+                )
+                active_cache_name_for_generation = metrics.context_cache_name
+                final_prompt_parts = []
+
+        if revision is not None:
+            final_instruction = report_sections.revision_instruction(
+                revision.current_report, revision.request
+            )
         else:
-            final_instruction += " Utilizza le istruzioni di stile, struttura e sistema fornite all'inizio di questo prompt."
+            final_instruction = "\n\nAnalizza TUTTI i documenti, foto e testi forniti (sia quelli caricati come file referenziati, sia quelli inclusi direttamente come testo) e genera il report."
+            if active_cache_name_for_generation:
+                final_instruction += " Utilizza le istruzioni di stile, struttura e sistema precedentemente cachate."
+            else:
+                final_instruction += " Utilizza le istruzioni di stile, struttura e sistema fornite all'inizio di questo prompt."
         final_prompt_parts.append(final_instruction)
 
         gen_config_dict = {
@@ -398,37 +1360,73 @@ async def generate_report_from_content(
                 "Request will NOT use cached content (prompts included directly)"
             )
 
-        # Use client.aio.models.generate_content for async call
+        # Input size charged to the governor's tokens-per-minute bucket; corrected
+        # with the reported usage once the response arrives
+        estimated_tokens = sum(
+            token_budget.estimate_text_tokens(part)
+            for part in final_prompt_parts
+            if isinstance(part, str)
+        ) + sum(
+            token_budget.estimate_vision_tokens(file_info)
+            for file_info in processed_files
+            if file_info.get("type") == "vision"
+        )
+
+        if settings.LLM_SECTION_PARALLEL_ENABLED and revision is None:
+            headings = report_sections.section_headings(prompts.schema_report)
+            if len(headings) > 1:
+                stage_started = time.perf_counter()
+                report_content = await _generate_sections(
+                    client,
+                    prompts,
+                    headings,
+                    document_parts,
+                    final_prompt_parts[:-1],  # Without the whole-report instruction
+                    generation_config_args,
+                    estimated_tokens,
+                    on_chunk,
+                    metrics,
+                    metrics.context_cache_name,
+                )
+                metrics.timings["generation"] = time.perf_counter() - stage_started
+                return report_content
+            logger.warning(
+                "The report schema has no numbered sections; generating serially."
+            )
+
+        # Use client.aio.models.generate_content (or its streaming variant) for async call
         response = None
+        streamed_text: Optional[str] = None
 
         # --- Main Generation Logic ---
         # We first try with the cache. If that fails with a specific, non-retriable
         # ClientError related to the cache, we then attempt a fallback without it.
 
+        # Prompt and config of the attempt that produced the response, reused by
+        # the continuation rounds
+        generation_parts = final_prompt_parts
+        generation_config = final_config
+
+        stage_started = time.perf_counter()
         try:
             # ATTEMPT 1: With cache (if available)
             logger.info(
                 "Attempting LLM generation with current settings (including cache if configured)."
             )
-            async for attempt in AsyncRetrying(
-                stop=stop_after_attempt(settings.LLM_API_RETRY_ATTEMPTS),
-                wait=wait_fixed(settings.LLM_API_RETRY_WAIT_SECONDS),
-                retry=retry_if_exception_type(RETRIABLE_GEMINI_EXCEPTIONS),
-                reraise=True,
-            ):
-                with attempt:
-                    logger.debug(
-                        f"Calling Gemini generate_content (attempt {attempt.retry_state.attempt_number})..."
-                    )
-                    response = await asyncio.wait_for(
-                        client.aio.models.generate_content(
-                            model=settings.LLM_MODEL_NAME,
-                            contents=final_prompt_parts,
-                            config=final_config,
-                        ),
-                        timeout=settings.LLM_API_TIMEOUT_SECONDS,
+
+            async def _generate_with_cache() -> Any:
+                logger.debug("Calling Gemini generate_content...")
+                async with gemini_call(
+                    generation=True, estimated_tokens=estimated_tokens
+                ):
+                    return await _generate_content(
+                        client, final_prompt_parts, final_config, on_chunk
                     )
 
+            response, streamed_text = await resilience.get_policy("generate").call(
+                _generate_with_cache, _is_retriable
+            )
+
         except genai_errors.ClientError as e:
             # This block catches non-retriable client errors from the first attempt.
             # The most important one to handle is a potential cache-related error.
@@ -445,25 +1443,38 @@ async def generate_report_from_content(
                 )
             )
 
+            if revision is not None and (
+                is_cache_error or getattr(e, "code", None) in (403, 404)
+            ):
+                logger.warning(
+                    f"Context cache {revision.context_cache_name} is no longer usable: {e}"
+                )
+                return "Error: The documents of this report are no longer cached. Please generate the report again."
+
             if is_cache_error:
                 logger.warning(
                     "Cache-related INVALID_ARGUMENT error detected. Attempting fallback generation without cache."
                 )
+                _invalidate_prompt_cache()
 
                 # Rebuild config without cache and include prompts directly
                 # This is necessary because the original prompt parts might not have the full text
                 # if caching was expected to work.
                 final_prompt_parts_fallback = [
-                    GUIDA_STILE_TERMINOLOGIA_ED_ESEMPI,
+                    prompts.style_guide,
                     "\n\n",
-                    SCHEMA_REPORT,
+                    prompts.schema_report,
                     "\n\n",
-                    SYSTEM_INSTRUCTION,
+                    prompts.system_instruction,
                     "\n\n",
                 ]
                 final_prompt_parts_fallback.extend(
-                    final_prompt_parts
+                    document_parts + [final_instruction]
                 )  # Add the content parts
+                if metrics.context_cache_name:
+                    # A broken context cache is of no use for follow-up edits either
+                    await _delete_cached_content(client, metrics.context_cache_name)
+                    metrics.context_cache_name = metrics.context_cache_expires_at = None
 
                 fallback_config_args = {
                     k: v
@@ -477,21 +1488,23 @@ async def generate_report_from_content(
                     logger.info(
                         "Calling Gemini generate_content for the second time (fallback without cache)."
                     )
-                    async for attempt in AsyncRetrying(
-                        stop=stop_after_attempt(settings.LLM_API_RETRY_ATTEMPTS),
-                        wait=wait_fixed(settings.LLM_API_RETRY_WAIT_SECONDS),
-                        retry=retry_if_exception_type(RETRIABLE_GEMINI_EXCEPTIONS),
-                        reraise=True,
-                    ):
-                        with attempt:
-                            response = await asyncio.wait_for(
-                                client.aio.models.generate_content(
-                                    model=settings.LLM_MODEL_NAME,
-                                    contents=final_prompt_parts_fallback,
-                                    config=fallback_config,
-                                ),
-                                timeout=settings.LLM_API_TIMEOUT_SECONDS,
+
+                    async def _generate_without_cache() -> Any:
+                        async with gemini_call(
+                            generation=True, estimated_tokens=estimated_tokens
+                        ):
+                            return await _generate_content(
+                                client,
+                                final_prompt_parts_fallback,
+                                fallback_config,
+                                on_chunk,
                             )
+
+                    response, streamed_text = await resilience.get_policy(
+                        "generate"
+                    ).call(_generate_without_cache, _is_retriable)
+                    generation_parts = final_prompt_parts_fallback
+                    generation_config = fallback_config
                     logger.info("Fallback generation without cache succeeded.")
                 except Exception as fallback_error:
                     logger.error(
@@ -501,19 +1514,32 @@ async def generate_report_from_content(
                     # Return a clear error indicating both attempts failed.
                     return f"Error: LLM call failed with cache, and the fallback attempt also failed. Details: {fallback_error}"
             else:
+                if (
+                    file_registry is not None
+                    and reused_file_names
+                    and getattr(e, "code", None) in (403, 404)
+                ):
+                    # A reused upload may have been deleted on Gemini's side.
+                    logger.warning(
+                        f"Forgetting {len(reused_file_names)} reused uploads after a {e.code} error."
+                    )
+                    file_registry.discard(reused_file_names)
                 # The error was a ClientError but not the one we handle for fallback. Re-raise it.
                 logger.error(
                     f"A non-cache-related ClientError occurred. This is not handled as a fallback. Error: {e}"
                 )
                 raise e
 
-        except (RetryError, asyncio.TimeoutError) as e:
-            # This block catches errors from the first attempt if all retries failed.
-            logger.error(
-                f"Initial LLM call failed after all retries or timed out: {e}",
-                exc_info=True,
-            )
-            return f"Error: The LLM API call failed after {settings.LLM_API_RETRY_ATTEMPTS} retries or timed out."
+        except LLMStreamInterruptedError as e:
+            # Part of the report already reached the caller through on_chunk.
+            logger.error(f"LLM stream failed mid-generation: {e}", exc_info=True)
+            return f"Error: The LLM stream was interrupted after {len(e.partial_text)} characters. Details: {e.cause}"
+
+        except asyncio.TimeoutError as e:
+            logger.error(f"Initial LLM call timed out: {e}", exc_info=True)
+            return "Error: The LLM API call timed out."
+
+        metrics.timings["generation"] = time.perf_counter() - stage_started
 
         if response is None:
             # This is a safeguard. If we've gotten here, response should have a value
@@ -523,27 +1549,16 @@ async def generate_report_from_content(
             )
             return "Error: LLM response was unexpectedly None after all processing."
 
-        report_content: str = ""
-
-        try:
-            if response.text:
-                report_content = response.text
-            elif response.candidates:
-                parts_text: List[str] = []
-                for candidate in response.candidates:
-                    if candidate.content and candidate.content.parts:
-                        for part in candidate.content.parts:
-                            if hasattr(part, "text") and part.text is not None:
-                                parts_text.append(part.text)
-                if parts_text:
-                    report_content = "".join(parts_text)
-        except AttributeError as e:
-            logger.warning(
-                f"AttributeError while accessing response text or parts: {e}.",
-                exc_info=True,
+        # When streaming, the last chunk carries the usage of the whole call
+        metrics.record_usage(response)
+        governor = get_gemini_governor()
+        if governor is not None and metrics.prompt_tokens is not None:
+            await asyncio.to_thread(
+                governor.record_tokens, estimated_tokens, metrics.prompt_tokens
             )
-            # Log the full response separately if needed for debugging, but don't include in common path
-            # logger.debug(f"Full response object on AttributeError: {response}")
+        report_content: str = (
+            streamed_text if streamed_text is not None else _response_text(response)
+        )
 
         if not report_content:
             logger.warning(f"Gemini response did not yield usable text content.")
@@ -597,9 +1612,48 @@ async def generate_report_from_content(
                     "Error: Unknown issue with LLM response, no text content received."
                 )
 
+        if revision is not None:
+            if _finish_reason_name(response) == types.FinishReason.MAX_TOKENS.name:
+                logger.warning("Revision stopped due to MAX_TOKENS.")
+                return "Error: The revision reached the maximum token limit. Please ask for fewer changes at a time."
+            headings = report_sections.section_headings(prompts.schema_report)
+            report_content, revised_headings = report_sections.replace_sections(
+                revision.current_report, report_content, headings
+            )
+            if not revised_headings:
+                logger.error("The revision did not return any report section.")
+                return "Error: The revision did not return any report section."
+            logger.info(f"Revised sections: {', '.join(revised_headings)}.")
+            return report_content
+
+        if _finish_reason_name(response) == types.FinishReason.MAX_TOKENS.name:
+            # Resume from the last complete section instead of discarding the output
+            stage_started = time.perf_counter()
+            report_content = await _continue_truncated_report(
+                client,
+                generation_parts,
+                generation_config,
+                report_content,
+                prompts.schema_report,
+                estimated_tokens,
+                on_chunk,
+                metrics,
+            )
+            metrics.timings["continuation"] = time.perf_counter() - stage_started
+            if report_content.startswith("Error"):
+                return report_content
+
         logger.info("Report content successfully generated.")
         return report_content
 
+    except GeminiOverloadedError as e:
+        logger.error(f"Report generation not scheduled: {e}")
+        return (
+            "Error: The LLM service is overloaded. Please try again in a few minutes."
+        )
+    except resilience.CircuitOpenError as e:
+        logger.error(f"Report generation skipped: {e}")
+        return f"Error: The LLM service is temporarily unavailable after repeated failures. Please try again in {e.retry_in:.0f} seconds."
     except google_exceptions.GoogleAPIError as e:
         logger.error(f"Gemini API Error: {e}", exc_info=True)
         return f"Error generating report due to an LLM API issue: {str(e)}"
@@ -609,6 +1663,17 @@ async def generate_report_from_content(
         )
         return f"Error generating report due to an unexpected LLM issue: {str(e)}"
     finally:
+        if file_registry is not None:
+            # Garbage-collect registered uploads that are too close to expiry to be
+            # reused, instead of deleting this report's uploads right away.
+            try:
+                expiring_file_names = await asyncio.to_thread(
+                    file_registry.pop_expiring,
+                    settings.GEMINI_FILE_REUSE_MARGIN_SECONDS,
+                )
+                temp_uploaded_file_names_for_api.extend(expiring_file_names)
+            except Exception as e:
+                logger.warning(f"Could not garbage-collect Gemini uploads: {e}")
         if temp_uploaded_file_names_for_api:
             logger.info(
                 f"Cleaning up {len(temp_uploaded_file_names_for_api)} uploaded files from Gemini File Service."
@@ -620,17 +1685,10 @@ async def generate_report_from_content(
                     logger.debug(
                         f"Attempting to delete uploaded file {name_to_delete} from Gemini File Service."
                     )
-
-                    @retry(
-                        stop=stop_after_attempt(settings.LLM_API_RETRY_ATTEMPTS),
-                        wait=wait_fixed(settings.LLM_API_RETRY_WAIT_SECONDS),
-                        retry=retry_if_exception_type(RETRIABLE_GEMINI_EXCEPTIONS),
-                        reraise=True,
+                    await _run_with_retry(
+                        lambda: client.files.delete(name=name_to_delete),
+                        operation="delete",
                     )
-                    def _delete_file_with_retry():
-                        client.files.delete(name=name_to_delete)
-
-                    await asyncio.to_thread(_delete_file_with_retry)
                     logger.debug(
                         f"Successfully deleted file {name_to_delete} from Gemini File Service."
                     )
@@ -644,12 +1702,6 @@ async def generate_report_from_content(
                         False,
                         name_to_delete,
                     )  # Indicate failure but not critical error
-                except RetryError as re:
-                    logger.error(
-                        f"Failed to delete file {name_to_delete} from Gemini after multiple retries: {re}",
-                        exc_info=True,
-                    )
-                    return False, name_to_delete
                 except Exception as e:
                     logger.error(
                         f"Failed to delete file {name_to_delete} from Gemini: {e}",
@@ -0,0 +1,263 @@
+"""Numbered sections of a report, as laid out by SCHEMA_REPORT.
+
+The schema gives each section a heading such as "2 – DINAMICA DEGLI EVENTI ED
+ACCERTAMENTI". The headings are read from the active schema rather than
+hard-coded, so that an edited schema keeps working, and are then located in
+the generated text. When a generation stops at the output token limit, the
+report is cut back to the start of the section it was writing and the model is
+asked to resume from that heading; the continuation is then stitched onto the
+complete sections.
+
+In section-parallel mode each section is generated by its own call: the first
+one also writes the header block that precedes section 1, and each one writes
+the blocks the schema places between it and the next heading (e.g. the closing
+greeting after "5 – COMMENTO FINALE"). The pieces are trimmed to their own
+section, assembled in order and checked by a consistency pass that returns
+targeted corrections rather than a rewritten report.
+
+Follow-up edits of a finished report ask the model for the sections it changes
+only; those replace the matching sections of the current text.
+"""
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+# "1 – DATI GENERALI": a number, an en dash (the model may write "-") and an
+# upper-case title alone on its line
+_SCHEMA_HEADING_RE = re.compile(
+    r"^(?P<number>\d+)\s*[–-]\s*(?P<title>[A-ZÀ-Ý][A-ZÀ-Ý' ]*[A-ZÀ-Ý])\s*$",
+    re.MULTILINE,
+)
+
+
+def section_headings(schema_report: str) -> List[str]:
+    """Returns the section headings of a schema, in order, e.g. "1 – DATI GENERALI"."""
+    headings: List[str] = []
+    seen_numbers = set()
+    for match in _SCHEMA_HEADING_RE.finditer(schema_report):
+        number = match.group("number")
+        if number in seen_numbers:
+            continue
+        seen_numbers.add(number)
+        headings.append(f"{number} – {match.group('title')}")
+    return headings
+
+
+def _heading_re(heading: str) -> "re.Pattern[str]":
+    number, title = heading.split(" – ", 1)
+    return re.compile(
+        rf"^[ \t]*{re.escape(number)}\s*[–-]\s*{re.escape(title)}[ \t]*$",
+        re.MULTILINE | re.IGNORECASE,
+    )
+
+
+def find_section_starts(text: str, headings: List[str]) -> List[Tuple[int, str]]:
+    """Returns (offset, heading) for every heading present in the text, by offset."""
+    starts = []
+    for heading in headings:
+        match = _heading_re(heading).search(text)
+        if match:
+            starts.append((match.start(), heading))
+    return sorted(starts)
+
+
+def split_before_last_section(
+    text: str, headings: List[str]
+) -> Tuple[str, Optional[str]]:
+    """Cuts a truncated report back to its complete sections.
+
+    Returns the text before the heading of the last section that was started,
+    and that heading. When no section was started the heading is None.
+    """
+    starts = find_section_starts(text, headings)
+    if not starts:
+        return text, None
+    offset, heading = starts[-1]
+    return text[:offset], heading
+
+
+def continuation_instruction(prefix: str, heading: str) -> str:
+    """Prompt asking the model to write the report on from ``heading``."""
+    return (
+        "\n\n--- INIZIO REPORT PARZIALE GIÀ GENERATO ---\n"
+        f"{prefix.rstrip()}\n"
+        "--- FINE REPORT PARZIALE GIÀ GENERATO ---\n\n"
+        "La generazione precedente di questo report si è interrotta per il "
+        "raggiungimento del limite di lunghezza. Il testo qui sopra è definitivo: "
+        "NON ripeterlo e non riassumerlo. Continua il report iniziando ESATTAMENTE "
+        f'dal titolo di sezione "{heading}" (titolo incluso) e prosegui fino alla '
+        "fine, seguendo lo stesso schema, la stessa formattazione e lo stesso stile."
+    )
+
+
+def stitch(prefix: str, continuation: str, heading: str) -> str:
+    """Joins the complete sections with the continuation that resumes at ``heading``.
+
+    Anything the model wrote before the heading (e.g. a preamble) is dropped.
+    """
+    match = _heading_re(heading).search(continuation)
+    if match:
+        continuation = continuation[match.start() :]
+    continuation = continuation.lstrip("\n")
+    if not prefix.strip():
+        return continuation
+    return f"{prefix.rstrip()}\n\n{continuation}"
+
+
+def section_instruction(headings: List[str], index: int) -> str:
+    """Prompt asking the model to write only the section ``headings[index]``."""
+    heading = headings[index]
+    if index == 0:
+        scope = (
+            "Genera SOLO la parte iniziale del report: il blocco di intestazione "
+            "previsto dallo schema (destinatario, luogo e data, riferimenti, oggetto "
+            f'e frase introduttiva) seguito dalla sezione "{heading}".'
+        )
+    else:
+        scope = (
+            f'Genera SOLO la sezione "{heading}", iniziando dal suo titolo, insieme '
+            "agli eventuali blocchi che lo schema colloca dopo di essa."
+        )
+    if index + 1 < len(headings):
+        scope += f' Fermati prima del titolo "{headings[index + 1]}".'
+    else:
+        scope += " Prosegui fino alla fine del report."
+    return (
+        f"\n\n{scope} Le altre sezioni vengono generate separatamente: non "
+        "scriverle e non anticiparne il contenuto. Analizza TUTTI i documenti, foto "
+        "e testi forniti e segui lo schema, la formattazione e lo stile indicati."
+    )
+
+
+def trim_section(text: str, headings: List[str], index: int) -> str:
+    """Keeps the part of a generated piece that belongs to ``headings[index]``.
+
+    Text written before the section's heading (a preamble) and from the next
+    heading on (the model running into the following section) is dropped; a
+    missing heading is added.
+    """
+    if index > 0:
+        match = _heading_re(headings[index]).search(text)
+        if match:
+            text = text[match.start() :]
+        else:
+            text = f"{headings[index]}\n\n{text.lstrip()}"
+    if index + 1 < len(headings):
+        match = _heading_re(headings[index + 1]).search(text)
+        if match:
+            text = text[: match.start()]
+    return text.strip()
+
+
+def assemble(sections: List[str]) -> str:
+    return "\n\n".join(section for section in sections if section)
+
+
+def consistency_instruction(report: str) -> str:
+    """Prompt asking for the corrections that make independently written sections agree."""
+    return (
+        "\n\n--- INIZIO BOZZA DEL REPORT ---\n"
+        f"{report}\n"
+        "--- FINE BOZZA DEL REPORT ---\n\n"
+        "Le sezioni di questa bozza sono state scritte separatamente. Verifica che "
+        "siano coerenti tra loro e con i documenti forniti: date, importi, quantità, "
+        "nomi delle parti, cause del danno e conclusioni. Non riscrivere il report. "
+        "Rispondi SOLO con un array JSON di correzioni, ciascuna nella forma "
+        '{"originale": "testo esatto presente nella bozza", "corretto": "testo '
+        'sostitutivo"}. Il testo originale deve comparire una sola volta nella '
+        "bozza ed essere il più breve possibile. Se non servono correzioni "
+        "rispondi con []."
+    )
+
+
+def parse_corrections(raw: str) -> List[Tuple[str, str]]:
+    """Reads the (original, corrected) pairs of a consistency pass answer."""
+    raw = raw.strip()
+    if raw.startswith("```"):
+        raw = raw.strip("`")
+        raw = raw[raw.find("[") :] if "[" in raw else raw
+    try:
+        items: Any = json.loads(raw)
+    except ValueError:
+        return []
+    if not isinstance(items, list):
+        return []
+    corrections = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        original, corrected = item.get("originale"), item.get("corretto")
+        if isinstance(original, str) and isinstance(corrected, str) and original:
+            corrections.append((original, corrected))
+    return corrections
+
+
+def apply_corrections(
+    report: str, corrections: List[Tuple[str, str]]
+) -> Tuple[str, int]:
+    """Applies the corrections whose original text occurs exactly once.
+
+    Returns the corrected report and the number of corrections applied.
+    """
+    applied = 0
+    for original, corrected in corrections:
+        if original == corrected or report.count(original) != 1:
+            continue
+        report = report.replace(original, corrected)
+        applied += 1
+    return report, applied
+
+
+def split_sections(text: str, headings: List[str]) -> Tuple[str, List[Tuple[str, str]]]:
+    """Splits a report into the text before its first section and its sections.
+
+    Each section runs from its heading to the next heading found in the text.
+    """
+    starts = find_section_starts(text, headings)
+    if not starts:
+        return text, []
+    sections = []
+    for position, (offset, heading) in enumerate(starts):
+        end = starts[position + 1][0] if position + 1 < len(starts) else len(text)
+        sections.append((heading, text[offset:end].strip()))
+    return text[: starts[0][0]], sections
+
+
+def revision_instruction(report: str, request: str) -> str:
+    """Prompt asking for the sections of ``report`` that ``request`` changes."""
+    return (
+        "\n\n--- INIZIO REPORT ATTUALE ---\n"
+        f"{report}\n"
+        "--- FINE REPORT ATTUALE ---\n\n"
+        "--- INIZIO RICHIESTA DI MODIFICA ---\n"
+        f"{request}\n"
+        "--- FINE RICHIESTA DI MODIFICA ---\n\n"
+        "Applica la richiesta di modifica al report attuale, tenendo conto dei "
+        "documenti già forniti e di quelli eventualmente aggiunti in questo messaggio. "
+        "Restituisci SOLO le sezioni numerate che cambiano, ciascuna completa e "
+        "preceduta dal suo titolo esatto, insieme agli eventuali blocchi che lo "
+        "schema colloca dopo di essa. Non restituire le sezioni che restano "
+        "invariate e non aggiungere commenti."
+    )
+
+
+def replace_sections(
+    report: str, revised: str, headings: List[str]
+) -> Tuple[str, List[str]]:
+    """Replaces the sections of ``report`` with those present in ``revised``.
+
+    Sections missing from the report are inserted in schema order.
+
+    Returns:
+        The updated report and the headings of the replaced sections.
+    """
+    preamble, current = split_sections(report, headings)
+    _, revised_sections = split_sections(revised, headings)
+    merged = dict(current)
+    merged.update(revised_sections)
+    ordered = sorted(merged.items(), key=lambda item: headings.index(item[0]))
+    return (
+        assemble([preamble.strip()] + [text for _, text in ordered]),
+        [heading for heading, _ in revised_sections],
+    )
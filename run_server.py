@@ -4,7 +4,7 @@ import os  # Import os
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
 
-from app import app  # Import your Flask app instance
+from app import app  # Import your Flask app instance; this starts the job loop
 from core.config import settings  # Import your application settings
 
 # Create a Hypercorn Config object
@@ -23,8 +23,9 @@ config.loglevel = settings.LOG_LEVEL.lower()  # Use LOG_LEVEL from settings
 # Set the crucial wsgi_max_body_size
 config.wsgi_max_body_size = settings.MAX_TOTAL_UPLOAD_SIZE_BYTES
 
-# Other configurations can be set here if needed, e.g.:
-# config.workers = 2
+# Other configurations can be set here if needed.
+# Keep a single worker: report jobs live in the memory of the process that runs
+# them, and their status and stream endpoints only see that process's jobs.
 
 if __name__ == "__main__":
     print(f"Starting Hypercorn server programmatically on port {port}...")
@@ -1,3 +1,4 @@
+import asyncio
 import io
 import logging
 from unittest import mock
@@ -5,8 +6,12 @@ from unittest import mock
 import pytest
 from werkzeug.datastructures import FileStorage
 
+import app as app_module
+import token_budget
 from app import app as flask_app  # Your Flask app instance
 from core.config import settings  # To potentially mock settings
+from core.job_queue import Job, JobState
+from llm_handler import LLMGenerationResult
 
 
 @pytest.fixture
@@ -152,43 +157,26 @@ def test_upload_total_files_exceed_size_limit(mock_settings, client):
         )
 
 
-@mock.patch("app.tempfile.mkdtemp")
-@mock.patch("app.shutil.rmtree")
-@mock.patch("app.document_processor.process_uploaded_file")
+@mock.patch("app.report_jobs")
+@mock.patch("app.extraction_pool.extract_files", new_callable=mock.AsyncMock)
 @mock.patch("app.llm_handler.generate_report_from_content", new_callable=mock.AsyncMock)
 @mock.patch("app.settings")  # Mock settings for general limits not being hit
 def test_upload_successful_flow(
     mock_app_settings,
     mock_generate_report,
-    mock_process_file,
-    mock_rmtree,
-    mock_mkdtemp,
+    mock_extract_files,
+    mock_report_jobs,
     client,
 ):
-    """Test a successful file upload and report generation flow."""
+    """Test that a successful upload persists the files and enqueues a report job."""
     mock_app_settings.MAX_FILE_SIZE_BYTES = 1000
     mock_app_settings.MAX_TOTAL_UPLOAD_SIZE_BYTES = 2000
     mock_app_settings.ALLOWED_EXTENSIONS = {"txt", "pdf"}
-    mock_app_settings.MAX_EXTRACTED_TEXT_LENGTH = 5000
 
-    mock_mkdtemp.return_value = "/tmp/fake_temp_dir"
-
-    mock_process_file.side_effect = [
-        {
-            "type": "text",
-            "filename": "file1.txt",
-            "content": "Text from file1",
-            "source": "file content",
-        },
-        {
-            "type": "text",
-            "filename": "file2.pdf",
-            "content": "Text from file2",
-            "source": "file content",
-        },
-    ]
-
-    mock_generate_report.return_value = "This is the generated report."
+    mock_report_jobs.submit.side_effect = lambda job_id, payload: mock.Mock(
+        id=job_id, payload=payload
+    )
+    mock_report_jobs.queue_position.return_value = 1
 
     file1 = FileStorage(io.BytesIO(b"content1"), filename="file1.txt")
     file2 = FileStorage(io.BytesIO(b"content2"), filename="file2.pdf")
@@ -197,232 +185,139 @@ def test_upload_successful_flow(
         "/upload", data={"files[]": [file1, file2]}, content_type="multipart/form-data"
     )
 
-    assert response.status_code == 200
-    response_data = response.get_data(as_text=True)
-    assert "This is the generated report." in response_data
-    assert "file1.txt" in response_data  # Check displayed filenames
-    assert "file2.pdf" in response_data
-
-    mock_mkdtemp.assert_called_once()
-    assert mock_process_file.call_count == 2
-    mock_generate_report.assert_called_once_with(
-        processed_files=[
-            {
-                "type": "text",
-                "filename": "file1.txt",
-                "content": "Text from file1",
-                "source": "file content",
-            },
-            {
-                "type": "text",
-                "filename": "file2.pdf",
-                "content": "Text from file2",
-                "source": "file content",
-            },
-        ],
-        additional_text="",
-    )
-    # asyncio.to_thread means rmtree might not be called if an error occurs before finally
-    # For successful path, it should be. If testing with an ASGI server, the call will be awaited.
-    # mock_rmtree.assert_called_once_with("/tmp/fake_temp_dir") # This can be tricky with async/threads
-
-
-@mock.patch("app.tempfile.mkdtemp")
-@mock.patch("app.shutil.rmtree")
-@mock.patch("app.document_processor.process_uploaded_file")
-@mock.patch("app.llm_handler.generate_report_from_content", new_callable=mock.AsyncMock)
-@mock.patch("app.settings")
-def test_upload_text_truncation(
-    mock_app_settings,
-    mock_generate_report,
-    mock_process_file,
-    mock_rmtree,
-    mock_mkdtemp,
-    client,
-):
-    """Test that extracted text is truncated correctly if it exceeds MAX_EXTRACTED_TEXT_LENGTH."""
-    mock_app_settings.MAX_FILE_SIZE_BYTES = 1000
-    mock_app_settings.MAX_TOTAL_UPLOAD_SIZE_BYTES = 2000
-    mock_app_settings.ALLOWED_EXTENSIONS = {"txt"}
-    mock_app_settings.MAX_EXTRACTED_TEXT_LENGTH = 20  # Very small for testing
-
-    mock_mkdtemp.return_value = "/tmp/fake_temp_dir"
-
-    # First file fits, second will be truncated, third will be skipped.
-    mock_process_file.side_effect = [
-        {
-            "type": "text",
-            "filename": "file1.txt",
-            "content": "1234567890",
-            "source": "file content",
-        },  # 10 chars
-        {
-            "type": "text",
-            "filename": "file2.txt",
-            "content": "abcdefghijklmnop",
-            "source": "file content",
-        },  # 16 chars
-        {
-            "type": "text",
-            "filename": "file3.txt",
-            "content": "XYZ",
-            "source": "file content",
-        },  # 3 chars
+    # The request returns as soon as the job is queued, without extracting or generating.
+    assert response.status_code == 202
+    response_data = response.get_json()
+    assert response_data["status"] == "processing"
+    assert response_data["status_url"] == f"/jobs/{response_data['job_id']}"
+
+    mock_report_jobs.submit.assert_called_once()
+    job_id, payload = mock_report_jobs.submit.call_args[0]
+    assert job_id == response_data["job_id"]
+    assert [f["original_filename"] for f in payload["files"]] == [
+        "file1.txt",
+        "file2.pdf",
+    ]
+    mock_extract_files.assert_not_called()
+    mock_generate_report.assert_not_called()
+
+
+def _run_job(job_id, files, extraction_results, budget_tokens):
+    """Runs _run_report_job with extraction, the database and the LLM mocked."""
+    job = Job(job_id, {"upload_dir": f"/nonexistent/{job_id}", "files": files})
+    generation = LLMGenerationResult()
+    generation.text = "Report."
+    with mock.patch("app.db") as mock_db, mock.patch(
+        "app.extraction_pool.extract_files",
+        new_callable=mock.AsyncMock,
+        return_value=extraction_results,
+    ), mock.patch(
+        "app.llm_handler.generate_report_from_content",
+        new_callable=mock.AsyncMock,
+        return_value=generation,
+    ) as mock_generate, mock.patch(
+        "app.token_budget.available_input_tokens", return_value=budget_tokens
+    ):
+        mock_db.session.get.return_value = mock.Mock(id=job_id)
+        asyncio.run(app_module._run_report_job(job))
+    return job, mock_generate
+
+
+def test_report_job_truncates_text_to_the_context_budget():
+    """Test that text beyond the context budget is truncated or skipped before generation."""
+    # Arrange
+    files = [
+        {"path": f"/uploads/file{i}.txt", "original_filename": f"file{i}.txt"}
+        for i in (1, 2, 3)
+    ]
+    extraction_results = [
+        {"type": "text", "filename": "file1.txt", "content": "a" * 400},
+        {"type": "text", "filename": "file2.txt", "content": "b" * 4000},
+        {"type": "text", "filename": "file3.txt", "content": "c" * 4000},
     ]
 
-    mock_generate_report.return_value = "Report based on truncated text."
-
-    file1 = FileStorage(io.BytesIO(b"content1"), filename="file1.txt")
-    file2 = FileStorage(io.BytesIO(b"content2"), filename="file2.txt")
-    file3 = FileStorage(io.BytesIO(b"content3"), filename="file3.txt")
-
-    response = client.post(
-        "/upload",
-        data={"files[]": [file1, file2, file3]},
-        content_type="multipart/form-data",
+    # Act
+    # file1 needs 100 tokens; file2 and file3 share the remaining 300
+    job, mock_generate = _run_job("job-trunc", files, extraction_results, 400)
+
+    # Assert
+    assert job.state == JobState.SUCCESS
+    sent = mock_generate.call_args.kwargs["processed_files"]
+    assert [part["filename"] for part in sent] == [
+        "file1.txt",
+        "file2.txt",
+        "file3.txt",
+    ]
+    assert sent[0]["content"] == "a" * 400
+    for part in sent[1:]:
+        assert part["content"].endswith(token_budget.TRUNCATION_NOTICE)
+        assert len(part["content"]) <= 150 * settings.TOKEN_ESTIMATE_CHARS_PER_TOKEN
+    messages = [m["message"] for m in job.messages]
+    assert any(
+        "Content from file2.txt (file content) was truncated" in m for m in messages
     )
 
-    assert (
-        response.status_code == 200
-    )  # Assuming it still proceeds to generate a report
-    with client.session_transaction() as session:
-        assert "_flashes" in session
-        flashed_messages = [msg[1] for msg in session["_flashes"]]
-        assert any(
-            "Content from file2.txt (file content) was truncated" in msg
-            for msg in flashed_messages
-        )
-        assert any(
-            "Skipped some content from file3.txt (file content)" in msg
-            for msg in flashed_messages
-        )
 
-    expected_processed_files_for_llm = [
-        {
-            "type": "text",
-            "filename": "file1.txt",
-            "content": "1234567890",
-            "source": "file content",
-        },  # Full
-        {
-            "type": "text",
-            "filename": "file2.txt",
-            "content": "abcdefghij",
-            "source": "file content",
-        },  # Truncated (10 chars from 16)
-        # file3.txt content is skipped entirely
+def test_report_job_skips_text_when_the_budget_is_spent():
+    """Test that a text whose share would be a stub is left out with a warning."""
+    # Arrange
+    files = [
+        {"path": f"/uploads/file{i}.txt", "original_filename": f"file{i}.txt"}
+        for i in (1, 2)
+    ]
+    extraction_results = [
+        {"type": "text", "filename": "file1.txt", "content": "a" * 40},
+        {"type": "text", "filename": "file2.txt", "content": "b" * 4000},
     ]
 
-    mock_generate_report.assert_called_once_with(
-        processed_files=expected_processed_files_for_llm, additional_text=""
-    )
-
+    # Act
+    # file1 needs 10 tokens, leaving file2 less than MIN_USEFUL_TEXT_TOKENS
+    job, mock_generate = _run_job("job-skip", files, extraction_results, 50)
 
-@mock.patch("app.tempfile.mkdtemp")
-@mock.patch("app.shutil.rmtree")
-@mock.patch("app.document_processor.process_uploaded_file")
-@mock.patch("app.llm_handler.generate_report_from_content", new_callable=mock.AsyncMock)
-@mock.patch("app.settings")
-def test_upload_eml_processing(
-    mock_app_settings,
-    mock_generate_report,
-    mock_process_file,
-    mock_rmtree,
-    mock_mkdtemp,
-    client,
-):
-    """Test EML file processing, ensuring body and attachments are handled and text is aggregated."""
-    mock_app_settings.MAX_FILE_SIZE_BYTES = 1000
-    mock_app_settings.MAX_TOTAL_UPLOAD_SIZE_BYTES = 2000
-    mock_app_settings.ALLOWED_EXTENSIONS = {"eml", "txt"}
-    mock_app_settings.MAX_EXTRACTED_TEXT_LENGTH = 100  # Smallish for testing
-
-    mock_mkdtemp.return_value = "/tmp/fake_temp_dir"
-
-    # Simulate document_processor returning data for an EML file
-    eml_processed_data = {
-        "type": "text",  # Main type for the EML body itself
-        "original_filetype": "eml",
-        "filename": "email.eml",
-        "content": "Email body text. ",  # 17 chars
-        "processed_attachments": [
-            {
-                "type": "text",
-                "filename": "attach1.txt",
-                "content": "Attachment 1 text. ",
-                "source": "attachment",
-            },  # 19 chars
-            {
-                "type": "vision",
-                "filename": "image.png",
-                "content": "base64_encoded_image_data",
-                "source": "attachment",
-            },  # Vision, not text
-            {
-                "type": "text",
-                "filename": "attach2.txt",
-                "content": "Attachment 2 text, long enough to be truncated. ",
-                "source": "attachment",
-            },  # 48 chars
-        ],
-    }
-    mock_process_file.return_value = eml_processed_data
-    mock_generate_report.return_value = "Report from EML."
-
-    eml_file = FileStorage(io.BytesIO(b"eml content"), filename="email.eml")
-
-    response = client.post(
-        "/upload", data={"files[]": [eml_file]}, content_type="multipart/form-data"
+    # Assert
+    sent = mock_generate.call_args.kwargs["processed_files"]
+    assert [part["filename"] for part in sent] == ["file1.txt"]
+    assert any(
+        "Skipped content from file2.txt (file content)" in m["message"]
+        for m in job.messages
     )
 
-    assert response.status_code == 200
-    with client.session_transaction() as session:
-        assert "_flashes" in session
-        flashed_messages = [msg[1] for msg in session["_flashes"]]
-        # print(flashed_messages) # For debugging
-        assert any(
-            "Content from attach2.txt (attachment from EML: email.eml) was truncated"
-            in msg
-            for msg in flashed_messages
-        )
 
-    expected_llm_input = [
-        {
-            "type": "text",
-            "filename": "email.eml",
-            "content": "Email body text. ",
-            "source": "email body",
-        },
-        {
-            "type": "text",
-            "filename": "attach1.txt",
-            "content": "Attachment 1 text. ",
-            "source": "attachment from EML: email.eml",
-        },
+def test_report_job_budgets_eml_parts():
+    """Test that EML bodies and attachments are budgeted after the vision parts."""
+    # Arrange
+    files = [{"path": "/uploads/email.eml", "original_filename": "email.eml"}]
+    eml_parts = [
+        {"type": "text", "filename": "email.eml", "content": "Email body text. "},
+        {"type": "text", "filename": "attach1.txt", "content": "x" * 200},
         {
             "type": "vision",
             "filename": "image.png",
-            "content": "base64_encoded_image_data",
-            "source": "attachment",
-        },  # Vision included as is
-        {
-            "type": "text",
-            "filename": "attach2.txt",
-            "content": "Attachment 2 text, long enough to be truncated. "[
-                : 100 - 17 - 19
-            ],
-            "source": "attachment from EML: email.eml",
-        },  # Truncated part
+            "path": "/uploads/image.png",
+            "mime_type": "image/png",
+            "width": 300,
+            "height": 200,
+        },
+        {"type": "text", "filename": "attach2.txt", "content": "y" * 4000},
     ]
-    # Adjust expected content for attach2.txt based on MAX_EXTRACTED_TEXT_LENGTH (100)
-    # Lengths: body (17) + attach1 (19) = 36. Remaining = 100 - 36 = 64
-    # So, attach2 content should be truncated to 64 chars.
-    expected_llm_input[3]["content"] = (
-        "Attachment 2 text, long enough to be truncated. "[:64]
+
+    # Act
+    # The image costs one tile, leaving 300 tokens for the text
+    job, mock_generate = _run_job(
+        "job-eml", files, [eml_parts], token_budget.TOKENS_PER_VISION_TILE + 300
     )
 
-    mock_generate_report.assert_called_once_with(
-        processed_files=expected_llm_input, additional_text=""
+    # Assert
+    sent = mock_generate.call_args.kwargs["processed_files"]
+    assert sent[0]["type"] == "vision"
+    texts = {part["filename"]: part for part in sent if part["type"] == "text"}
+    assert texts["email.eml"]["content"] == "Email body text. "
+    assert texts["attach1.txt"]["content"] == "x" * 200
+    assert texts["attach1.txt"]["source"] == "from email.eml"
+    assert texts["attach2.txt"]["content"].endswith(token_budget.TRUNCATION_NOTICE)
+    assert any(
+        "Content from attach2.txt (from email.eml) was truncated" in m["message"]
+        for m in job.messages
     )
 
 
@@ -0,0 +1,22 @@
+"""
+Unit tests for the startup of the app's background services.
+Tests that importing the app the way an ASGI server does starts the job loop and its background tasks.
+"""
+
+import importlib
+
+
+class TestBackgroundServices:
+    """Test that the background services do not depend on run_server.py."""
+
+    def test_importing_the_app_schedules_the_prompt_cache_refresh(self):
+        """Test that "hypercorn app:app" gets the job loop and the prompt cache refresh."""
+        # Act
+        module = importlib.import_module("app")
+        application = getattr(module, "app")
+
+        # Assert
+        assert application is not None
+        assert module.report_jobs.is_running
+        refresh = module._background_tasks["prompt_cache_refresh"]
+        assert not refresh.done()
@@ -8,7 +8,11 @@ import os
 import tempfile
 from unittest.mock import MagicMock, Mock, mock_open, patch
 
+import fitz
+import openpyxl
 import pytest
+from docx import Document as DocxDocument
+from openpyxl.styles import Font
 from PIL import Image
 
 # Import the functions under test
@@ -186,6 +190,73 @@ class TestPDFProcessor:
         assert "error" in result["message"].lower()
 
 
+def _write_pdf(path, scanned_pages=()):
+    """Writes a three page PDF whose ``scanned_pages`` are a full-page image."""
+    doc = fitz.open()
+    for number in range(3):
+        page = doc.new_page()
+        if number in scanned_pages:
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 40), 0)
+            pixmap.clear_with(200)
+            page.insert_image(page.rect, pixmap=pixmap)
+        else:
+            page.insert_text((72, 72), f"Polizza pagina {number + 1}. " * 10)
+    doc.save(path)
+    doc.close()
+
+
+class TestPDFTextLayer:
+    """Test the per-page text layer fast path of prepare_pdf_for_llm."""
+
+    def test_text_only_pdf_is_sent_as_text(self):
+        """Test that a born-digital PDF becomes a single text part."""
+        # Arrange
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "polizza.pdf")
+            _write_pdf(pdf_path)
+
+            # Act
+            result = prepare_pdf_for_llm(pdf_path)
+
+        # Assert
+        assert result["type"] == "text"
+        assert result["original_filetype"] == "pdf"
+        assert "--- Pagina 3 ---\nPolizza pagina 3." in result["content"]
+
+    def test_scanned_pages_go_to_a_sub_pdf(self):
+        """Test that only the image-heavy pages are sent to the model as a vision file."""
+        # Arrange
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "perizia.pdf")
+            _write_pdf(pdf_path, scanned_pages=(1,))
+
+            # Act
+            text_part, vision_part = prepare_pdf_for_llm(pdf_path)
+            with fitz.open(vision_part["path"]) as subset:
+                subset_pages = subset.page_count
+
+        # Assert
+        assert "Polizza pagina 1." in text_part["content"]
+        assert "Pagina 2: scansione" in text_part["content"]
+        assert vision_part["type"] == "vision"
+        assert vision_part["page_count"] == subset_pages == 1
+
+    def test_fully_scanned_pdf_is_sent_whole(self):
+        """Test that a PDF without any text layer is sent unchanged."""
+        # Arrange
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "scansione.pdf")
+            _write_pdf(pdf_path, scanned_pages=(0, 1, 2))
+
+            # Act
+            result = prepare_pdf_for_llm(pdf_path)
+
+        # Assert
+        assert result["type"] == "vision"
+        assert result["path"] == pdf_path
+        assert result["page_count"] == 3
+
+
 class TestImageProcessor:
     """Test image file processing for LLM vision input."""
 
@@ -250,70 +321,144 @@ class TestImageProcessor:
 class TestTextExtractors:
     """Test text extraction from various document types."""
 
-    @patch("document_processor.DocxDocument")
-    def test_extract_text_from_docx_success(self, mock_document):
+    def test_extract_text_from_docx_success(self):
         """Test successful text extraction from DOCX."""
         # Arrange
-        docx_path = "/tmp/test.docx"
-        mock_doc = Mock()
-        mock_paragraph1 = Mock()
-        mock_paragraph1.text = "First paragraph"
-        mock_paragraph2 = Mock()
-        mock_paragraph2.text = "Second paragraph"
-        mock_doc.paragraphs = [mock_paragraph1, mock_paragraph2]
-        mock_document.return_value = mock_doc
+        document = DocxDocument()
+        document.add_paragraph("First paragraph")
+        document.add_paragraph("Second paragraph")
 
-        # Act
-        result = extract_text_from_docx(docx_path)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            docx_path = os.path.join(tmp_dir, "test.docx")
+            document.save(docx_path)
+
+            # Act
+            result = extract_text_from_docx(docx_path)
 
         # Assert
-        mock_document.assert_called_once_with(docx_path)
         assert result["type"] == "text"
         assert result["content"] == "First paragraph\nSecond paragraph"
         assert result["filename"] == "test.docx"
 
-    @patch("openpyxl.load_workbook")
-    def test_extract_text_from_xlsx_success(self, mock_load_workbook):
-        """Test successful text extraction from XLSX."""
+    def test_extract_text_from_docx_tables_headers_and_footers(self):
+        """Test that tables keep their place in the text and headers/footers are included."""
         # Arrange
-        xlsx_path = "/tmp/test.xlsx"
-        mock_workbook = Mock()
-        mock_workbook.sheetnames = ["Sheet1", "Sheet2"]
-
-        # Mock Sheet1
-        mock_sheet1 = Mock()
-        mock_cell1 = Mock()
-        mock_cell1.value = "A1"
-        mock_cell2 = Mock()
-        mock_cell2.value = "B1"
-        mock_row1 = [mock_cell1, mock_cell2]
-        mock_sheet1.iter_rows.return_value = [mock_row1]
-
-        # Mock Sheet2
-        mock_sheet2 = Mock()
-        mock_cell3 = Mock()
-        mock_cell3.value = "A2"
-        mock_cell4 = Mock()
-        mock_cell4.value = None
-        mock_row2 = [mock_cell3, mock_cell4]
-        mock_sheet2.iter_rows.return_value = [mock_row2]
-
-        mock_workbook.__getitem__ = Mock(
-            side_effect=lambda x: mock_sheet1 if x == "Sheet1" else mock_sheet2
+        document = DocxDocument()
+        document.sections[0].header.paragraphs[0].text = "Studio Peritale Rossi"
+        document.sections[0].footer.paragraphs[0].text = "Pagina riservata"
+        document.add_paragraph("Preventivo di riparazione")
+        table = document.add_table(rows=2, cols=2)
+        table.cell(0, 0).text, table.cell(0, 1).text = "Voce", "Importo"
+        table.cell(1, 0).text, table.cell(1, 1).text = "Infissi", "2.400,00"
+        document.add_paragraph("Totale come da tabella")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            docx_path = os.path.join(tmp_dir, "preventivo.docx")
+            document.save(docx_path)
+
+            # Act
+            result = extract_text_from_docx(docx_path)
+
+        # Assert
+        assert result["content"] == (
+            "--- Header ---\nStudio Peritale Rossi\n\n"
+            "Preventivo di riparazione\n\nVoce | Importo\nInfissi | 2.400,00\n\n"
+            "Totale come da tabella\n\n"
+            "--- Footer ---\nPagina riservata"
         )
-        mock_load_workbook.return_value = mock_workbook
 
-        # Act
-        result = extract_text_from_xlsx(xlsx_path)
+    def test_extract_text_from_docx_stops_at_the_context_limit(self):
+        """Test that extraction stops once the text cannot fit in the model's context."""
+        # Arrange
+        document = DocxDocument()
+        for number in range(500):
+            document.add_paragraph(f"Paragrafo numero {number}")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            docx_path = os.path.join(tmp_dir, "lungo.docx")
+            document.save(docx_path)
+
+            # Act
+            with patch(
+                "document_processor.token_budget.available_input_tokens",
+                return_value=100,
+            ):
+                result = extract_text_from_docx(docx_path)
+
+        # Assert
+        assert "Paragrafo numero 499" not in result["content"]
+        assert result["content"].endswith(document_processor.CONTEXT_LIMIT_NOTICE)
+
+    def test_extract_text_from_xlsx_success(self):
+        """Test successful text extraction from XLSX."""
+        # Arrange
+        workbook = openpyxl.Workbook()
+        workbook.active.title = "Sheet1"
+        workbook.active.append(["A1", "B1"])
+        sheet2 = workbook.create_sheet("Sheet2")
+        sheet2.append(["A2", None, "C, with comma"])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xlsx_path = os.path.join(tmp_dir, "test.xlsx")
+            workbook.save(xlsx_path)
+
+            # Act
+            result = extract_text_from_xlsx(xlsx_path)
 
         # Assert
-        mock_load_workbook.assert_called_once_with(xlsx_path)
-        mock_workbook.close.assert_called_once()
         assert result["type"] == "text"
         assert "--- Sheet: Sheet1 ---" in result["content"]
         assert "--- Sheet: Sheet2 ---" in result["content"]
         assert "A1,B1" in result["content"]
-        assert "A2," in result["content"]  # None value becomes empty string
+        assert 'A2,,"C, with comma"' in result["content"]
+
+    def test_extract_text_from_xlsx_trims_empty_cells(self):
+        """Test that formatted but empty rows and columns are not serialized."""
+        # Arrange
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(["Voce", "Importo"])
+        sheet.append(["Danno", 1500.0])
+        sheet["A5"] = "Totale"
+        # Styled cells far away inflate the sheet's dimensions
+        sheet["Z2000"].font = Font(bold=True)
+        sheet["H3"].font = Font(bold=True)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xlsx_path = os.path.join(tmp_dir, "ledger.xlsx")
+            workbook.save(xlsx_path)
+
+            # Act
+            result = extract_text_from_xlsx(xlsx_path)
+
+        # Assert
+        assert result["content"] == (
+            "--- Sheet: Sheet ---\nVoce,Importo\nDanno,1500\n\nTotale\n\n"
+        )
+
+    def test_extract_text_from_xlsx_stops_at_the_context_limit(self):
+        """Test that extraction stops once the text cannot fit in the model's context."""
+        # Arrange
+        workbook = openpyxl.Workbook()
+        for number in range(1000):
+            workbook.active.append([f"riga {number}", number])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xlsx_path = os.path.join(tmp_dir, "ledger.xlsx")
+            workbook.save(xlsx_path)
+
+            # Act
+            with patch(
+                "document_processor.token_budget.available_input_tokens",
+                return_value=100,
+            ):
+                result = extract_text_from_xlsx(xlsx_path)
+
+        # Assert
+        assert "riga 999" not in result["content"]
+        assert result["content"].endswith(
+            "[AVVISO: estrazione interrotta, il file supera il limite di contesto del modello]\n"
+        )
 
     def test_extract_text_from_txt_success(self):
         """Test successful text extraction from TXT."""
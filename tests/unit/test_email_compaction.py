@@ -0,0 +1,159 @@
+"""
+Unit tests for email thread compaction.
+Tests that quoted replies and repeated signatures are kept once across the emails of an upload.
+"""
+
+from email_compaction import compact_email_bodies
+
+SIGNATURE = (
+    "Mario Rossi\nUfficio Sinistri - Compagnia Assicurativa S.p.A.\nTel. 010 1234567"
+)
+DISCLAIMER = (
+    "Questo messaggio e i suoi allegati sono riservati. Se lo avete ricevuto "
+    "per errore siete pregati di cancellarlo e di avvisare il mittente."
+)
+FIRST_TEXT = (
+    "Buongiorno,\nvi segnaliamo il sinistro del 12 marzo presso il magazzino di "
+    "Genova, con danni da acqua alle scaffalature."
+)
+REPLY_TEXT = "Grazie, il sopralluogo è fissato per giovedì alle 10."
+
+
+def _email(filename, content):
+    return {
+        "type": "text",
+        "filename": f"{filename} (body)",
+        "content": content,
+        "source": f"from {filename}",
+        "original_filetype": "eml",
+    }
+
+
+def _first_email():
+    return _email(
+        "denuncia.eml",
+        f"Da: mario@example.com\nOggetto: Sinistro\n\n{FIRST_TEXT}\n\n"
+        f"{SIGNATURE}\n\n{DISCLAIMER}",
+    )
+
+
+def _reply_email():
+    quoted = "\n".join(
+        f"> {line}"
+        for line in f"{FIRST_TEXT}\n\n{SIGNATURE}\n\n{DISCLAIMER}".split("\n")
+    )
+    return _email(
+        "risposta.eml",
+        f"Da: perito@example.com\nOggetto: R: Sinistro\n\n{REPLY_TEXT}\n\n"
+        f"Il giorno 13 mar 2025, alle ore 09:12, mario@example.com ha scritto:\n{quoted}",
+    )
+
+
+class TestCompactEmailBodies:
+    """Test compaction across the emails of one upload."""
+
+    def test_quote_of_an_uploaded_email_is_dropped(self):
+        """Test that a reply quoting an uploaded email keeps only its new text."""
+        # Arrange
+        parts = [_first_email(), _reply_email()]
+
+        # Act
+        compacted, messages = compact_email_bodies(parts)
+
+        # Assert
+        assert FIRST_TEXT in compacted[0]["content"]
+        assert compacted[1]["content"] == (
+            "Da: perito@example.com\nOggetto: R: Sinistro\n\n"
+            f"{REPLY_TEXT}\n\n"
+            "[1 messaggi citati omessi: già presenti altrove nel thread]"
+        )
+        assert "1 repeated message(s)" in messages[0][0]
+
+    def test_quote_is_kept_when_the_original_is_missing(self):
+        """Test that a quoted message is kept if no uploaded email contains it."""
+        # Arrange
+        parts = [_reply_email()]
+
+        # Act
+        compacted, messages = compact_email_bodies(parts)
+
+        # Assert
+        assert compacted == parts
+        assert messages == []
+
+    def test_repeated_signature_and_disclaimer_are_kept_once(self):
+        """Test that boilerplate shared by different messages appears only in the first."""
+        # Arrange
+        second_text = (
+            "Vi inviamo anche le fotografie dei danni e la stima del fornitore "
+            "per la sostituzione delle scaffalature."
+        )
+        parts = [
+            _first_email(),
+            _email(
+                "foto.eml",
+                f"Da: mario@example.com\n\n{second_text}\n\n{SIGNATURE}\n\n{DISCLAIMER}",
+            ),
+        ]
+
+        # Act
+        compacted, messages = compact_email_bodies(parts)
+
+        # Assert
+        assert DISCLAIMER in compacted[0]["content"]
+        assert compacted[1]["content"] == f"Da: mario@example.com\n\n{second_text}"
+        assert "2 repeated signature/disclaimer block(s)" in messages[0][0]
+
+    def test_outlook_reply_header_is_recognized(self):
+        """Test that an Outlook header block starts a quoted message."""
+        # Arrange
+        reply = _email(
+            "outlook.eml",
+            f"{REPLY_TEXT}\n\n________________________________\n"
+            "Da: mario@example.com\nInviato: giovedì 13 marzo 2025 09:12\n"
+            f"A: perito@example.com\nOggetto: Sinistro\n\n{FIRST_TEXT}",
+        )
+        parts = [_first_email(), reply]
+
+        # Act
+        compacted, _ = compact_email_bodies(parts)
+
+        # Assert
+        assert FIRST_TEXT not in compacted[1]["content"]
+        assert compacted[1]["content"].startswith(REPLY_TEXT)
+
+    def test_lines_ending_in_scritto_are_not_reply_headers(self):
+        """Test that "Il sottoscritto:" does not start a quoted message."""
+        # Arrange
+        declaration = (
+            "Il sottoscritto:\nMario Rossi dichiara che il magazzino era chiuso "
+            "al momento del sinistro."
+        )
+        parts = [
+            _first_email(),
+            _email(
+                "dichiarazione.eml",
+                f"Da: perito@example.com\n\n{declaration}\n\n{FIRST_TEXT}",
+            ),
+        ]
+
+        # Act
+        compacted, _ = compact_email_bodies(parts)
+
+        # Assert
+        assert compacted[1]["content"].startswith(
+            f"Da: perito@example.com\n\n{declaration}"
+        )
+        assert "[Messaggio citato]" not in compacted[1]["content"]
+
+    def test_other_parts_are_untouched(self):
+        """Test that non-email parts pass through unchanged."""
+        # Arrange
+        parts = [{"type": "text", "filename": "a.txt", "content": FIRST_TEXT}]
+
+        # Act
+        compacted, messages = compact_email_bodies(parts)
+
+        # Assert
+        assert compacted == parts
+        assert messages == []
@@ -0,0 +1,149 @@
+"""
+Unit tests for the streaming .eml parser.
+Tests body and attachment decoding, size caps and nested forwarded messages.
+"""
+
+import os
+import tempfile
+from email.message import EmailMessage
+from unittest.mock import patch
+
+import pytest
+
+import eml_parser
+from core.config import settings
+from document_processor import process_eml_file
+
+
+@pytest.fixture
+def work_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+def _message(subject="Sinistro 123", body="Buongiorno,\nin allegato la denuncia."):
+    message = EmailMessage()
+    message["From"] = "Mario Rossi <mario@example.com>"
+    message["To"] = "perito@example.com"
+    message["Subject"] = subject
+    message.set_content(body)
+    message.add_alternative(f"<p>{body}</p>", subtype="html")
+    return message
+
+
+def _write(message, path):
+    with open(path, "wb") as f:
+        f.write(message.as_bytes())
+    return path
+
+
+class TestParseEml:
+    """Test the streaming parser on its own."""
+
+    def test_bodies_headers_and_attachments_are_decoded(self, work_dir):
+        """Test that text bodies and a base64 attachment come out byte for byte."""
+        # Arrange
+        message = _message(body="Danno da acqua: caffè e più")
+        payload = bytes(range(256)) * 100
+        message.add_attachment(
+            payload, maintype="application", subtype="pdf", filename="denuncia.pdf"
+        )
+        eml_path = _write(message, os.path.join(work_dir, "mail.eml"))
+
+        # Act
+        parsed = eml_parser.parse_eml(eml_path, os.path.join(work_dir, "out"))
+
+        # Assert
+        assert parsed.headers["Subject"] == "Sinistro 123"
+        assert parsed.text_plain == ["Danno da acqua: caffè e più\n"]
+        assert "<p>" in parsed.text_html[0]
+        (attachment,) = parsed.attachments
+        assert attachment.filename == "denuncia.pdf"
+        with open(attachment.path, "rb") as f:
+            assert f.read() == payload
+
+    def test_oversized_attachment_is_skipped(self, work_dir):
+        """Test that an attachment over the per-attachment cap is not kept on disk."""
+        # Arrange
+        message = _message()
+        message.add_attachment(
+            b"x" * (2 * 1024 * 1024),
+            maintype="application",
+            subtype="octet-stream",
+            filename="enorme.bin",
+        )
+        message.add_attachment(
+            b"small", maintype="text", subtype="plain", filename="note.txt"
+        )
+        eml_path = _write(message, os.path.join(work_dir, "mail.eml"))
+        out_dir = os.path.join(work_dir, "out")
+
+        # Act
+        with patch.object(settings, "EML_MAX_ATTACHMENT_MB", 1):
+            parsed = eml_parser.parse_eml(eml_path, out_dir)
+
+        # Assert
+        big, small = parsed.attachments
+        assert big.path is None
+        assert big.skipped_reason == "attachment size limit exceeded"
+        assert small.size == 5
+        assert os.listdir(out_dir) == ["note.txt"]
+
+
+class TestProcessEmlFile:
+    """Test process_eml_file on top of the parser."""
+
+    def test_body_starts_with_the_headers(self, work_dir):
+        """Test that sender and subject are given to the model with the body."""
+        # Arrange
+        eml_path = _write(_message(), os.path.join(work_dir, "mail.eml"))
+
+        # Act
+        parts = process_eml_file(eml_path, work_dir)
+
+        # Assert
+        assert parts[0]["filename"] == "mail.eml (body)"
+        assert parts[0]["content"].startswith(
+            "Da: Mario Rossi <mario@example.com>\nA: perito@example.com\n"
+            "Oggetto: Sinistro 123\n\nBuongiorno,"
+        )
+
+    def test_nested_forwards_stop_at_the_depth_limit(self, work_dir):
+        """Test that forwarded messages are followed only up to EML_MAX_NESTING_DEPTH."""
+        # Arrange
+        innermost = _message(subject="Livello 2", body="testo originale")
+        middle = _message(subject="Livello 1", body="primo inoltro")
+        middle.add_attachment(innermost)
+        outer = _message(subject="Livello 0", body="secondo inoltro")
+        outer.add_attachment(middle)
+        eml_path = _write(outer, os.path.join(work_dir, "mail.eml"))
+
+        # Act
+        with patch.object(settings, "EML_MAX_NESTING_DEPTH", 1):
+            parts = process_eml_file(eml_path, work_dir)
+
+        # Assert
+        assert "secondo inoltro" in parts[0]["content"]
+        assert "primo inoltro" in parts[1]["content"]
+        assert parts[2]["type"] == "error"
+        assert "troppi livelli" in parts[2]["message"]
+
+    def test_depth_limit_applies_to_forwards_without_eml_name(self, work_dir):
+        """Test that a message/rfc822 part named otherwise still counts as a nested email."""
+        # Arrange
+        innermost = _message(subject="Livello 2", body="testo originale")
+        middle = _message(subject="Livello 1", body="primo inoltro")
+        middle.add_attachment(innermost, filename="inoltro.dat")
+        outer = _message(subject="Livello 0", body="secondo inoltro")
+        outer.add_attachment(middle, filename="inoltro")
+        eml_path = _write(outer, os.path.join(work_dir, "mail.eml"))
+
+        # Act
+        with patch.object(settings, "EML_MAX_NESTING_DEPTH", 1):
+            parts = process_eml_file(eml_path, work_dir)
+
+        # Assert
+        assert "primo inoltro" in parts[1]["content"]
+        assert parts[2]["type"] == "error"
+        assert "troppi livelli" in parts[2]["message"]
+        assert not any("testo originale" in str(part) for part in parts)
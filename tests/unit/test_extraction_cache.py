@@ -0,0 +1,165 @@
+"""
+Unit tests for the content-addressed extraction cache.
+Tests lookup by file hash and extractor version, LRU eviction and the document_processor hook.
+"""
+
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+import document_processor
+import extractor_registry
+from core.config import settings
+from core.extraction_cache import ExtractionCache, hash_file
+
+
+@pytest.fixture
+def work_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+@pytest.fixture
+def cache(work_dir):
+    return ExtractionCache(os.path.join(work_dir, "cache.sqlite3"), 10_000)
+
+
+def _write(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+class TestExtractionCache:
+    """Test the SQLite cache itself."""
+
+    def test_get_returns_stored_result_and_counts_hits(self, cache):
+        """Test a round trip and the hit/miss counters."""
+        # Arrange
+        result = {"type": "text", "content": "Polizza n. 123", "filename": "a.txt"}
+
+        # Act
+        miss = cache.get("abc", "extract_text_from_txt", 1)
+        cache.put("abc", "extract_text_from_txt", 1, result)
+        hit = cache.get("abc", "extract_text_from_txt", 1)
+
+        # Assert
+        assert miss is None
+        assert hit == result
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["entries"] == 1
+
+    def test_extractor_version_is_part_of_the_key(self, cache):
+        """Test that a new extractor version does not see the old result."""
+        # Arrange
+        cache.put("abc", "extract_text_from_txt", 1, {"content": "old"})
+
+        # Act
+        result = cache.get("abc", "extract_text_from_txt", 2)
+
+        # Assert
+        assert result is None
+
+    def test_least_recently_used_entries_are_evicted_by_size(self, work_dir):
+        """Test that the total size stays under the limit, evicting the oldest access first."""
+        # Arrange
+        cache = ExtractionCache(os.path.join(work_dir, "small.sqlite3"), 2_500)
+        payload = "x" * 1_000
+        cache.put("first", "extract_text_from_txt", 1, payload)
+        cache.put("second", "extract_text_from_txt", 1, payload)
+        # Touch "first" so that "second" becomes the least recently used
+        cache.get("first", "extract_text_from_txt", 1)
+
+        # Act
+        cache.put("third", "extract_text_from_txt", 1, payload)
+
+        # Assert
+        assert cache.get("second", "extract_text_from_txt", 1) is None
+        assert cache.get("first", "extract_text_from_txt", 1) == payload
+        assert cache.get("third", "extract_text_from_txt", 1) == payload
+        stats = cache.stats()
+        assert stats["evictions"] == 1
+        assert stats["total_bytes"] <= 2_500
+
+
+class TestProcessUploadedFileCaching:
+    """Test the cache hook in document_processor."""
+
+    def test_repeat_document_is_not_parsed_again(self, cache, work_dir):
+        """Test that identical bytes under another name are served from the cache."""
+        # Arrange
+        first = _write(work_dir, "perizia.txt", "Sinistro del 12/03")
+        second = _write(work_dir, "perizia_copia.txt", "Sinistro del 12/03")
+
+        # Act
+        with patch("document_processor.get_extraction_cache", return_value=cache):
+            first_result = document_processor.process_uploaded_file(first, work_dir)
+            with patch("document_processor.extract_text_from_txt") as parser:
+                second_result = document_processor.process_uploaded_file(
+                    second, work_dir
+                )
+
+        # Assert
+        assert first_result["content"] == "Sinistro del 12/03"
+        assert second_result["content"] == "Sinistro del 12/03"
+        assert second_result["filename"] == "perizia_copia.txt"
+        parser.assert_not_called()
+        assert cache.stats()["hits"] == 1
+
+    def test_changed_extraction_settings_miss_the_cache(self, cache, work_dir):
+        """Test that a result extracted under other limits is not served again."""
+        # Arrange
+        filepath = _write(work_dir, "perizia.txt", "Sinistro del 12/03")
+
+        # Act
+        with patch("document_processor.get_extraction_cache", return_value=cache):
+            document_processor.process_uploaded_file(filepath, work_dir)
+            with patch.object(settings, "PDF_TEXT_MIN_CHARS_PER_PAGE", 1), patch(
+                "document_processor.extract_text_from_txt",
+                return_value={"type": "text", "content": "nuovo", "filename": ""},
+            ) as parser:
+                result = document_processor.process_uploaded_file(filepath, work_dir)
+
+        # Assert
+        parser.assert_called_once()
+        assert result["content"] == "nuovo"
+
+    def test_vision_results_are_not_cached(self, cache, work_dir):
+        """Test that results pointing at an uploaded file path are never stored."""
+        # Arrange
+        filepath = os.path.join(work_dir, "foto.png")
+        with open(filepath, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\nnot really an image")
+        vision_result = {
+            "type": "vision",
+            "path": filepath,
+            "mime_type": "image/png",
+            "filename": "foto.png",
+        }
+
+        # Act
+        with patch(
+            "document_processor.get_extraction_cache", return_value=cache
+        ), patch.object(extractor_registry.get_file_type("png"), "version", 1), patch(
+            "document_processor.prepare_image_for_llm", return_value=vision_result
+        ) as preparer:
+            document_processor.process_uploaded_file(filepath, work_dir)
+
+        # Assert
+        assert cache.stats()["entries"] == 0
+
+    def test_hash_file_depends_only_on_content(self, work_dir):
+        """Test that the hash ignores the file name."""
+        # Arrange
+        a = _write(work_dir, "a.txt", "stesso contenuto")
+        b = _write(work_dir, "b.txt", "stesso contenuto")
+        c = _write(work_dir, "c.txt", "altro contenuto")
+
+        # Act & Assert
+        assert hash_file(a) == hash_file(b)
+        assert hash_file(a) != hash_file(c)
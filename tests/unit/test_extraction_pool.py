@@ -0,0 +1,211 @@
+"""
+Unit tests for parallel document extraction.
+Tests that the files of an upload are extracted concurrently and merged back in upload order.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+import openpyxl
+import pytest
+
+import extraction_pool
+from core.config import settings
+
+
+@pytest.fixture
+def upload_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+def _write(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+def _write_xlsx(directory, name, value):
+    path = os.path.join(directory, name)
+    workbook = openpyxl.Workbook()
+    workbook.active["A1"] = value
+    workbook.save(path)
+    return path
+
+
+class TestExtractFiles:
+    """Test the fan-out of extraction across workers."""
+
+    def test_results_keep_upload_order_in_thread_mode(self, upload_dir):
+        """Test that results are returned in input order even if workers finish out of order."""
+        # Arrange
+        paths = [os.path.join(upload_dir, f"file{i}.txt") for i in range(3)]
+
+        def fake_process(filepath, work_dir):
+            if filepath.endswith("file0.txt"):
+                # The first file is the slowest one
+                time.sleep(0.2)
+            return {"type": "text", "content": os.path.basename(filepath)}
+
+        # Act
+        with patch.object(settings, "EXTRACTION_MAX_WORKERS", 0), patch(
+            "extraction_pool.document_processor.process_uploaded_file",
+            side_effect=fake_process,
+        ):
+            results = asyncio.run(extraction_pool.extract_files(paths, upload_dir))
+
+        # Assert
+        assert [r["content"] for r in results] == [
+            "file0.txt",
+            "file1.txt",
+            "file2.txt",
+        ]
+
+    def test_each_file_gets_its_own_work_dir(self, upload_dir):
+        """Test that concurrent files never share an attachment folder."""
+        # Arrange
+        paths = ["/tmp/a.eml", "/tmp/b.eml"]
+        seen_work_dirs = []
+
+        def fake_process(filepath, work_dir):
+            seen_work_dirs.append(work_dir)
+            return []
+
+        # Act
+        with patch.object(settings, "EXTRACTION_MAX_WORKERS", 0), patch(
+            "extraction_pool.document_processor.process_uploaded_file",
+            side_effect=fake_process,
+        ):
+            asyncio.run(extraction_pool.extract_files(paths, upload_dir))
+
+        # Assert
+        assert len(set(seen_work_dirs)) == 2
+        assert all(d.startswith(upload_dir) for d in seen_work_dirs)
+
+    def test_exception_is_returned_per_file(self, upload_dir):
+        """Test that a failing file does not prevent the others from being extracted."""
+
+        # Arrange
+        def fake_process(filepath, work_dir):
+            if "bad" in filepath:
+                raise RuntimeError("parser crashed")
+            return {"type": "text", "content": "ok"}
+
+        # Act
+        with patch.object(settings, "EXTRACTION_MAX_WORKERS", 0), patch(
+            "extraction_pool.document_processor.process_uploaded_file",
+            side_effect=fake_process,
+        ):
+            results = asyncio.run(
+                extraction_pool.extract_files(
+                    ["/tmp/bad.txt", "/tmp/good.txt"], upload_dir
+                )
+            )
+
+        # Assert
+        assert isinstance(results[0], RuntimeError)
+        assert results[1] == {"type": "text", "content": "ok"}
+
+    def test_process_pool_extracts_real_files(self, upload_dir):
+        """Test extraction through the real process pool."""
+        # Arrange
+        paths = [
+            _write_xlsx(upload_dir, "first.xlsx", "Prima pagina"),
+            _write_xlsx(upload_dir, "second.xlsx", "Seconda pagina"),
+        ]
+
+        # Act
+        try:
+            with patch.object(settings, "EXTRACTION_MAX_WORKERS", 2):
+                results = asyncio.run(extraction_pool.extract_files(paths, upload_dir))
+                started_pool = extraction_pool._pool is not None
+        finally:
+            extraction_pool.shutdown_extraction_pool()
+
+        # Assert
+        assert started_pool
+        assert "Prima pagina" in results[0]["content"]
+        assert "Seconda pagina" in results[1]["content"]
+
+    def test_io_bound_files_do_not_start_the_pool(self, upload_dir):
+        """Test that plain text files are read in threads even when workers are enabled."""
+        # Arrange
+        paths = [
+            _write(upload_dir, "first.txt", "Prima pagina"),
+            _write(upload_dir, "second.txt", "Seconda pagina"),
+        ]
+
+        # Act
+        try:
+            with patch.object(settings, "EXTRACTION_MAX_WORKERS", 2):
+                results = asyncio.run(extraction_pool.extract_files(paths, upload_dir))
+                started_pool = extraction_pool._pool is not None
+        finally:
+            extraction_pool.shutdown_extraction_pool()
+
+        # Assert
+        assert not started_pool
+        assert [r["content"] for r in results] == ["Prima pagina", "Seconda pagina"]
+        assert [r["filename"] for r in results] == ["first.txt", "second.txt"]
+
+
+class TestSandboxPool:
+    """Test the isolation of the worker processes."""
+
+    @pytest.fixture
+    def pool(self):
+        pool = extraction_pool.SandboxPool(max_workers=1)
+        yield pool
+        pool.shutdown()
+
+    def test_hung_extraction_is_killed(self, pool, upload_dir):
+        """Test that a worker over the time limit is killed and the file reported as an error."""
+        # Arrange
+        path = _write_xlsx(upload_dir, "stima.xlsx", "Totale")
+
+        # Act
+        with patch.object(settings, "EXTRACTION_TIMEOUT_SECONDS", 1):
+            with pytest.raises(extraction_pool.ExtractionTimeout):
+                pool.run(time.sleep, 30)
+        result = pool.extract(path, upload_dir)
+
+        # Assert
+        assert "Totale" in result["content"]
+
+    def test_memory_limit_stops_a_runaway_allocation(self, pool):
+        """Test that an allocation over the address-space limit fails inside the worker."""
+        # Act
+        with patch.object(settings, "EXTRACTION_MEMORY_LIMIT_MB", 1024):
+            with pytest.raises(RuntimeError, match="MemoryError"):
+                pool.run(bytes, 4 * 1024 * 1024 * 1024)
+
+    def test_worker_is_replaced_after_its_task_quota(self, pool):
+        """Test that workers are recycled after EXTRACTION_TASKS_PER_WORKER files."""
+        # Act
+        with patch.object(settings, "EXTRACTION_TASKS_PER_WORKER", 2):
+            pids = [pool.run(os.getpid) for _ in range(4)]
+
+        # Assert
+        assert pids[0] == pids[1]
+        assert pids[2] == pids[3]
+        assert pids[0] != pids[2]
+
+    def test_timeout_comes_back_as_an_error_entry(self, pool, upload_dir):
+        """Test that extract() reports a killed worker with the usual error dict."""
+        # Arrange
+        path = os.path.join(upload_dir, "denuncia.pdf")
+
+        # Act
+        with patch.object(settings, "EXTRACTION_TIMEOUT_SECONDS", 0):
+            result = pool.extract(path, upload_dir)
+
+        # Assert
+        assert result == {
+            "type": "error",
+            "filename": "denuncia.pdf",
+            "message": "Extraction timed out",
+        }
@@ -0,0 +1,154 @@
+"""
+Unit tests for the extractor registry.
+Tests content sniffing by magic bytes, routing of misnamed files and registration of new formats.
+"""
+
+import os
+import tempfile
+from email.message import EmailMessage
+
+import docx
+import fitz
+import openpyxl
+import pytest
+from PIL import Image
+
+import document_processor
+import extractor_registry
+from extractor_registry import FileType, sniff_file_type
+
+
+@pytest.fixture
+def work_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+def _write_bytes(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _write_pdf(directory, name, text):
+    path = os.path.join(directory, name)
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+class TestSniffFileType:
+    """Test recognition of the built-in formats from their content."""
+
+    def test_builtin_formats_are_recognized(self, work_dir):
+        """Test each built-in format saved under its usual extension."""
+        # Arrange
+        pdf_path = _write_pdf(work_dir, "denuncia.pdf", "Denuncia di sinistro")
+        png_path = os.path.join(work_dir, "foto.png")
+        Image.new("RGB", (10, 10)).save(png_path)
+        jpeg_path = os.path.join(work_dir, "foto.jpg")
+        Image.new("RGB", (10, 10)).save(jpeg_path)
+        docx_path = os.path.join(work_dir, "perizia.docx")
+        docx.Document().save(docx_path)
+        xlsx_path = os.path.join(work_dir, "stima.xlsx")
+        openpyxl.Workbook().save(xlsx_path)
+        message = EmailMessage()
+        message["From"] = "mario@example.com"
+        message["Subject"] = "Sinistro"
+        message.set_content("Buongiorno")
+        eml_path = _write_bytes(work_dir, "mail.eml", message.as_bytes())
+        html_path = _write_bytes(
+            work_dir, "pagina.html", b"<!DOCTYPE html><html><body>x</body></html>"
+        )
+        txt_path = _write_bytes(work_dir, "note.txt", "Caffè".encode("utf-8"))
+
+        # Act
+        names = [
+            sniff_file_type(path).name
+            for path in [
+                pdf_path,
+                png_path,
+                jpeg_path,
+                docx_path,
+                xlsx_path,
+                eml_path,
+                html_path,
+                txt_path,
+            ]
+        ]
+
+        # Assert
+        assert names == ["pdf", "png", "jpeg", "docx", "xlsx", "eml", "html", "txt"]
+
+    def test_misnamed_file_is_recognized_by_content(self, work_dir):
+        """Test that a PDF renamed to .docx is still a PDF."""
+        # Arrange
+        path = _write_pdf(work_dir, "denuncia.docx", "Denuncia di sinistro")
+
+        # Act
+        file_type = sniff_file_type(path)
+
+        # Assert
+        assert file_type.name == "pdf"
+
+    def test_binary_content_is_not_recognized(self, work_dir):
+        """Test that unknown binary content matches no type, whatever its name."""
+        # Arrange
+        path = _write_bytes(work_dir, "documento.pdf", b"\x00\x01\x02garbage")
+
+        # Act
+        file_type = sniff_file_type(path)
+
+        # Assert
+        assert file_type is None
+
+
+class TestProcessUploadedFile:
+    """Test dispatching through the registry."""
+
+    def test_misnamed_pdf_is_extracted_as_pdf(self, work_dir):
+        """Test that the PDF extractor handles a PDF uploaded with a .txt name."""
+        # Arrange
+        path = _write_pdf(
+            work_dir,
+            "denuncia.txt",
+            "Denuncia di sinistro del magazzino di Genova, danni da acqua alle scaffalature",
+        )
+
+        # Act
+        result = document_processor.process_uploaded_file(path, work_dir)
+
+        # Assert
+        assert result["type"] == "text"
+        assert result["original_filetype"] == "pdf"
+        assert "Denuncia di sinistro" in result["content"]
+
+    def test_registered_format_is_dispatched(self, work_dir):
+        """Test that a new format plugs in without changes to the dispatcher."""
+        # Arrange
+        path = _write_bytes(work_dir, "misure.csv", b"SEP=;\nlarghezza;altezza\n")
+        file_type = FileType(
+            "csv",
+            "text/csv",
+            (".csv",),
+            lambda header, path: header.startswith(b"SEP="),
+            lambda path, folder: {"type": "text", "content": "tabella"},
+            extractor_registry.COST_IO,
+        )
+
+        # Act
+        extractor_registry.register_file_type(file_type, before="txt")
+        try:
+            result = document_processor.process_uploaded_file(path, work_dir)
+        finally:
+            extractor_registry.unregister_file_type("csv")
+
+        # Assert
+        assert result == {
+            "type": "text",
+            "content": "tabella",
+            "filename": "misure.csv",
+        }
@@ -54,6 +54,22 @@ class TestFileValidation:
                 allowed_file(filename) is False
             ), f"File {filename} should not be allowed"
 
+    def test_registered_file_types_are_allowed(self):
+        """Test that formats known only to the extractor registry can be uploaded."""
+        # Arrange
+        filenames = ["pagina.html", "pagina.htm", "foto.webp", "animazione.gif"]
+
+        # Act & Assert
+        for filename in filenames:
+            assert allowed_file(filename) is True, f"File {filename} should be allowed"
+
+    def test_configured_extensions_restrict_uploads(self):
+        """Test that ALLOWED_EXTENSIONS narrows the registered types when set."""
+        # Act & Assert
+        with patch.object(settings, "ALLOWED_EXTENSIONS", {"pdf"}):
+            assert allowed_file("document.pdf") is True
+            assert allowed_file("pagina.html") is False
+
     def test_allowed_file_case_insensitive(self):
         """Test that file extension checking is case insensitive."""
         # Arrange
@@ -0,0 +1,124 @@
+"""
+Unit tests for the shared Gemini client.
+Tests that one pooled client is reused per event loop and that it is closed on shutdown.
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from core import gemini_client
+from core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_client():
+    gemini_client._client, gemini_client._client_loop = None, None
+    gemini_client._loop_clients.clear()
+    yield
+    gemini_client._client, gemini_client._client_loop = None, None
+    gemini_client._loop_clients.clear()
+
+
+class TestGetGeminiClient:
+    """Test creation and sharing of the process-wide client."""
+
+    def test_client_is_built_with_connection_limits(self):
+        """Test that the configured pool limits reach both httpx clients."""
+        # Act
+        with patch.object(settings, "GEMINI_API_KEY", "key"), patch.object(
+            settings, "GEMINI_HTTP_MAX_CONNECTIONS", 7
+        ), patch("core.gemini_client.genai.Client") as client_cls:
+            gemini_client.get_gemini_client()
+
+        # Assert
+        http_options = client_cls.call_args.kwargs["http_options"]
+        assert http_options.client_args["limits"].max_connections == 7
+        assert http_options.async_client_args["limits"].max_connections == 7
+
+    def test_same_loop_reuses_the_client(self):
+        """Test that consecutive calls on one loop share a single client."""
+
+        # Arrange
+        async def _get_twice():
+            return gemini_client.get_gemini_client(), gemini_client.get_gemini_client()
+
+        # Act
+        with patch("core.gemini_client.genai.Client", side_effect=MagicMock):
+            first, second = asyncio.run(_get_twice())
+
+        # Assert
+        assert first is second
+
+    def test_closed_loop_gets_a_fresh_client(self):
+        """Test that a client bound to a finished loop is not handed out again."""
+
+        # Arrange
+        async def _get():
+            return gemini_client.get_gemini_client()
+
+        # Act
+        with patch("core.gemini_client.genai.Client", side_effect=MagicMock):
+            first = asyncio.run(_get())
+            second = asyncio.run(_get())
+
+        # Assert
+        assert first is not second
+
+    def test_foreign_loop_reuses_its_own_client(self):
+        """Test that another live loop gets one client of its own, not one per call."""
+        # Arrange
+        owner_loop = asyncio.new_event_loop()
+
+        async def _get_twice():
+            return gemini_client.get_gemini_client(), gemini_client.get_gemini_client()
+
+        # Act
+        with patch("core.gemini_client.genai.Client", side_effect=MagicMock):
+            shared = owner_loop.run_until_complete(_get_twice())[0]
+            first, second = asyncio.run(_get_twice())
+        owner_loop.close()
+
+        # Assert
+        assert first is second
+        assert first is not shared
+
+    def test_client_of_a_closed_foreign_loop_is_released(self):
+        """Test that the pool of a foreign loop's client is closed once its loop is gone."""
+        # Arrange
+        owner_loop = asyncio.new_event_loop()
+
+        async def _get():
+            return gemini_client.get_gemini_client()
+
+        with patch("core.gemini_client.genai.Client", side_effect=MagicMock):
+            owner_loop.run_until_complete(_get())
+            foreign = asyncio.run(_get())
+
+            # Act
+            owner_loop.run_until_complete(_get())
+        owner_loop.close()
+
+        # Assert
+        foreign._api_client._httpx_client.close.assert_called_once()
+        assert len(gemini_client._loop_clients) == 0
+
+
+class TestCloseGeminiClient:
+    """Test the shutdown of the shared client."""
+
+    def test_close_releases_both_connection_pools(self):
+        """Test that both httpx clients are closed and the client is dropped."""
+        # Arrange
+        client = MagicMock()
+        client._api_client._async_httpx_client.aclose = AsyncMock()
+        gemini_client._client = client
+
+        # Act
+        asyncio.run(gemini_client.close_gemini_client())
+
+        # Assert
+        client._api_client._async_httpx_client.aclose.assert_awaited_once()
+        client._api_client._httpx_client.close.assert_called_once()
+        assert gemini_client._client is None
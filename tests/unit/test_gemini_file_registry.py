@@ -0,0 +1,128 @@
+"""
+Unit tests for the Gemini File API upload registry.
+Tests that identical documents reuse a still-valid upload and that expiring uploads are collected.
+"""
+
+import asyncio
+import datetime
+import os
+import tempfile
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import pytest
+from google.genai import types
+
+import llm_handler
+from core.config import settings
+from core.gemini_file_registry import GeminiFileRegistry
+
+
+@pytest.fixture
+def work_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+@pytest.fixture
+def registry(work_dir):
+    return GeminiFileRegistry(os.path.join(work_dir, "registry.sqlite3"))
+
+
+def _uploaded_file(name, hours_left):
+    return types.File(
+        name=name,
+        uri=f"https://generativelanguage.googleapis.com/v1beta/{name}",
+        mime_type="application/pdf",
+        display_name="polizza.pdf",
+        expiration_time=datetime.datetime.now(datetime.timezone.utc)
+        + datetime.timedelta(hours=hours_left),
+    )
+
+
+class TestGeminiFileRegistry:
+    """Test lookup and garbage collection in the registry."""
+
+    def test_lookup_returns_registered_file(self, registry):
+        """Test that a registered upload is found by content hash and MIME type."""
+        # Arrange
+        registry.register("hash1", _uploaded_file("files/abc", hours_left=40))
+
+        # Act
+        found = registry.lookup("hash1", "application/pdf", 3600)
+        other_type = registry.lookup("hash1", "image/png", 3600)
+
+        # Assert
+        assert found.name == "files/abc"
+        assert found.uri.endswith("files/abc")
+        assert other_type is None
+
+    def test_lookup_ignores_files_close_to_expiry(self, registry):
+        """Test that an upload expiring within the margin is not reused."""
+        # Arrange
+        registry.register("hash1", _uploaded_file("files/abc", hours_left=0.5))
+
+        # Act
+        found = registry.lookup("hash1", "application/pdf", 3600)
+
+        # Assert
+        assert found is None
+
+    def test_pop_expiring_removes_only_expiring_files(self, registry):
+        """Test that garbage collection returns and forgets only expiring uploads."""
+        # Arrange
+        registry.register("old", _uploaded_file("files/old", hours_left=0.5))
+        registry.register("new", _uploaded_file("files/new", hours_left=40))
+
+        # Act
+        expiring = registry.pop_expiring(3600)
+
+        # Assert
+        assert expiring == ["files/old"]
+        assert registry.stats()["files"] == 1
+
+
+class TestUploadReuseInReportGeneration:
+    """Test that generate_report_from_content consults the registry."""
+
+    def test_identical_document_is_uploaded_once(self, registry, work_dir):
+        """Test that a second report with the same PDF skips the upload and nothing is deleted."""
+        # Arrange
+        pdf_path = os.path.join(work_dir, "polizza.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(b"%PDF-1.4 polizza")
+        processed_files = [
+            {
+                "type": "vision",
+                "path": pdf_path,
+                "mime_type": "application/pdf",
+                "filename": "polizza.pdf",
+            }
+        ]
+        client = MagicMock()
+        client.files.upload.return_value = _uploaded_file("files/abc", hours_left=40)
+        generate = AsyncMock(return_value=(Mock(), "Report"))
+
+        # Act
+        with patch.object(settings, "GEMINI_API_KEY", "key"), patch(
+            "llm_handler.get_gemini_client", return_value=client
+        ), patch("llm_handler.get_gemini_file_registry", return_value=registry), patch(
+            "llm_handler._get_or_create_prompt_cache", AsyncMock(return_value=None)
+        ), patch(
+            "llm_handler._generate_content", generate
+        ):
+            first = asyncio.run(
+                llm_handler.generate_report_from_content(processed_files)
+            )
+            second = asyncio.run(
+                llm_handler.generate_report_from_content(processed_files)
+            )
+
+        # Assert
+        assert first.text == second.text == "Report"
+        client.files.upload.assert_called_once()
+        client.files.delete.assert_not_called()
+        second_prompt = generate.call_args_list[1].args[1]
+        assert any(
+            isinstance(part, types.File) and part.name == "files/abc"
+            for part in second_prompt
+        )
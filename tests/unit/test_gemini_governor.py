@@ -0,0 +1,199 @@
+"""
+Unit tests for the Gemini rate and concurrency governor.
+Tests the token buckets, the generation limit, the bounded queue and the reaction to 429 errors.
+"""
+
+import asyncio
+import os
+import tempfile
+from unittest.mock import patch
+
+import httpx
+import pytest
+from google.genai import errors as genai_errors
+
+from core.config import settings
+from core.gemini_governor import (
+    GeminiGovernor,
+    GeminiOverloadedError,
+    retry_after_seconds,
+)
+
+
+@pytest.fixture
+def work_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+def _governor(work_dir, **overrides):
+    options = {
+        "requests_per_minute": 600,
+        "tokens_per_minute": 100_000,
+        "max_concurrent_generations": 2,
+        "max_queued_calls": 10,
+        **overrides,
+    }
+    return GeminiGovernor(os.path.join(work_dir, "governor.sqlite3"), **options)
+
+
+async def _call(governor, generation=False, estimated_tokens=0):
+    async with governor.slot(generation, estimated_tokens):
+        pass
+
+
+def _rate_limit_error(retry_delay="7s"):
+    return genai_errors.ClientError(
+        429,
+        {
+            "error": {
+                "code": 429,
+                "status": "RESOURCE_EXHAUSTED",
+                "details": [
+                    {
+                        "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": retry_delay,
+                    }
+                ],
+            }
+        },
+    )
+
+
+class TestBuckets:
+    """Test the requests and tokens per minute buckets."""
+
+    def test_requests_beyond_the_bucket_wait(self, work_dir):
+        """Test that a call over the requests quota is refused once the wait limit passes."""
+        # Arrange
+        governor = _governor(work_dir, requests_per_minute=2)
+
+        async def scenario():
+            await _call(governor)
+            await _call(governor)
+            await _call(governor)
+
+        # Act & Assert
+        with patch.object(settings, "GEMINI_MAX_QUEUE_WAIT_SECONDS", 1):
+            with pytest.raises(GeminiOverloadedError):
+                asyncio.run(scenario())
+        assert governor.stats()["queued_calls"] == 0
+
+    def test_actual_usage_corrects_the_token_estimate(self, work_dir):
+        """Test that record_tokens charges the tokens the estimate missed."""
+        # Arrange
+        governor = _governor(work_dir)
+        asyncio.run(_call(governor, generation=True, estimated_tokens=10_000))
+
+        # Act
+        governor.record_tokens(10_000, 60_000)
+
+        # Assert
+        assert 40_000 <= governor.stats()["tokens_available"] < 41_000
+
+
+class TestConcurrency:
+    """Test the limit on generations in flight and the bounded queue."""
+
+    def test_generations_beyond_the_limit_wait_for_a_free_slot(self, work_dir):
+        """Test that a generation starts only when another one ends."""
+        # Arrange
+        governor = _governor(work_dir, max_concurrent_generations=1)
+        events = []
+
+        async def generation(name, seconds):
+            async with governor.slot(generation=True):
+                events.append(f"{name} start")
+                await asyncio.sleep(seconds)
+                events.append(f"{name} end")
+
+        async def scenario():
+            first = asyncio.create_task(generation("first", 0.5))
+            await asyncio.sleep(0.1)
+            await generation("second", 0)
+            await first
+
+        # Act
+        asyncio.run(scenario())
+
+        # Assert
+        assert events == ["first start", "first end", "second start", "second end"]
+
+    def test_full_queue_fails_fast(self, work_dir):
+        """Test that callers beyond GEMINI_MAX_QUEUED_CALLS are rejected right away."""
+        # Arrange
+        governor = _governor(work_dir, max_queued_calls=0)
+
+        # Act & Assert
+        with pytest.raises(GeminiOverloadedError, match="waiting"):
+            asyncio.run(_call(governor))
+
+
+class TestRateLimits:
+    """Test the reaction to 429 answers."""
+
+    def test_rate_limit_slows_everyone_down(self, work_dir):
+        """Test that a 429 halves the rates and pauses calls for the suggested delay."""
+        # Arrange
+        governor = _governor(work_dir)
+
+        async def failing_call():
+            async with governor.slot(generation=True):
+                raise _rate_limit_error("7s")
+
+        # Act
+        with pytest.raises(genai_errors.ClientError):
+            asyncio.run(failing_call())
+
+        # Assert
+        stats = governor.stats()
+        assert stats["rate_factor"] == 0.5
+        assert 6 < stats["cooldown_seconds"] <= 7
+        assert stats["in_flight_generations"] == 0
+
+    def test_successes_restore_the_rate(self, work_dir):
+        """Test that the rate recovers step by step after a rate limit."""
+        # Arrange
+        governor = _governor(work_dir)
+        governor.record_rate_limited(retry_after=0)
+
+        # Act
+        for _ in range(4):
+            asyncio.run(_call(governor))
+
+        # Assert
+        assert governor.stats()["rate_factor"] == 0.7
+
+    def test_other_errors_count_as_successes(self, work_dir):
+        """Test that a non-429 error restores the rate like a success and frees its slot."""
+        # Arrange
+        governor = _governor(work_dir)
+        governor.record_rate_limited(retry_after=0)
+
+        async def failing_call():
+            async with governor.slot(generation=True):
+                raise genai_errors.ClientError(400, {"error": {"code": 400}})
+
+        # Act
+        with pytest.raises(genai_errors.ClientError):
+            asyncio.run(failing_call())
+
+        # Assert
+        stats = governor.stats()
+        assert stats["rate_factor"] > 0.5
+        assert stats["in_flight_generations"] == 0
+
+    def test_retry_after_header_and_retry_info(self):
+        """Test the two places where Gemini suggests a retry delay."""
+        # Arrange
+        response = httpx.Response(429, headers={"Retry-After": "12"})
+        header_error = httpx.HTTPStatusError(
+            "429",
+            request=httpx.Request("POST", "https://example.com"),
+            response=response,
+        )
+
+        # Act & Assert
+        assert retry_after_seconds(header_error) == 12.0
+        assert retry_after_seconds(_rate_limit_error("1.5s")) == 1.5
+        assert retry_after_seconds(RuntimeError("boom")) is None
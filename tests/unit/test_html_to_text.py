@@ -0,0 +1,119 @@
+"""
+Unit tests for the HTML to text conversion.
+Tests that markup, styles and scripts are dropped while lists, tables and quotes keep their layout.
+"""
+
+import os
+import tempfile
+from email.message import EmailMessage
+
+from document_processor import extract_text_from_html, process_eml_file
+from html_to_text import html_to_text
+
+
+class TestHtmlToText:
+    """Test html_to_text on typical email markup."""
+
+    def test_style_script_and_hidden_blocks_are_dropped(self):
+        """Test that only the visible text remains."""
+        # Arrange
+        html = (
+            "<html><head><title>Newsletter</title><style>p {color: red}</style></head>"
+            "<body><div style='display:none'>Anteprima nascosta</div>"
+            "<script>track();</script><p>Buongiorno,&nbsp;in   allegato\n la denuncia.</p>"
+            "<img src='https://tracker.example.com/pixel.gif' width='1' height='1'>"
+            "</body></html>"
+        )
+
+        # Act
+        text = html_to_text(html)
+
+        # Assert
+        assert text == "Buongiorno, in allegato la denuncia."
+
+    def test_lists_and_line_breaks(self):
+        """Test that list items get markers and <br> starts a new line."""
+        # Arrange
+        html = (
+            "<p>Danni rilevati:<br>elenco</p>"
+            "<ul><li>scaffalature</li><li>merce</li></ul>"
+            "<ol><li>primo</li><li>secondo</li></ol>"
+        )
+
+        # Act
+        text = html_to_text(html)
+
+        # Assert
+        assert text == (
+            "Danni rilevati:\nelenco\n\n- scaffalature\n- merce\n\n1. primo\n2. secondo"
+        )
+
+    def test_tables_keep_rows_and_cells(self):
+        """Test that each table row becomes one line with cells separated by ' | '."""
+        # Arrange
+        html = (
+            "<p>Stima:</p><table><tr><th>Voce</th><th>Importo</th></tr>"
+            "<tr><td>Scaffalature</td><td>1.200 &euro;</td></tr>"
+            "<tr><td></td><td></td></tr></table><p>Cordiali saluti</p>"
+        )
+
+        # Act
+        text = html_to_text(html)
+
+        # Assert
+        assert text == (
+            "Stima:\n\nVoce | Importo\nScaffalature | 1.200 €\n\nCordiali saluti"
+        )
+
+    def test_blockquotes_are_marked_as_quotes(self):
+        """Test that quoted replies get the '> ' prefix used by plain-text emails."""
+        # Arrange
+        html = "<div>Grazie</div><blockquote><p>Testo originale</p></blockquote>"
+
+        # Act
+        text = html_to_text(html)
+
+        # Assert
+        assert text == "Grazie\n\n> Testo originale"
+
+
+class TestHtmlExtraction:
+    """Test that HTML bodies and attachments go through the converter."""
+
+    def test_html_file_is_converted(self):
+        """Test extract_text_from_html with a charset declared in the document."""
+        # Arrange
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, "perizia.html")
+            with open(path, "wb") as f:
+                f.write(
+                    "<html><head><meta charset='iso-8859-1'></head>"
+                    "<body><h1>Perizia</h1><p>Caffè</p></body></html>".encode(
+                        "iso-8859-1"
+                    )
+                )
+
+            # Act
+            result = extract_text_from_html(path)
+
+        # Assert
+        assert result["content"] == "Perizia\n\nCaffè"
+
+    def test_html_only_email_body_is_converted(self):
+        """Test that an email without a text/plain part gets a text body."""
+        # Arrange
+        message = EmailMessage()
+        message["Subject"] = "Sinistro"
+        message.set_content(
+            "<style>.x{}</style><p>Sopralluogo fissato</p>", subtype="html"
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            eml_path = os.path.join(work_dir, "mail.eml")
+            with open(eml_path, "wb") as f:
+                f.write(message.as_bytes())
+
+            # Act
+            parts = process_eml_file(eml_path, work_dir)
+
+        # Assert
+        assert parts[0]["content"] == "Oggetto: Sinistro\n\nSopralluogo fissato"
@@ -0,0 +1,163 @@
+"""
+Unit tests for near-duplicate photo detection.
+Tests the perceptual hash and the collapsing of near-duplicate images in an upload.
+"""
+
+import os
+import tempfile
+
+import pytest
+from PIL import Image, ImageDraw
+
+import image_dedup
+
+
+@pytest.fixture
+def work_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+def _write_scene(path, size, shift=0):
+    """Writes a simple 'photo' whose content scales with ``size``."""
+    width, height = size
+    img = Image.new("RGB", size, (30, 30, 30))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle(
+        [width // 4 + shift, height // 4, width // 2 + shift, height * 3 // 4],
+        fill=(220, 200, 180),
+    )
+    img.save(path, "JPEG", quality=80)
+
+
+def _hash(path):
+    with Image.open(path) as img:
+        return image_dedup.perceptual_hash(img)
+
+
+def _image_part(path, width, height, filename=None):
+    return {
+        "type": "vision",
+        "path": path,
+        "mime_type": "image/jpeg",
+        "filename": filename or os.path.basename(path),
+        "width": width,
+        "height": height,
+        "dhash": _hash(path),
+    }
+
+
+class TestPerceptualHash:
+    """Test the dHash of images."""
+
+    def test_resized_copy_has_a_close_hash(self, work_dir):
+        """Test that the same scene at another resolution hashes almost identically."""
+        # Arrange
+        large = os.path.join(work_dir, "large.jpg")
+        small = os.path.join(work_dir, "small.jpg")
+        _write_scene(large, (1600, 1200))
+        _write_scene(small, (400, 300))
+
+        # Act
+        distance = image_dedup.hamming_distance(_hash(large), _hash(small))
+
+        # Assert
+        assert distance <= 2
+
+    def test_rotated_photo_hashes_as_displayed(self, work_dir):
+        """Test that a photo rotated by its EXIF orientation matches an upright copy."""
+        # Arrange
+        upright = os.path.join(work_dir, "upright.jpg")
+        rotated = os.path.join(work_dir, "rotated.jpg")
+        _write_scene(upright, (800, 600))
+        with Image.open(upright) as img:
+            exif = Image.Exif()
+            exif[0x0112] = 6  # Displayed rotated 90 degrees clockwise
+            img.transpose(Image.Transpose.ROTATE_90).save(rotated, "JPEG", exif=exif)
+
+        # Act
+        distance = image_dedup.hamming_distance(_hash(upright), _hash(rotated))
+
+        # Assert
+        assert distance <= 2
+
+    def test_truncated_image_has_no_hash(self, work_dir):
+        """Test that an image that cannot be decoded yields None instead of failing."""
+        # Arrange
+        truncated = os.path.join(work_dir, "truncated.jpg")
+        _write_scene(truncated, (800, 600))
+        with open(truncated, "rb") as f:
+            data = f.read()
+        with open(truncated, "wb") as f:
+            f.write(data[: len(data) // 3])
+
+        # Act
+        with Image.open(truncated) as img:
+            result = image_dedup.try_perceptual_hash(img)
+
+        # Assert
+        assert result is None
+
+
+class TestCollapseNearDuplicates:
+    """Test the collapsing of near-duplicate images."""
+
+    def test_duplicates_collapse_into_the_sharpest_copy(self, work_dir):
+        """Test that the higher-resolution copy is kept in the first copy's position."""
+        # Arrange
+        small = os.path.join(work_dir, "small.jpg")
+        large = os.path.join(work_dir, "large.jpg")
+        _write_scene(small, (400, 300))
+        _write_scene(large, (1600, 1200))
+        notes = {"type": "text", "filename": "note.txt", "content": "x"}
+        parts = [
+            _image_part(small, 400, 300, "IMG_001.jpg"),
+            notes,
+            _image_part(large, 1600, 1200, "IMG_001 (email).jpg"),
+        ]
+
+        # Act
+        kept, messages = image_dedup.collapse_near_duplicates(parts)
+
+        # Assert
+        assert len(kept) == 2
+        assert kept[0]["path"] == large
+        assert kept[0]["duplicates"] == ["IMG_001.jpg"]
+        assert kept[1] is notes
+        assert "IMG_001.jpg" in messages[0][0]
+
+    def test_different_photos_are_kept(self, work_dir):
+        """Test that photos of different scenes are all sent."""
+        # Arrange
+        first = os.path.join(work_dir, "first.jpg")
+        second = os.path.join(work_dir, "second.jpg")
+        _write_scene(first, (800, 600))
+        img = Image.new("RGB", (800, 600), (30, 30, 30))
+        ImageDraw.Draw(img).ellipse([500, 50, 780, 550], fill=(250, 250, 250))
+        img.save(second, "JPEG")
+        parts = [_image_part(first, 800, 600), _image_part(second, 800, 600)]
+
+        # Act
+        kept, messages = image_dedup.collapse_near_duplicates(parts)
+
+        # Assert
+        assert kept == parts
+        assert messages == []
+
+    def test_sharpness_is_judged_on_the_originals(self, work_dir):
+        """Test that the copy with the larger original wins although both are downsized."""
+        # Arrange
+        small = os.path.join(work_dir, "small.jpg")
+        large = os.path.join(work_dir, "large.jpg")
+        _write_scene(small, (800, 600))
+        _write_scene(large, (1600, 1200))
+        first = {**_image_part(small, 800, 600), "source_width": 800}
+        first["source_height"] = 600
+        second = {**_image_part(large, 800, 600), "source_width": 1600}
+        second["source_height"] = 1200
+
+        # Act
+        kept, _ = image_dedup.collapse_near_duplicates([first, second])
+
+        # Assert
+        assert [part["path"] for part in kept] == [large]
@@ -0,0 +1,139 @@
+"""
+Unit tests for the image normalizer.
+Tests downsizing, EXIF orientation, metadata stripping and reuse of normalized copies.
+"""
+
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import image_normalizer
+from core.config import settings
+from document_processor import prepare_image_for_llm
+
+
+@pytest.fixture
+def work_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        with patch.object(
+            settings, "IMAGE_CACHE_DIR", os.path.join(directory, "cache")
+        ), patch.object(settings, "IMAGE_MAX_LONG_EDGE", 1000):
+            yield directory
+
+
+def _write_photo(path, size=(4000, 3000), orientation=None):
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    if orientation is not None:
+        exif[0x0112] = orientation
+    Image.new("RGB", size, (120, 80, 40)).save(path, "JPEG", exif=exif)
+
+
+class TestNormalizeImage:
+    """Test the normalized copies produced for uploaded images."""
+
+    def test_large_photo_is_downsized_and_stripped(self, work_dir):
+        """Test that the long edge is capped and no EXIF metadata survives."""
+        # Arrange
+        photo = os.path.join(work_dir, "danno.jpg")
+        _write_photo(photo)
+
+        # Act
+        result = image_normalizer.normalize_image(photo)
+
+        # Assert
+        assert (result.width, result.height) == (1000, 750)
+        assert result.mime_type == "image/jpeg"
+        with Image.open(result.path) as normalized:
+            assert len(normalized.getexif()) == 0
+
+    def test_exif_orientation_is_applied(self, work_dir):
+        """Test that a photo taken sideways comes out upright."""
+        # Arrange
+        photo = os.path.join(work_dir, "ruotata.jpg")
+        _write_photo(photo, size=(800, 600), orientation=6)  # Rotated 90 degrees
+
+        # Act
+        result = image_normalizer.normalize_image(photo)
+
+        # Assert
+        assert (result.width, result.height) == (600, 800)
+
+    def test_same_source_reuses_the_normalized_copy(self, work_dir):
+        """Test that a re-uploaded photo is served from the cache directory."""
+        # Arrange
+        first_upload = os.path.join(work_dir, "a.jpg")
+        second_upload = os.path.join(work_dir, "b.jpg")
+        _write_photo(first_upload)
+        _write_photo(second_upload)
+        first = image_normalizer.normalize_image(first_upload)
+
+        # Act
+        with patch.object(image_normalizer.Image, "open", wraps=Image.open) as opened:
+            second = image_normalizer.normalize_image(second_upload)
+
+        # Assert
+        assert second == first
+        opened.assert_called_once_with(first.path)
+
+    def test_pruning_spares_images_in_use(self, work_dir):
+        """Test that pruning deletes old entries but not one a job may still upload."""
+        # Arrange
+        old_upload = os.path.join(work_dir, "old.jpg")
+        pending_upload = os.path.join(work_dir, "pending.jpg")
+        new_upload = os.path.join(work_dir, "new.jpg")
+        _write_photo(old_upload, size=(900, 600))
+        _write_photo(pending_upload, size=(700, 600))
+        _write_photo(new_upload, size=(500, 600))
+        old = image_normalizer.normalize_image(old_upload)
+        pending = image_normalizer.normalize_image(pending_upload)
+        long_ago = time.time() - 2 * settings.LLM_API_TIMEOUT_SECONDS
+        os.utime(old.path, (long_ago, long_ago))
+        os.utime(pending.path, (long_ago, long_ago))
+        image_normalizer.mark_in_use(pending.path)
+
+        # Act
+        with patch.object(settings, "IMAGE_CACHE_MAX_MB", 0):
+            new = image_normalizer.normalize_image(new_upload)
+
+        # Assert
+        assert not os.path.exists(old.path)
+        assert os.path.exists(pending.path)
+        assert os.path.exists(new.path)
+
+
+class TestPrepareImageForLLM:
+    """Test that prepare_image_for_llm sends the normalized copy."""
+
+    def test_vision_part_points_at_normalized_copy(self, work_dir):
+        """Test that the part keeps the upload name but uses the normalized file."""
+        # Arrange
+        photo = os.path.join(work_dir, "danno.jpg")
+        _write_photo(photo)
+
+        # Act
+        result = prepare_image_for_llm(photo)
+
+        # Assert
+        assert result["filename"] == "danno.jpg"
+        assert result["path"].startswith(settings.IMAGE_CACHE_DIR)
+        assert result["width"] == 1000
+        assert os.path.getsize(result["path"]) < os.path.getsize(photo)
+
+    def test_original_is_sent_when_disabled(self, work_dir):
+        """Test that disabling normalization keeps the uploaded file."""
+        # Arrange
+        photo = os.path.join(work_dir, "danno.jpg")
+        _write_photo(photo)
+
+        # Act
+        with patch.object(settings, "IMAGE_NORMALIZATION_ENABLED", False):
+            result = prepare_image_for_llm(photo)
+
+        # Assert
+        assert result["path"] == photo
+        assert result["mime_type"] == "image/jpeg"
@@ -0,0 +1,137 @@
+"""
+Unit tests for the background job engine.
+Tests that queued report jobs run off the request thread and report their progress.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from core.job_queue import JobQueue, JobQueueFullError, JobState
+
+
+@pytest.fixture
+def job_queue():
+    queue = JobQueue(max_workers=1, max_queue_size=2, retention_seconds=3600)
+    yield queue
+    queue.shutdown()
+
+
+def _wait_for(job, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if job.is_finished:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"Job {job.id} did not finish in time")
+
+
+class TestJobQueue:
+    """Test job submission, execution and status reporting."""
+
+    def test_submit_runs_handler_and_marks_success(self, job_queue):
+        """Test that a submitted job is executed and ends in the success state."""
+        # Arrange
+        seen_payloads = []
+
+        async def handler(job):
+            job.set_stage("generating")
+            seen_payloads.append(job.payload)
+
+        job_queue.set_handler(handler)
+
+        # Act
+        job = job_queue.submit("job-1", {"files": ["a.pdf"]})
+        _wait_for(job)
+
+        # Assert
+        assert job.state == JobState.SUCCESS
+        assert job.stage == "done"
+        assert seen_payloads == [{"files": ["a.pdf"]}]
+        assert job_queue.get("job-1") is job
+
+    def test_handler_exception_marks_error(self, job_queue):
+        """Test that an exception raised by the handler is recorded on the job."""
+
+        # Arrange
+        async def handler(job):
+            raise ValueError("extraction exploded")
+
+        job_queue.set_handler(handler)
+
+        # Act
+        job = job_queue.submit("job-2", {})
+        _wait_for(job)
+
+        # Assert
+        assert job.state == JobState.ERROR
+        assert "extraction exploded" in job.error
+
+    def test_handler_can_report_error_state(self, job_queue):
+        """Test that a handler can fail a job without raising."""
+
+        # Arrange
+        async def handler(job):
+            job.add_message("Content was truncated.", "warning")
+            job.state = JobState.ERROR
+            job.error = "LLM failed"
+
+        job_queue.set_handler(handler)
+
+        # Act
+        job = job_queue.submit("job-3", {})
+        _wait_for(job)
+
+        # Assert
+        status = job.to_dict()
+        assert status["state"] == JobState.ERROR
+        assert status["error"] == "LLM failed"
+        assert status["messages"] == [
+            {"message": "Content was truncated.", "category": "warning"}
+        ]
+
+    def test_queue_full_rejects_submission(self, job_queue):
+        """Test that submissions beyond the queue size are rejected and positions reported."""
+        # Arrange
+        release = threading.Event()
+
+        async def handler(job):
+            await asyncio.to_thread(release.wait, 5)
+
+        job_queue.set_handler(handler)
+        running = job_queue.submit("running", {})
+        for _ in range(100):
+            if running.state == JobState.RUNNING:
+                break
+            threading.Event().wait(0.01)
+
+        # Act
+        job_queue.submit("waiting-1", {})
+        job_queue.submit("waiting-2", {})
+
+        # Assert
+        assert job_queue.queue_depth() == 2
+        assert job_queue.queue_position("waiting-2") == 2
+        assert job_queue.queue_position("running") is None
+        with pytest.raises(JobQueueFullError):
+            job_queue.submit("rejected", {})
+
+        release.set()
+
+    def test_start_hooks_run_once_per_start(self, job_queue):
+        """Test that start hooks run when the loop starts, not on every submission."""
+        # Arrange
+        calls = []
+        job_queue.add_start_hook(lambda: calls.append(job_queue.is_running))
+
+        async def handler(job):
+            pass
+
+        job_queue.set_handler(handler)
+
+        # Act
+        _wait_for(job_queue.submit("job-1", {}))
+        _wait_for(job_queue.submit("job-2", {}))
+
+        # Assert
+        assert calls == [True]
@@ -0,0 +1,119 @@
+"""
+Unit tests for the continuation of reports cut at the output token limit.
+Tests that a MAX_TOKENS generation is resumed from its last complete section and that the rounds are capped.
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from google.genai import types
+
+import llm_handler
+from core.config import settings
+
+
+def _response(finish_reason, output_tokens=100):
+    response = MagicMock()
+    candidate = MagicMock()
+    candidate.finish_reason = finish_reason
+    response.candidates = [candidate]
+    response.usage_metadata = types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=1000, candidates_token_count=output_tokens
+    )
+    return response
+
+
+def _run(generate, max_rounds=2):
+    with patch.object(settings, "GEMINI_API_KEY", "key"), patch.object(
+        settings, "LLM_CONTINUATION_MAX_ROUNDS", max_rounds
+    ), patch("llm_handler.get_gemini_client", return_value=MagicMock()), patch(
+        "llm_handler._get_or_create_prompt_cache",
+        AsyncMock(return_value="cachedContents/abc"),
+    ), patch(
+        "llm_handler._generate_content", generate
+    ):
+        return asyncio.run(
+            llm_handler.generate_report_from_content(
+                [{"type": "text", "content": "Testo", "filename": "a.txt"}]
+            )
+        )
+
+
+TRUNCATED = (
+    "Spett.le\n\n1 – DATI GENERALI\n\nMittente: X\n\n"
+    "2 – DINAMICA DEGLI EVENTI ED ACCERTAMENTI\n\nIl giorno"
+)
+
+
+class TestContinuation:
+    """Test the resumption of truncated generations."""
+
+    def test_truncated_report_is_resumed_and_stitched(self):
+        """Test that the continuation restarts at the truncated section and is joined on."""
+        # Arrange
+        generate = AsyncMock(
+            side_effect=[
+                (_response(types.FinishReason.MAX_TOKENS), TRUNCATED),
+                (
+                    _response(types.FinishReason.STOP, output_tokens=50),
+                    "2 – DINAMICA DEGLI EVENTI ED ACCERTAMENTI\n\nIl giorno 3 maggio.",
+                ),
+            ]
+        )
+
+        # Act
+        result = _run(generate)
+
+        # Assert
+        assert not result.is_error
+        assert result.text == (
+            "Spett.le\n\n1 – DATI GENERALI\n\nMittente: X\n\n"
+            "2 – DINAMICA DEGLI EVENTI ED ACCERTAMENTI\n\nIl giorno 3 maggio."
+        )
+        continuation_prompt = generate.call_args_list[1].args[1][-1]
+        assert "Mittente: X" in continuation_prompt
+        assert "Il giorno" not in continuation_prompt.split("--- FINE")[0]
+        assert result.output_tokens == 150
+        assert "continuation" in result.timings
+
+    def test_rounds_are_capped(self):
+        """Test that generation gives up once LLM_CONTINUATION_MAX_ROUNDS is reached."""
+        # Arrange
+        generate = AsyncMock(
+            side_effect=[
+                (_response(types.FinishReason.MAX_TOKENS), TRUNCATED),
+                (
+                    _response(types.FinishReason.MAX_TOKENS),
+                    "2 – DINAMICA DEGLI EVENTI ED ACCERTAMENTI\n\nTesto\n\n"
+                    "3 – QUANTIFICAZIONE DEL DANNO\n\nEuro",
+                ),
+            ]
+        )
+
+        # Act
+        result = _run(generate, max_rounds=1)
+
+        # Assert
+        assert result.is_error
+        assert "maximum token limit" in result.text
+        assert generate.await_count == 2
+
+    def test_no_continuation_without_progress(self):
+        """Test that a section longer than the output limit is not resumed forever."""
+        # Arrange
+        generate = AsyncMock(
+            side_effect=[
+                (_response(types.FinishReason.MAX_TOKENS), TRUNCATED),
+                (
+                    _response(types.FinishReason.MAX_TOKENS),
+                    "2 – DINAMICA DEGLI EVENTI ED ACCERTAMENTI\n\nIl giorno ancora",
+                ),
+            ]
+        )
+
+        # Act
+        result = _run(generate, max_rounds=5)
+
+        # Assert
+        assert result.is_error
+        assert generate.await_count == 2
@@ -0,0 +1,214 @@
+"""
+Unit tests for claim context caching and follow-up revisions in llm_handler.
+Tests that the documents stay cached with the report, that revisions send only the delta and replace the sections they change.
+"""
+
+import asyncio
+import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from google.genai import errors as genai_errors
+from google.genai import types
+
+import llm_handler
+from core.config import settings
+
+REPORT = (
+    "Spett.le Assicurazione\n\n1 – DATI GENERALI\n\nMittente: X\n\n"
+    "4 – CAUSE DEL DANNO\n\nUmidità.\n\n5 – COMMENTO FINALE\n\nIn sintesi."
+)
+
+
+def _response(text):
+    response = MagicMock()
+    candidate = MagicMock()
+    candidate.finish_reason = types.FinishReason.STOP
+    response.candidates = [candidate]
+    response.text = text
+    response.usage_metadata = types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=1000,
+        cached_content_token_count=900,
+        candidates_token_count=10,
+    )
+    return response
+
+
+def _patches(client, generate):
+    return (
+        patch.object(settings, "GEMINI_API_KEY", "key"),
+        patch.object(settings, "LLM_CLAIM_CONTEXT_CACHE_ENABLED", True),
+        patch("llm_handler.get_gemini_client", return_value=client),
+        patch(
+            "llm_handler._get_or_create_prompt_cache",
+            AsyncMock(return_value="cachedContents/prompts"),
+        ),
+        patch("llm_handler._generate_content", generate),
+    )
+
+
+def _run(client, generate, coro_factory):
+    patches = _patches(client, generate)
+    with patches[0], patches[1], patches[2], patches[3], patches[4]:
+        return asyncio.run(coro_factory())
+
+
+class TestClaimContextCache:
+    """Test that a generated report keeps its documents cached."""
+
+    def test_generation_reads_the_documents_from_the_context_cache(self):
+        """Test that the documents are cached once and only the instruction is sent."""
+        # Arrange
+        client = MagicMock()
+        client.caches.list.return_value = []
+        client.caches.create.return_value.name = "cachedContents/claim"
+        generate = AsyncMock(return_value=(_response(REPORT), None))
+
+        # Act
+        result = _run(
+            client,
+            generate,
+            lambda: llm_handler.generate_report_from_content(
+                [{"type": "text", "content": "Testo", "filename": "a.txt"}]
+            ),
+        )
+
+        # Assert
+        assert result.text == REPORT
+        assert result.context_cache_name == "cachedContents/claim"
+        assert result.context_cache_expires_at is not None
+        contents, config = generate.call_args.args[1], generate.call_args.args[2]
+        assert len(contents) == 1 and "Testo" not in contents[0]
+        assert config.cached_content == "cachedContents/claim"
+        assert client.caches.create.call_args.kwargs["config"]["ttl"] == (
+            f"{settings.REPORT_EDIT_WINDOW_HOURS * 3600}s"
+        )
+
+    def test_same_documents_reuse_the_live_cache(self):
+        """Test that a cache holding the same bundle is extended instead of recreated."""
+        # Arrange
+        files = [{"type": "text", "content": "Testo", "filename": "a.txt"}]
+        client = MagicMock()
+        client.caches.list.return_value = []
+        client.caches.create.return_value.name = "cachedContents/claim"
+        generate = AsyncMock(return_value=(_response(REPORT), None))
+        _run(client, generate, lambda: llm_handler.generate_report_from_content(files))
+        existing = MagicMock()
+        existing.name = "cachedContents/claim"
+        existing.display_name = client.caches.create.call_args.kwargs["config"][
+            "display_name"
+        ]
+        existing.model = f"models/{settings.LLM_MODEL_NAME}"
+        client.caches.list.return_value = [existing]
+
+        # Act
+        result = _run(
+            client, generate, lambda: llm_handler.generate_report_from_content(files)
+        )
+
+        # Assert
+        assert result.context_cache_name == "cachedContents/claim"
+        assert client.caches.create.call_count == 1
+        client.caches.update.assert_called_once()
+
+
+class TestReviseReport:
+    """Test follow-up revisions of a finished report."""
+
+    def test_revision_sends_the_delta_and_replaces_changed_sections(self):
+        """Test that only the request, the report and new documents are sent."""
+        # Arrange
+        client = MagicMock()
+        answer = "4 – CAUSE DEL DANNO\n\nInfiltrazione dal tetto."
+        generate = AsyncMock(return_value=(_response(answer), None))
+        revision = llm_handler.ReportRevision(
+            "cachedContents/claim", REPORT, "Riscrivi la sezione 4"
+        )
+        new_invoice = [{"type": "text", "content": "Fattura 12", "filename": "f.txt"}]
+
+        # Act
+        result = _run(
+            client, generate, lambda: llm_handler.revise_report(revision, new_invoice)
+        )
+
+        # Assert
+        assert result.text == REPORT.replace("Umidità.", "Infiltrazione dal tetto.")
+        contents, config = generate.call_args.args[1], generate.call_args.args[2]
+        assert config.cached_content == "cachedContents/claim"
+        assert any("Fattura 12" in str(part) for part in contents)
+        assert "Riscrivi la sezione 4" in contents[-1]
+        client.caches.create.assert_not_called()
+
+    def test_expired_cache_asks_for_a_new_report(self):
+        """Test that a revision whose cache is gone fails with a clear message."""
+        # Arrange
+        client = MagicMock()
+        generate = AsyncMock(
+            side_effect=genai_errors.ClientError(
+                404, {"error": {"message": "Cached content not found"}}
+            )
+        )
+        revision = llm_handler.ReportRevision(
+            "cachedContents/claim", REPORT, "Riscrivi la sezione 4"
+        )
+
+        # Act
+        result = _run(client, generate, lambda: llm_handler.revise_report(revision))
+
+        # Assert
+        assert result.is_error
+        assert "no longer cached" in result.text
+
+    def test_answer_without_sections_is_an_error(self):
+        """Test that a revision returning no known section leaves the report alone."""
+        # Arrange
+        client = MagicMock()
+        generate = AsyncMock(return_value=(_response("Nessuna modifica."), None))
+        revision = llm_handler.ReportRevision(
+            "cachedContents/claim", REPORT, "Riscrivi la sezione 4"
+        )
+
+        # Act
+        result = _run(client, generate, lambda: llm_handler.revise_report(revision))
+
+        # Assert
+        assert result.is_error
+
+
+class TestDeleteContextCache:
+    """Test that a released context cache is only deleted if nobody reused it."""
+
+    def _delete(self, client, bound_until):
+        with patch("llm_handler.get_gemini_client", return_value=client):
+            asyncio.run(
+                llm_handler.delete_context_cache("cachedContents/claim", bound_until)
+            )
+
+    def test_cache_reused_since_is_kept(self):
+        """Test that a cache whose editing window was restarted is not deleted."""
+        # Arrange
+        bound_until = datetime.datetime(2026, 1, 1, 12, 0)
+        client = MagicMock()
+        client.caches.get.return_value.expire_time = datetime.datetime(
+            2026, 1, 2, 11, 0, tzinfo=datetime.timezone.utc
+        )
+
+        # Act
+        self._delete(client, bound_until)
+
+        # Assert
+        client.caches.delete.assert_not_called()
+
+    def test_cache_left_as_bound_is_deleted(self):
+        """Test that a cache still expiring when its last report said is deleted."""
+        # Arrange
+        bound_until = datetime.datetime(2026, 1, 1, 12, 0)
+        client = MagicMock()
+        client.caches.get.return_value.expire_time = datetime.datetime(
+            2026, 1, 1, 12, 0, tzinfo=datetime.timezone.utc
+        )
+
+        # Act
+        self._delete(client, bound_until)
+
+        # Assert
+        client.caches.delete.assert_called_once_with(name="cachedContents/claim")
@@ -0,0 +1,127 @@
+"""
+Unit tests for section-parallel report generation in llm_handler.
+Tests that sections are generated concurrently, assembled in schema order, reconciled and streamed in order.
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from google.genai import types
+
+import llm_handler
+from core.config import settings
+
+SECTIONS = {
+    "1 – DATI GENERALI": "Spett.le\n\n1 – DATI GENERALI\n\nMittente: X",
+    "2 – DINAMICA DEGLI EVENTI ED ACCERTAMENTI": (
+        "2 – DINAMICA DEGLI EVENTI ED ACCERTAMENTI\n\nDanno di EUR 1.500,00."
+    ),
+    "3 – QUANTIFICAZIONE DEL DANNO": "3 – QUANTIFICAZIONE DEL DANNO\n\nEUR 1.900,00.",
+    "4 – CAUSE DEL DANNO": "4 – CAUSE DEL DANNO\n\nUmidità.",
+    "5 – COMMENTO FINALE": "5 – COMMENTO FINALE\n\nIn sintesi.",
+    "6 – ALLEGATI": "6 – ALLEGATI\n\n- Fotografie",
+}
+
+
+def _response(text=None):
+    response = MagicMock()
+    candidate = MagicMock()
+    candidate.finish_reason = types.FinishReason.STOP
+    response.candidates = [candidate]
+    response.text = text
+    response.usage_metadata = types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=1000, candidates_token_count=10
+    )
+    return response
+
+
+async def _fake_generate(client, contents, config, on_chunk=None):
+    instruction = contents[-1]
+    if "BOZZA DEL REPORT" in instruction:
+        corrections = '[{"originale": "EUR 1.500,00", "corretto": "EUR 1.900,00"}]'
+        return _response(corrections), None
+    heading = next(h for h in SECTIONS if f'"{h}"' in instruction)
+    # Later sections finish first, to check the order of assembly and streaming
+    await asyncio.sleep(0.01 * (7 - int(heading[0])))
+    if on_chunk is None:
+        return _response(SECTIONS[heading]), None
+    await on_chunk(SECTIONS[heading])
+    return _response(), SECTIONS[heading]
+
+
+def _run(client, on_chunk=None):
+    with patch.object(settings, "GEMINI_API_KEY", "key"), patch.object(
+        settings, "LLM_SECTION_PARALLEL_ENABLED", True
+    ), patch("llm_handler.get_gemini_client", return_value=client), patch(
+        "llm_handler._get_or_create_prompt_cache",
+        AsyncMock(return_value="cachedContents/prompts"),
+    ), patch(
+        "llm_handler._generate_content", AsyncMock(side_effect=_fake_generate)
+    ) as generate:
+        result = asyncio.run(
+            llm_handler.generate_report_from_content(
+                [{"type": "text", "content": "Testo", "filename": "a.txt"}],
+                on_chunk=on_chunk,
+            )
+        )
+    return result, generate
+
+
+class TestSectionParallelGeneration:
+    """Test the section-parallel generation mode."""
+
+    def test_sections_are_assembled_in_order_and_reconciled(self):
+        """Test that the report follows the schema order and gets the consistency fixes."""
+        # Arrange
+        client = MagicMock()
+        client.caches.create.return_value.name = "cachedContents/documents"
+
+        # Act
+        result, generate = _run(client)
+
+        # Assert
+        assert not result.is_error
+        assert result.text == "\n\n".join(SECTIONS.values()).replace(
+            "EUR 1.500,00", "EUR 1.900,00"
+        )
+        assert generate.await_count == 7  # Six sections and the consistency pass
+        section_config = generate.call_args_list[0].args[2]
+        assert section_config.cached_content == "cachedContents/documents"
+        client.caches.delete.assert_called_once_with(name="cachedContents/documents")
+        assert {"sections", "consistency"} <= set(result.timings)
+
+    def test_without_document_cache_the_documents_are_sent(self):
+        """Test that sections fall back to sending the documents with the prompt cache."""
+        # Arrange
+        client = MagicMock()
+        client.caches.create.side_effect = ValueError("content too small to cache")
+
+        # Act
+        result, generate = _run(client)
+
+        # Assert
+        assert not result.is_error
+        contents = generate.call_args_list[0].args[1]
+        assert "Testo" in contents
+        assert generate.call_args_list[0].args[2].cached_content == (
+            "cachedContents/prompts"
+        )
+        client.caches.delete.assert_not_called()
+
+    def test_streamed_sections_reach_the_caller_in_order(self):
+        """Test that chunks of sections finishing early are held back until their turn."""
+        # Arrange
+        client = MagicMock()
+        client.caches.create.return_value.name = "cachedContents/documents"
+        received = []
+
+        async def on_chunk(text):
+            received.append(text)
+
+        # Act
+        with patch.object(settings, "LLM_STREAMING_ENABLED", True):
+            _run(client, on_chunk)
+
+        # Assert
+        streamed = [text for text in received if text.strip()]
+        assert streamed == list(SECTIONS.values())
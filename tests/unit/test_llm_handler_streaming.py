@@ -0,0 +1,108 @@
+"""
+Unit tests for streamed report generation in llm_handler.
+Tests that chunks reach the caller as they arrive and that partial output is kept on failure.
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, Mock
+
+import httpx
+import pytest
+
+from llm_handler import LLMStreamInterruptedError, _generate_content
+
+
+def _chunk(text):
+    chunk = Mock()
+    chunk.text = text
+    return chunk
+
+
+def _stream_of(*items):
+    async def _iterate():
+        for item in items:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    return _iterate()
+
+
+class TestGenerateContent:
+    """Test the single-call generation helper in streaming and non-streaming mode."""
+
+    def test_non_streaming_returns_response_without_text(self):
+        """Test that without a chunk callback the regular API is used."""
+        # Arrange
+        client = MagicMock()
+        response = Mock()
+        client.aio.models.generate_content = AsyncMock(return_value=response)
+
+        # Act
+        result, streamed_text = asyncio.run(
+            _generate_content(client, ["prompt"], Mock())
+        )
+
+        # Assert
+        assert result is response
+        assert streamed_text is None
+        client.aio.models.generate_content_stream.assert_not_called()
+
+    def test_streaming_forwards_chunks_in_order(self):
+        """Test that every chunk is forwarded and the full text returned."""
+        # Arrange
+        client = MagicMock()
+        last = _chunk("finale.")
+        client.aio.models.generate_content_stream = AsyncMock(
+            return_value=_stream_of(
+                _chunk("1 - DATI "), _chunk(""), _chunk("GENERALI "), last
+            )
+        )
+        received = []
+
+        async def on_chunk(text):
+            received.append(text)
+
+        # Act
+        result, streamed_text = asyncio.run(
+            _generate_content(client, ["prompt"], Mock(), on_chunk)
+        )
+
+        # Assert
+        assert received == ["1 - DATI ", "GENERALI ", "finale."]
+        assert streamed_text == "1 - DATI GENERALI finale."
+        assert result is last
+
+    def test_streaming_failure_after_output_keeps_partial_text(self):
+        """Test that a mid-stream failure surfaces the partial text instead of retrying."""
+        # Arrange
+        client = MagicMock()
+        client.aio.models.generate_content_stream = AsyncMock(
+            return_value=_stream_of(_chunk("parte "), httpx.ReadTimeout("stalled"))
+        )
+
+        async def on_chunk(text):
+            pass
+
+        # Act
+        with pytest.raises(LLMStreamInterruptedError) as exc_info:
+            asyncio.run(_generate_content(client, ["prompt"], Mock(), on_chunk))
+
+        # Assert
+        assert exc_info.value.partial_text == "parte "
+        assert isinstance(exc_info.value.cause, httpx.ReadTimeout)
+
+    def test_streaming_failure_before_output_is_reraised(self):
+        """Test that a failure before any chunk keeps the original (retriable) exception."""
+        # Arrange
+        client = MagicMock()
+        client.aio.models.generate_content_stream = AsyncMock(
+            return_value=_stream_of(httpx.ReadTimeout("stalled"))
+        )
+
+        async def on_chunk(text):
+            pass
+
+        # Act & Assert
+        with pytest.raises(httpx.ReadTimeout):
+            asyncio.run(_generate_content(client, ["prompt"], Mock(), on_chunk))
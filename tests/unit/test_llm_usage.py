@@ -0,0 +1,147 @@
+"""
+Unit tests for token and cost accounting of report generation.
+Tests that usage metadata is captured, priced with the configured table and stored on ReportLog.
+"""
+
+import asyncio
+import os
+import tempfile
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from flask import Flask
+from google.genai import types
+from sqlalchemy import inspect, text
+
+import llm_handler
+from core.config import settings
+from core.database import add_missing_columns, db
+from llm_handler import LLMGenerationResult
+
+PRICES = {"test-model": {"input": 1.0, "cached_input": 0.25, "output": 4.0}}
+
+
+def _response_with_usage(**usage):
+    response = MagicMock()
+    response.usage_metadata = types.GenerateContentResponseUsageMetadata(**usage)
+    return response
+
+
+class TestLLMGenerationResult:
+    """Test usage capture and cost calculation."""
+
+    def test_record_usage_reads_all_token_counts(self):
+        """Test that prompt, cached, output and thinking tokens are captured."""
+        # Arrange
+        result = LLMGenerationResult()
+
+        # Act
+        result.record_usage(
+            _response_with_usage(
+                prompt_token_count=12000,
+                cached_content_token_count=10000,
+                candidates_token_count=3000,
+                thoughts_token_count=500,
+            )
+        )
+
+        # Assert
+        assert result.prompt_tokens == 12000
+        assert result.cached_tokens == 10000
+        assert result.output_tokens == 3000
+        assert result.thinking_tokens == 500
+
+    def test_cost_prices_cached_tokens_separately(self):
+        """Test that cached prompt tokens are billed at the cached rate."""
+        # Arrange
+        result = LLMGenerationResult()
+        result.model = "test-model"
+        result.prompt_tokens = 1_000_000
+        result.cached_tokens = 800_000
+        result.output_tokens = 100_000
+        result.thinking_tokens = 50_000
+
+        # Act
+        with patch.object(settings, "LLM_PRICES_USD_PER_MILLION_TOKENS", PRICES):
+            cost = result.cost_usd
+
+        # Assert
+        # 200k uncached * 1.0 + 800k cached * 0.25 + 150k output/thinking * 4.0
+        assert cost == pytest.approx(0.2 + 0.2 + 0.6)
+
+    def test_cost_is_unknown_for_unpriced_model(self):
+        """Test that no cost is invented for a model missing from the price table."""
+        # Arrange
+        result = LLMGenerationResult()
+        result.model = "unknown-model"
+        result.prompt_tokens = 10
+
+        # Act & Assert
+        with patch.object(settings, "LLM_PRICES_USD_PER_MILLION_TOKENS", PRICES):
+            assert result.cost_usd is None
+
+    def test_generation_returns_usage_and_timings(self):
+        """Test that generate_report_from_content returns text, usage and stage timings."""
+        # Arrange
+        response = _response_with_usage(
+            prompt_token_count=5000,
+            cached_content_token_count=4000,
+            candidates_token_count=800,
+        )
+        generate = AsyncMock(return_value=(response, "Report"))
+
+        # Act
+        with patch.object(settings, "GEMINI_API_KEY", "key"), patch(
+            "llm_handler.get_gemini_client", return_value=MagicMock()
+        ), patch(
+            "llm_handler._get_or_create_prompt_cache",
+            AsyncMock(return_value="cachedContents/abc"),
+        ), patch(
+            "llm_handler._generate_content", generate
+        ):
+            result = asyncio.run(
+                llm_handler.generate_report_from_content(
+                    [{"type": "text", "content": "Testo", "filename": "a.txt"}]
+                )
+            )
+
+        # Assert
+        assert result.text == "Report"
+        assert not result.is_error
+        assert result.cached_tokens == 4000
+        assert result.output_tokens == 800
+        assert {"prompt_cache", "generation", "total"} <= set(result.timings)
+
+
+class TestAddMissingColumns:
+    """Test the upgrade of databases created before new ReportLog columns existed."""
+
+    def test_new_nullable_columns_are_added(self):
+        """Test that init-db adds the usage columns to an existing report_log table."""
+        # Arrange
+        with tempfile.TemporaryDirectory() as directory:
+            app = Flask(__name__)
+            app.config["SQLALCHEMY_DATABASE_URI"] = (
+                f"sqlite:///{os.path.join(directory, 'old.db')}"
+            )
+            db.init_app(app)
+            with app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        text(
+                            "CREATE TABLE report_log (id VARCHAR(36) PRIMARY KEY, "
+                            "status VARCHAR(10) NOT NULL, api_cost_usd FLOAT)"
+                        )
+                    )
+
+                # Act
+                added = add_missing_columns()
+                columns = {
+                    c["name"] for c in inspect(db.engine).get_columns("report_log")
+                }
+                db.engine.dispose()
+
+        # Assert
+        assert "report_log.prompt_tokens" in added
+        assert "report_log.status" not in added
+        assert {"cached_tokens", "output_tokens", "stage_timings"} <= columns
@@ -0,0 +1,159 @@
+"""
+Unit tests for the in-memory prompt cache handle in llm_handler.
+Tests that the cache is resolved once, shared by concurrent reports and refreshed before expiry.
+"""
+
+import asyncio
+import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+from google.genai import types
+
+import llm_handler
+from core.config import settings
+from core.prompt_config import PromptSet, prompt_registry
+
+
+@pytest.fixture(autouse=True)
+def reset_prompt_cache_handle():
+    llm_handler._invalidate_prompt_cache()
+    with patch.object(settings, "REPORT_PROMPT_CACHE_NAME", None):
+        yield
+    llm_handler._invalidate_prompt_cache()
+
+
+def _cached_content(name, display_name, hours_left):
+    return types.CachedContent(
+        name=name,
+        model=f"models/{settings.LLM_MODEL_NAME}",
+        display_name=display_name,
+        expire_time=datetime.datetime.now(datetime.timezone.utc)
+        + datetime.timedelta(hours=hours_left),
+    )
+
+
+def _client_creating(hours_left=48):
+    client = MagicMock()
+    client.caches.list.return_value = []
+
+    def _create(model, config):
+        return _cached_content("cachedContents/new", config["display_name"], hours_left)
+
+    client.caches.create.side_effect = _create
+    return client
+
+
+class TestGetOrCreatePromptCache:
+    """Test memoization and refresh of the prompt cache handle."""
+
+    def test_handle_is_reused_without_network_calls(self):
+        """Test that a fresh handle is served from memory on later reports."""
+        # Arrange
+        client = _client_creating()
+
+        async def _two_reports():
+            first = await llm_handler._get_or_create_prompt_cache(client)
+            client.reset_mock()
+            second = await llm_handler._get_or_create_prompt_cache(client)
+            return first, second
+
+        # Act
+        first, second = asyncio.run(_two_reports())
+
+        # Assert
+        assert first == second == "cachedContents/new"
+        client.caches.get.assert_not_called()
+        client.caches.list.assert_not_called()
+        client.caches.create.assert_not_called()
+
+    def test_concurrent_reports_create_a_single_cache(self):
+        """Test that simultaneous cold starts do not create duplicate caches."""
+        # Arrange
+        client = _client_creating()
+
+        async def _five_reports():
+            return await asyncio.gather(
+                *(llm_handler._get_or_create_prompt_cache(client) for _ in range(5))
+            )
+
+        # Act
+        names = asyncio.run(_five_reports())
+
+        # Assert
+        assert set(names) == {"cachedContents/new"}
+        client.caches.create.assert_called_once()
+
+    def test_existing_cache_with_matching_prompts_is_found(self):
+        """Test that a cache created by another process for the same prompts is reused."""
+        # Arrange
+        client = _client_creating()
+        display_name = llm_handler._prompt_cache_display_name(
+            llm_handler._prompt_cache_hash(prompt_registry.get_prompts())
+        )
+        client.caches.list.return_value = [
+            _cached_content("cachedContents/other", "ReportGenerationPromptsV2", 40),
+            _cached_content("cachedContents/shared", display_name, 40),
+        ]
+
+        # Act
+        name = asyncio.run(llm_handler._get_or_create_prompt_cache(client))
+
+        # Assert
+        assert name == "cachedContents/shared"
+        client.caches.create.assert_not_called()
+
+    def test_changed_prompts_get_a_new_cache(self):
+        """Test that the handle is keyed by the hash of the prompt texts."""
+        # Arrange
+        client = _client_creating()
+        original = PromptSet("Istruzioni", "Stile", "Schema")
+        edited = PromptSet("Istruzioni", "Stile", "Nuovo schema")
+        asyncio.run(llm_handler._get_or_create_prompt_cache(client, original))
+
+        # Act
+        asyncio.run(llm_handler._get_or_create_prompt_cache(client, edited))
+
+        # Assert
+        assert client.caches.create.call_count == 2
+        display_names = [
+            c.kwargs["config"]["display_name"]
+            for c in client.caches.create.call_args_list
+        ]
+        assert display_names[0] != display_names[1]
+
+    def test_cache_close_to_expiry_is_extended(self):
+        """Test that a handle inside the refresh margin gets its TTL reset."""
+        # Arrange
+        client = _client_creating(hours_left=1)
+        client.caches.update.return_value = _cached_content(
+            "cachedContents/new", "irrelevant", 48
+        )
+        asyncio.run(llm_handler._get_or_create_prompt_cache(client))
+
+        # Act
+        name = asyncio.run(llm_handler._get_or_create_prompt_cache(client))
+
+        # Assert
+        assert name == "cachedContents/new"
+        client.caches.update.assert_called()
+        assert llm_handler._prompt_cache_handle.seconds_left() > 47 * 3600
+
+    def test_current_cache_is_served_while_a_rebuild_is_in_progress(self):
+        """Test that reports are not blocked while the cache for edited prompts is built."""
+        # Arrange
+        client = _client_creating()
+        original = PromptSet("Istruzioni", "Stile", "Schema")
+        edited = PromptSet("Istruzioni", "Stile", "Nuovo schema")
+
+        async def _report_during_rebuild():
+            await llm_handler._get_or_create_prompt_cache(client, original)
+            async with llm_handler._get_prompt_cache_lock():
+                return await llm_handler._get_or_create_prompt_cache(client, edited)
+
+        # Act
+        name = asyncio.run(_report_during_rebuild())
+
+        # Assert
+        assert name == "cachedContents/new"
+        client.caches.create.assert_called_once()
@@ -0,0 +1,100 @@
+"""
+Unit tests for the prompt registry.
+Tests that prompt files are reloaded when they change and that listeners are notified.
+"""
+
+import os
+import tempfile
+from unittest.mock import Mock
+
+import pytest
+
+from core.prompt_config import PromptRegistry
+
+
+@pytest.fixture
+def registry():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {}
+        for name in ("system_instruction", "style_guide", "schema_report"):
+            paths[name] = os.path.join(directory, f"{name}.txt")
+            with open(paths[name], "w", encoding="utf-8") as f:
+                f.write(f"Testo di {name}")
+        yield PromptRegistry(paths)
+
+
+class TestPromptRegistry:
+    """Test lazy reloading and atomic writes of the prompt files."""
+
+    def test_unchanged_files_are_not_reloaded(self, registry):
+        """Test that the same snapshot is returned while the files are untouched."""
+        # Act
+        first = registry.get_prompts()
+        second = registry.get_prompts()
+
+        # Assert
+        assert first is second
+        assert first.schema_report == "Testo di schema_report"
+
+    def test_write_swaps_in_new_prompts_and_notifies(self, registry):
+        """Test that an admin edit is visible immediately and fires the listeners."""
+        # Arrange
+        listener = Mock()
+        registry.add_change_listener(listener)
+        before = registry.get_prompts()
+
+        # Act
+        registry.write("schema_report", "Nuovo schema")
+        after = registry.get_prompts()
+
+        # Assert
+        assert after.schema_report == "Nuovo schema"
+        assert after.hash != before.hash
+        listener.assert_called_once_with(after)
+        leftovers = [
+            f
+            for f in os.listdir(os.path.dirname(registry.paths["schema_report"]))
+            if f.endswith(".tmp")
+        ]
+        assert leftovers == []
+
+    def test_external_edit_is_picked_up_lazily(self, registry):
+        """Test that a file changed outside the registry is reloaded on next access."""
+        # Arrange
+        registry.get_prompts()
+        path = registry.paths["style_guide"]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("Guida di stile modificata a mano")
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        # Act
+        prompts = registry.get_prompts()
+
+        # Assert
+        assert prompts.style_guide == "Guida di stile modificata a mano"
+
+    def test_rewrite_with_same_content_does_not_notify(self, registry):
+        """Test that listeners only fire when the prompt texts actually change."""
+        # Arrange
+        listener = Mock()
+        registry.add_change_listener(listener)
+        registry.get_prompts()
+
+        # Act
+        registry.write("style_guide", "Testo di style_guide")
+
+        # Assert
+        listener.assert_not_called()
+
+    def test_write_keeps_the_file_permissions(self, registry):
+        """Test that an admin edit does not turn a shared prompt file into an owner-only one."""
+        # Arrange
+        path = registry.paths["style_guide"]
+        os.chmod(path, 0o644)
+
+        # Act
+        registry.write("style_guide", "Nuova guida")
+
+        # Assert
+        assert os.stat(path).st_mode & 0o777 == 0o644
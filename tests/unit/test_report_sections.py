@@ -0,0 +1,203 @@
+"""
+Unit tests for the report section helpers.
+Tests heading discovery in the schema, the cut before a truncated section and the stitching of a continuation.
+"""
+
+from core.prompt_config import SCHEMA_REPORT
+from report_sections import (
+    apply_corrections,
+    continuation_instruction,
+    parse_corrections,
+    replace_sections,
+    section_headings,
+    section_instruction,
+    split_before_last_section,
+    split_sections,
+    stitch,
+    trim_section,
+)
+
+HEADINGS = ["1 – DATI GENERALI", "2 – DINAMICA DEGLI EVENTI", "3 – CAUSE DEL DANNO"]
+
+
+class TestSectionHeadings:
+    """Test that the numbered headings are read from the schema."""
+
+    def test_headings_of_the_shipped_schema(self):
+        """Test that the six sections of SCHEMA_REPORT are found in order."""
+        # Act
+        headings = section_headings(SCHEMA_REPORT)
+
+        # Assert
+        assert headings[0] == "1 – DATI GENERALI"
+        assert headings[-1] == "6 – ALLEGATI"
+        assert len(headings) == 6
+
+    def test_numbered_rules_are_not_headings(self):
+        """Test that numbered formatting rules and inline mentions are ignored."""
+        # Arrange
+        schema = (
+            '1.  REGOLA: usa i titoli (es. "1 – DATI GENERALI")\n\n'
+            "1 – DATI GENERALI\n\nTesto\n\n2 – COMMENTO FINALE\n"
+        )
+
+        # Act & Assert
+        assert section_headings(schema) == ["1 – DATI GENERALI", "2 – COMMENTO FINALE"]
+
+
+class TestSplitAndStitch:
+    """Test the cut of a truncated report and the join of its continuation."""
+
+    def test_split_keeps_the_complete_sections(self):
+        """Test that the report is cut before the heading of the section being written."""
+        # Arrange
+        report = (
+            "Spett.le\n\n1 – DATI GENERALI\n\nMittente: X\n\n"
+            "2 - Dinamica degli eventi\n\nIl giorno"
+        )
+
+        # Act
+        prefix, heading = split_before_last_section(report, HEADINGS)
+
+        # Assert
+        assert heading == "2 – DINAMICA DEGLI EVENTI"
+        assert prefix.endswith("Mittente: X\n\n")
+
+    def test_split_without_sections(self):
+        """Test that a report cut before its first section has no resume heading."""
+        # Act
+        prefix, heading = split_before_last_section("Spett.le\nDitta", HEADINGS)
+
+        # Assert
+        assert heading is None
+        assert prefix == "Spett.le\nDitta"
+
+    def test_stitch_drops_a_preamble_before_the_heading(self):
+        """Test that text written before the resumed heading is not kept."""
+        # Arrange
+        continuation = "Ecco il seguito:\n\n2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3"
+
+        # Act
+        report = stitch(
+            "1 – DATI GENERALI\n\nMittente: X\n\n", continuation, HEADINGS[1]
+        )
+
+        # Assert
+        assert report == (
+            "1 – DATI GENERALI\n\nMittente: X\n\n2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3"
+        )
+
+    def test_instruction_carries_the_partial_report(self):
+        """Test that the continuation prompt includes the kept text and the heading."""
+        # Act
+        instruction = continuation_instruction("1 – DATI GENERALI\n\nX", HEADINGS[1])
+
+        # Assert
+        assert "1 – DATI GENERALI\n\nX" in instruction
+        assert '"2 – DINAMICA DEGLI EVENTI"' in instruction
+
+
+class TestSectionParallelHelpers:
+    """Test the helpers of section-parallel generation."""
+
+    def test_trim_section_keeps_only_its_section(self):
+        """Test that a preamble and text of the next section are dropped."""
+        # Arrange
+        text = (
+            "Certo, ecco la sezione.\n\n2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3\n\n"
+            "3 – CAUSE DEL DANNO\n\nUmidità"
+        )
+
+        # Act
+        section = trim_section(text, HEADINGS, 1)
+
+        # Assert
+        assert section == "2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3"
+
+    def test_trim_section_adds_a_missing_heading(self):
+        """Test that a section written without its title gets it back."""
+        # Act
+        section = trim_section("Umidità nel vano di carico.", HEADINGS, 2)
+
+        # Assert
+        assert section == "3 – CAUSE DEL DANNO\n\nUmidità nel vano di carico."
+
+    def test_instruction_names_the_section_and_where_to_stop(self):
+        """Test that a section prompt bounds the section by the next heading."""
+        # Act
+        instruction = section_instruction(HEADINGS, 1)
+
+        # Assert
+        assert '"2 – DINAMICA DEGLI EVENTI"' in instruction
+        assert 'Fermati prima del titolo "3 – CAUSE DEL DANNO"' in instruction
+
+    def test_corrections_are_applied_only_when_unambiguous(self):
+        """Test that a correction whose original text is repeated is skipped."""
+        # Arrange
+        report = "Danno: EUR 1.900,00. Totale EUR 1.500,00. Data 3 maggio, 3 maggio."
+        raw = (
+            '```json\n[{"originale": "EUR 1.500,00", "corretto": "EUR 1.900,00"},'
+            ' {"originale": "3 maggio", "corretto": "4 maggio"}, "rumore"]\n```'
+        )
+
+        # Act
+        corrections = parse_corrections(raw)
+        corrected, applied = apply_corrections(report, corrections)
+
+        # Assert
+        assert len(corrections) == 2
+        assert applied == 1
+        assert corrected == (
+            "Danno: EUR 1.900,00. Totale EUR 1.900,00. Data 3 maggio, 3 maggio."
+        )
+
+    def test_invalid_answer_yields_no_corrections(self):
+        """Test that an answer that is not a JSON array is ignored."""
+        # Act & Assert
+        assert parse_corrections("Nessuna correzione necessaria.") == []
+        assert parse_corrections('{"originale": "a"}') == []
+
+
+class TestReplaceSections:
+    """Test that the sections returned by a revision replace those of the report."""
+
+    REPORT = (
+        "Spett.le Assicurazione\n\n1 – DATI GENERALI\n\nMittente: X\n\n"
+        "2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3\n\n3 – CAUSE DEL DANNO\n\nUmidità"
+    )
+
+    def test_split_keeps_the_header_block_apart(self):
+        """Test that the text before section 1 is returned as the preamble."""
+        # Act
+        preamble, sections = split_sections(self.REPORT, HEADINGS)
+
+        # Assert
+        assert preamble.strip() == "Spett.le Assicurazione"
+        assert [heading for heading, _ in sections] == HEADINGS
+        assert sections[1][1] == "2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3"
+
+    def test_only_the_returned_sections_change(self):
+        """Test that a revised section replaces its counterpart and the rest is kept."""
+        # Arrange
+        revised = "Ecco la sezione.\n\n2 – DINAMICA DEGLI EVENTI\n\nIl giorno 4"
+
+        # Act
+        report, replaced = replace_sections(self.REPORT, revised, HEADINGS)
+
+        # Assert
+        assert replaced == ["2 – DINAMICA DEGLI EVENTI"]
+        assert report == self.REPORT.replace("Il giorno 3", "Il giorno 4")
+
+    def test_a_missing_section_is_inserted_in_schema_order(self):
+        """Test that a section absent from the report is added at its place."""
+        # Arrange
+        report = self.REPORT.replace("2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3\n\n", "")
+
+        # Act
+        revised_report, replaced = replace_sections(
+            report, "2 – DINAMICA DEGLI EVENTI\n\nIl giorno 3", HEADINGS
+        )
+
+        # Assert
+        assert replaced == ["2 – DINAMICA DEGLI EVENTI"]
+        assert revised_report == self.REPORT
@@ -0,0 +1,176 @@
+"""
+Unit tests for the retry and circuit-breaking layer of Gemini calls.
+Tests the backoff attempts, the retry budget and the breaker's open, fail-fast and half-open states.
+"""
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from core.config import settings
+from core.resilience import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    ResiliencePolicy,
+    RetryBudget,
+)
+
+
+def _is_transient(e):
+    return isinstance(
+        e, (google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests)
+    )
+
+
+class _Upstream:
+    """Fails with the queued errors, then answers "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def fast_settings():
+    with patch.object(settings, "LLM_API_RETRY_WAIT_SECONDS", 0), patch.object(
+        settings, "LLM_API_RETRY_MAX_WAIT_SECONDS", 0
+    ), patch.object(settings, "LLM_API_RETRY_ATTEMPTS", 3), patch.object(
+        settings, "CIRCUIT_BREAKER_FAILURE_THRESHOLD", 2
+    ), patch.object(
+        settings, "CIRCUIT_BREAKER_RESET_SECONDS", 30
+    ):
+        yield
+
+
+class TestRetries:
+    """Test which errors are retried and how many times."""
+
+    def test_transient_errors_are_retried(self, fast_settings):
+        """Test that a call succeeds after a transient failure."""
+        # Arrange
+        policy = ResiliencePolicy("generate")
+        upstream = _Upstream(google_exceptions.ServiceUnavailable("down"))
+
+        # Act
+        result = asyncio.run(policy.call(upstream, _is_transient))
+
+        # Assert
+        assert result == "ok"
+        assert upstream.calls == 2
+        assert policy.breaker.state == STATE_CLOSED
+
+    def test_non_transient_errors_are_not_retried(self, fast_settings):
+        """Test that a bad request is raised at once and does not trip the breaker."""
+        # Arrange
+        policy = ResiliencePolicy("generate")
+        upstream = _Upstream(*[google_exceptions.BadRequest("bad")] * 3)
+
+        # Act & Assert
+        for _ in range(3):
+            with pytest.raises(google_exceptions.BadRequest):
+                asyncio.run(policy.call(upstream, _is_transient))
+        assert upstream.calls == 3
+        assert policy.breaker.state == STATE_CLOSED
+
+    def test_exhausted_budget_stops_retries(self, fast_settings):
+        """Test that no retry is made once the retry budget is spent."""
+        # Arrange
+        with patch.object(settings, "CIRCUIT_BREAKER_FAILURE_THRESHOLD", 100):
+            policy = ResiliencePolicy("upload")
+        policy.budget = RetryBudget(ratio=0.0, min_per_minute=1)
+        upstream = _Upstream(*[google_exceptions.ServiceUnavailable("down")] * 10)
+
+        # Act
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            asyncio.run(policy.call(upstream, _is_transient))
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            asyncio.run(policy.call(upstream, _is_transient))
+
+        # Assert
+        assert upstream.calls == 3  # One retry for the first call, none for the second
+
+    def test_rate_limits_do_not_trip_the_breaker(self, fast_settings):
+        """Test that 429 errors are retried without opening the breaker."""
+        # Arrange
+        policy = ResiliencePolicy("generate")
+        upstream = _Upstream(*[google_exceptions.TooManyRequests("slow down")] * 3)
+
+        # Act
+        with pytest.raises(google_exceptions.TooManyRequests):
+            asyncio.run(policy.call(upstream, _is_transient))
+
+        # Assert
+        assert upstream.calls == 3
+        assert policy.breaker.state == STATE_CLOSED
+
+
+class TestCircuitBreaker:
+    """Test the breaker's transitions."""
+
+    def test_breaker_opens_and_fails_fast(self, fast_settings):
+        """Test that consecutive failures open the breaker and later calls are not made."""
+        # Arrange
+        policy = ResiliencePolicy("generate")
+        upstream = _Upstream(*[google_exceptions.ServiceUnavailable("down")] * 3)
+
+        # Act
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(policy.call(upstream, _is_transient))
+        with pytest.raises(CircuitOpenError) as excinfo:
+            asyncio.run(policy.call(upstream, _is_transient))
+
+        # Assert
+        assert upstream.calls == 2
+        assert policy.breaker.state == STATE_OPEN
+        assert 0 < excinfo.value.retry_in <= 30
+        assert policy.breaker.snapshot()["last_failure"].startswith(
+            "ServiceUnavailable"
+        )
+
+    def test_half_open_probe_closes_the_breaker(self):
+        """Test that a successful probe after the reset period closes the breaker."""
+        # Arrange
+        breaker = CircuitBreaker("upload", failure_threshold=1, reset_seconds=0.1)
+        breaker.before_call()
+        breaker.record_failure(RuntimeError("down"))
+        assert breaker.state == STATE_OPEN
+
+        # Act
+        asyncio.run(asyncio.sleep(0.15))
+        breaker.before_call()  # The probe
+
+        # Assert
+        assert breaker.state == STATE_HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()  # Only one probe at a time
+        breaker.record_success()
+        assert breaker.state == STATE_CLOSED
+
+    def test_failed_probe_reopens_the_breaker(self):
+        """Test that a failing probe opens the breaker for another reset period."""
+        # Arrange
+        breaker = CircuitBreaker("upload", failure_threshold=3, reset_seconds=0.1)
+        for _ in range(3):
+            breaker.before_call()
+            breaker.record_failure(RuntimeError("down"))
+        asyncio.run(asyncio.sleep(0.15))
+        breaker.before_call()
+
+        # Act
+        breaker.record_failure(RuntimeError("still down"))
+
+        # Assert
+        assert breaker.state == STATE_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
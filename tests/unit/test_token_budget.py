@@ -0,0 +1,149 @@
+"""
+Unit tests for the token budget planner.
+Tests token estimates for text and vision parts and the fair allocation of the context window.
+"""
+
+from unittest.mock import patch
+
+import token_budget
+from core.config import settings
+
+
+def _text(filename, chars, filetype=None):
+    return {
+        "type": "text",
+        "filename": filename,
+        "content": "x" * chars,
+        "source": "file content",
+        "original_filetype": filetype,
+    }
+
+
+class TestEstimates:
+    """Test the token estimates of single parts."""
+
+    def test_pdf_costs_one_tile_per_page(self):
+        """Test that a PDF is estimated from its page count."""
+        # Arrange
+        part = {"type": "vision", "mime_type": "application/pdf", "page_count": 12}
+
+        # Act
+        tokens = token_budget.estimate_vision_tokens(part)
+
+        # Assert
+        assert tokens == 12 * token_budget.TOKENS_PER_VISION_TILE
+
+    def test_large_image_is_estimated_in_tiles(self):
+        """Test that small images cost one tile and large ones one per 768px tile."""
+        # Arrange
+        small = {
+            "type": "vision",
+            "mime_type": "image/png",
+            "width": 300,
+            "height": 200,
+        }
+        large = {
+            "type": "vision",
+            "mime_type": "image/jpeg",
+            "width": 2000,
+            "height": 1000,
+        }
+
+        # Act
+        small_tokens = token_budget.estimate_vision_tokens(small)
+        large_tokens = token_budget.estimate_vision_tokens(large)
+
+        # Assert
+        assert small_tokens == token_budget.TOKENS_PER_VISION_TILE
+        assert large_tokens == 3 * 2 * token_budget.TOKENS_PER_VISION_TILE
+
+
+class TestAllocate:
+    """Test the weighted max-min allocation."""
+
+    def test_small_demands_are_met_and_leftover_is_shared(self):
+        """Test that a demand under its share is granted and the rest goes to the others."""
+        # Act
+        allocations = token_budget.allocate([100, 1000, 1000], [1, 1, 1], 1000)
+
+        # Assert
+        assert allocations == [100, 450, 450]
+
+    def test_weights_decide_the_split(self):
+        """Test that a heavier part gets a proportionally larger share."""
+        # Act
+        allocations = token_budget.allocate([1000, 1000], [3, 1], 800)
+
+        # Assert
+        assert allocations == [600, 200]
+
+
+class TestPlanContext:
+    """Test planning of a whole upload."""
+
+    def test_everything_fits_untouched(self):
+        """Test that parts within the budget are returned unchanged and without messages."""
+        # Arrange
+        parts = [_text("a.txt", 400), _text("b.txt", 400)]
+
+        # Act
+        planned, messages = token_budget.plan_context(parts, budget_tokens=1000)
+
+        # Assert
+        assert planned == parts
+        assert messages == []
+
+    def test_late_file_is_not_starved_by_an_early_one(self):
+        """Test that a large first file no longer consumes the budget of the ones after it."""
+        # Arrange
+        parts = [_text("huge.txt", 40000), _text("small.txt", 800)]
+
+        # Act
+        with patch.object(settings, "TOKEN_ESTIMATE_CHARS_PER_TOKEN", 4.0):
+            planned, messages = token_budget.plan_context(parts, budget_tokens=2000)
+
+        # Assert
+        assert planned[1]["content"] == parts[1]["content"]
+        assert planned[0]["content"].endswith(token_budget.TRUNCATION_NOTICE)
+        assert len(planned[0]["content"]) <= (2000 - 200) * 4
+        assert len(messages) == 1
+        assert "huge.txt" in messages[0][0]
+
+    def test_vision_cost_is_reserved_before_text(self):
+        """Test that PDF pages reduce the budget left for text."""
+        # Arrange
+        pdf = {
+            "type": "vision",
+            "mime_type": "application/pdf",
+            "filename": "polizza.pdf",
+            "page_count": 3,
+        }
+        parts = [pdf, _text("notes.txt", 4000)]
+
+        # Act
+        with patch.object(settings, "TOKEN_ESTIMATE_CHARS_PER_TOKEN", 4.0):
+            planned, messages = token_budget.plan_context(parts, budget_tokens=1000)
+
+        # Assert
+        assert planned[0] is pdf
+        text_budget = 1000 - 3 * token_budget.TOKENS_PER_VISION_TILE
+        assert len(planned[1]["content"]) == text_budget * 4
+        assert "notes.txt" in messages[0][0]
+
+    def test_text_without_room_is_skipped(self):
+        """Test that a text part left with less than a useful share is dropped."""
+        # Arrange
+        pdf = {
+            "type": "vision",
+            "mime_type": "application/pdf",
+            "filename": "perizia.pdf",
+            "page_count": 4,
+        }
+        parts = [pdf, _text("notes.txt", 4000)]
+
+        # Act
+        planned, messages = token_budget.plan_context(parts, budget_tokens=1050)
+
+        # Assert
+        assert planned == [pdf]
+        assert messages[0][0].startswith("Skipped content from notes.txt")
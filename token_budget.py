@@ -0,0 +1,209 @@
+"""Token budget planning for the content sent to the LLM.
+
+Instead of truncating whichever file happens to come last once a character limit
+is hit, the planner estimates the tokens of every part of an upload (text, PDF
+pages, images) and shares the model's context window across all of them before
+anything is sent. Text parts get a weighted fair share (email bodies weigh more
+than spreadsheets, see TOKEN_BUDGET_PRIORITY_WEIGHTS); parts that fit in their
+share are kept whole and the unused share is redistributed to the others.
+"""
+
+import logging
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from core.config import settings
+from core.prompt_config import prompt_registry
+
+logger = logging.getLogger(__name__)
+
+# Gemini bills each PDF page, and each image of up to 384x384 pixels, as 258
+# tokens. Larger images are cut into 768x768 tiles of 258 tokens each.
+TOKENS_PER_VISION_TILE = 258
+SMALL_IMAGE_MAX_SIDE = 384
+IMAGE_TILE_SIDE = 768
+
+# Texts that would get less than this are skipped rather than cut to a stub.
+MIN_USEFUL_TEXT_TOKENS = 50
+
+TRUNCATION_NOTICE = (
+    "\n\n[AVVISO: contenuto troncato per rispettare il limite di contesto del modello]"
+)
+
+
+def estimate_text_tokens(text: str) -> int:
+    return math.ceil(len(text) / settings.TOKEN_ESTIMATE_CHARS_PER_TOKEN)
+
+
+def _pdf_page_count(part: Dict[str, Any]) -> int:
+    if part.get("page_count"):
+        return int(part["page_count"])
+    try:
+        with fitz.open(part["path"]) as doc:
+            return doc.page_count
+    except Exception as e:
+        logger.warning(f"Could not count pages of {part.get('filename')}: {e}")
+        return 1
+
+
+def _image_size(part: Dict[str, Any]) -> Tuple[int, int]:
+    if part.get("width") and part.get("height"):
+        return int(part["width"]), int(part["height"])
+    try:
+        with Image.open(part["path"]) as img:
+            return img.size
+    except Exception as e:
+        logger.warning(f"Could not read the size of {part.get('filename')}: {e}")
+        return IMAGE_TILE_SIDE, IMAGE_TILE_SIDE
+
+
+def estimate_vision_tokens(part: Dict[str, Any]) -> int:
+    """Estimates the tokens of a file sent to the model as a document or image."""
+    if part.get("mime_type") == "application/pdf":
+        return _pdf_page_count(part) * TOKENS_PER_VISION_TILE
+    width, height = _image_size(part)
+    if width <= SMALL_IMAGE_MAX_SIDE and height <= SMALL_IMAGE_MAX_SIDE:
+        return TOKENS_PER_VISION_TILE
+    tiles = math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE)
+    return tiles * TOKENS_PER_VISION_TILE
+
+
+def _priority_weight(part: Dict[str, Any]) -> float:
+    filetype = part.get("original_filetype")
+    if not filetype:
+        _, ext = os.path.splitext(part.get("filename", ""))
+        filetype = ext.lstrip(".").lower()
+    return settings.TOKEN_BUDGET_PRIORITY_WEIGHTS.get(filetype, 1.0)
+
+
+def available_input_tokens() -> int:
+    """Tokens left for the documents once the prompts and a safety margin are reserved."""
+    prompts = prompt_registry.get_prompts()
+    prompt_tokens = sum(
+        estimate_text_tokens(text)
+        for text in (
+            prompts.system_instruction,
+            prompts.style_guide,
+            prompts.schema_report,
+        )
+    )
+    usable = int(
+        settings.LLM_CONTEXT_WINDOW_TOKENS * (1 - settings.TOKEN_BUDGET_SAFETY_MARGIN)
+    )
+    return max(usable - prompt_tokens, 0)
+
+
+def allocate(needs: List[int], weights: List[float], budget: int) -> List[int]:
+    """Splits ``budget`` across demands by weighted max-min fairness.
+
+    Every demand that fits in its weighted share of what is left is granted in
+    full; the rest share the remainder in proportion to their weights.
+    """
+    allocations = [0] * len(needs)
+    active = [i for i, need in enumerate(needs) if need > 0]
+    remaining = budget
+    while active and remaining > 0:
+        total_weight = sum(weights[i] for i in active)
+        satisfied = [
+            i for i in active if needs[i] <= remaining * weights[i] / total_weight
+        ]
+        if not satisfied:
+            for i in active:
+                allocations[i] = int(remaining * weights[i] / total_weight)
+            break
+        for i in satisfied:
+            allocations[i] = needs[i]
+            remaining -= needs[i]
+            active.remove(i)
+    return allocations
+
+
+def plan_context(
+    parts: List[Dict[str, Any]], budget_tokens: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """Fits the processed parts of an upload into the model's input budget.
+
+    Vision parts cannot be shortened, so their cost is reserved first (dropping
+    the last ones only if they alone exceed the budget). The remaining tokens
+    are allocated across text parts with ``allocate``.
+
+    Returns:
+        The parts to send, in their original order, and flash messages about
+        every part that was truncated or left out.
+    """
+    if budget_tokens is None:
+        budget_tokens = available_input_tokens()
+    planned: List[Optional[Dict[str, Any]]] = list(parts)
+    messages: List[Tuple[str, str]] = []
+
+    vision_indexes = [i for i, p in enumerate(parts) if p.get("type") == "vision"]
+    vision_costs = {i: estimate_vision_tokens(parts[i]) for i in vision_indexes}
+    vision_total = sum(vision_costs.values())
+    for i in reversed(vision_indexes):
+        if vision_total <= budget_tokens:
+            break
+        filename = parts[i].get("filename", "file")
+        logger.warning(f"Omitting {filename}: documents exceed the context budget.")
+        messages.append(
+            (
+                f"{filename} was not sent for analysis because the documents exceed the model's context limit.",
+                "warning",
+            )
+        )
+        planned[i] = {
+            "type": "error",
+            "filename": filename,
+            "message": "Documento omesso: supera il limite di contesto del modello",
+        }
+        vision_total -= vision_costs[i]
+
+    text_indexes = [
+        i for i, p in enumerate(parts) if p.get("type") == "text" and p.get("content")
+    ]
+    needs = [estimate_text_tokens(parts[i]["content"]) for i in text_indexes]
+    weights = [_priority_weight(parts[i]) for i in text_indexes]
+    allocations = allocate(needs, weights, max(budget_tokens - vision_total, 0))
+
+    for i, need, granted in zip(text_indexes, needs, allocations):
+        if granted >= need:
+            continue
+        part = parts[i]
+        description = (
+            f"{part.get('filename', 'file')} ({part.get('source', 'file content')})"
+        )
+        if granted < MIN_USEFUL_TEXT_TOKENS:
+            logger.warning(f"Skipping text from {description}: no context budget left.")
+            messages.append(
+                (
+                    f"Skipped content from {description} as the model's context limit was reached.",
+                    "warning",
+                )
+            )
+            planned[i] = None
+            continue
+        keep_chars = int(granted * settings.TOKEN_ESTIMATE_CHARS_PER_TOKEN) - len(
+            TRUNCATION_NOTICE
+        )
+        logger.warning(
+            f"Truncating text from {description} from ~{need} to ~{granted} tokens."
+        )
+        messages.append(
+            (
+                f"Content from {description} was truncated to fit the model's context limit.",
+                "warning",
+            )
+        )
+        planned[i] = {
+            **part,
+            "content": part["content"][:keep_chars] + TRUNCATION_NOTICE,
+        }
+
+    logger.info(
+        f"Planned context: ~{vision_total} vision tokens and ~{sum(allocations)} text tokens "
+        f"of a {budget_tokens} token budget."
+    )
+    return [p for p in planned if p is not None], messages